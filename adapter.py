@@ -1,13 +1,22 @@
-import requests
 import json
 import re
 import os
 import argparse
-from py2neo import Graph, Node, Relationship, NodeMatcher, RelationshipMatcher
+from py2neo import Graph, Node, Relationship, NodeMatcher
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from course_format_detector import get_course_format
 from extract_concepts import extract_course_concepts
+from llm_client import chat_completion, configure_cache, LLMError, StopStream
+from run_journal import RunJournal, ANALYZED, PERSISTED
+from neo4j_schema import warn_if_schema_missing, updated_at_now
+from mention_index import MentionIndex
+from chapter_chunker import split_into_windows
+from json_stream import JSONStreamParser
+from analysis_schema import (CHAPTER_ANALYSIS_SCHEMA, CONCEPT_SCHEMA, RELATIONSHIP_SCHEMA, SchemaError,
+                             response_format, validate, parse_chapter_analysis)
+import metrics
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -19,6 +28,20 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 AI_MODEL = os.getenv("AI_MODEL", "x-ai/grok-2-1212")
+CHAPTER_CONCURRENCY = int(os.getenv("CHAPTER_CONCURRENCY", "4"))
+GROUP_CONCURRENCY = int(os.getenv("GROUP_CONCURRENCY", "4"))
+# Размер части главы в токенах: более длинные главы анализируются по частям
+CHAPTER_WINDOW_TOKENS = int(os.getenv("CHAPTER_WINDOW_TOKENS", "2000"))
+# Максимальное количество понятий в одном запросе анализа главы и группы понятий
+CONCEPTS_PER_CALL = int(os.getenv("CONCEPTS_PER_CALL", "30"))
+CONCEPTS_PER_GROUP = int(os.getenv("CONCEPTS_PER_GROUP", "10"))
+# Ограничения на базовые связи RELATES_TO, которые добавляются, если модель вернула мало связей
+EXTRA_RELATIONSHIPS_MAX_CONCEPTS = int(os.getenv("EXTRA_RELATIONSHIPS_MAX_CONCEPTS", "10"))
+EXTRA_RELATIONSHIPS_MAX_PAIRS = int(os.getenv("EXTRA_RELATIONSHIPS_MAX_PAIRS", "45"))
+
+# Ответ анализа главы запрашивается по JSON-схеме; ответ, не прошедший проверку, повторяется
+CHAPTER_RESPONSE_FORMAT = response_format("chapter_analysis", CHAPTER_ANALYSIS_SCHEMA)
+SCHEMA_MAX_ATTEMPTS = 3
 
 # Проверка наличия необходимых переменных
 if not OPENROUTER_API_KEY:
@@ -52,7 +75,86 @@ def split_into_chapters(text):
     
     return result
 
-# Функция для анализа главы с помощью Grok через OpenRouter
+def make_stream_parser(expected_concepts):
+    """
+    Парсер ответа модели по мере генерации: собирает готовые объекты понятий и связей.
+    Если модель выдает намного больше понятий, чем запрошено (зациклилась), ответ обрывается
+    """
+    limit = max(expected_concepts * 2, expected_concepts + 10)
+    parser = JSONStreamParser(("concepts", "relationships"))
+    
+    def on_item(key, item):
+        if key == "concepts" and parser.count("concepts") > limit:
+            print(f"Модель вернула больше {limit} понятий, прерываем ответ")
+            raise StopStream()
+    
+    parser.on_item = on_item
+    return parser
+
+def streamed_analysis(parser):
+    """
+    Анализ из понятий и связей, которые были полностью получены до обрыва ответа
+    (max_tokens или прерывание). Элементы, не соответствующие схеме, отбрасываются.
+    Возвращает None, если готовых понятий нет
+    """
+    if parser is None:
+        return None
+    concepts = [c for c in parser.items["concepts"] if not validate(c, CONCEPT_SCHEMA) and c["name"].strip()]
+    relationships = [r for r in parser.items["relationships"] if not validate(r, RELATIONSHIP_SCHEMA)]
+    if not concepts:
+        return None
+    print(f"Используем {len(concepts)} понятий и {len(relationships)} связей, "
+          f"полученных до обрыва ответа")
+    metrics.count("json.salvaged")
+    return {
+        "main_ideas": [],
+        "concepts": concepts,
+        "relationships": relationships
+    }
+
+def request_chapter_analysis(prompt, expected_concepts, label):
+    """
+    Запрашивает анализ главы или группы понятий по JSON-схеме и возвращает проверенный результат.
+
+    Повторяется только ответ, не прошедший проверку схемы: сразу, без паузы и без кеша.
+    Если ответ оборван, используются понятия и связи, полученные целиком.
+    Возвращает None, если ни одна попытка не прошла проверку; LLMError пробрасывается
+    """
+    for attempt in range(SCHEMA_MAX_ATTEMPTS):
+        # При повторной попытке не берем ответ из кеша: закешированный ответ не прошел проверку
+        stream_parser = make_stream_parser(expected_concepts)
+        content = chat_completion(prompt, max_tokens=8000, temperature=0.7, timeout=300,
+                                  refresh=attempt > 0, stream_handler=stream_parser,
+                                  response_format=CHAPTER_RESPONSE_FORMAT)
+        with metrics.span("json.parse"):
+            try:
+                return parse_chapter_analysis(content)
+            except SchemaError as e:
+                metrics.count("json.schema_violations")
+                print(f"Ответ для {label} не соответствует схеме: {str(e)}")
+                salvaged = streamed_analysis(stream_parser)
+        if salvaged is not None:
+            return salvaged
+        if attempt < SCHEMA_MAX_ATTEMPTS - 1:
+            print(f"Повторяем запрос для {label} (попытка {attempt + 2} из {SCHEMA_MAX_ATTEMPTS})")
+    metrics.count("json.failed")
+    return None
+
+def placeholder_analysis(main_idea, reason, concepts):
+    """Базовый шаблон анализа главы, если модель не вернула результат (первые 5 понятий из саммари)"""
+    return {
+        "main_ideas": [main_idea],
+        "concepts": [
+            {
+                "name": concept_name,
+                "definition": f"Определение не получено {reason}",
+                "example": f"Пример не получен {reason}",
+                "questions": [f"Вопросы не сформулированы {reason}"]
+            } for concept_name in concepts[:5]
+        ],
+        "relationships": []
+    }
+
 def analyze_chapter_with_grok(chapter):
     # Сначала ищем "Основные понятия" или "Саммари раздела" с перечислением понятий
     concepts_from_summary = []
@@ -99,10 +201,21 @@ def analyze_chapter_with_grok(chapter):
         print(f"Слишком много понятий ({len(concepts_from_summary)}), вероятно дубликаты. Уникальных: {len(unique_concepts)}")
         concepts_from_summary = unique_concepts
     
-    # Проверяем количество понятий и размер главы
-    if len(concepts_from_summary) > 30 or len(chapter['content']) > 8000:
+    # Проверяем количество понятий и размер главы: если глава не помещается в одно окно, анализируем ее по частям
+    if len(concepts_from_summary) > CONCEPTS_PER_CALL or len(split_into_windows(chapter['content'], CHAPTER_WINDOW_TOKENS)) > 1:
         return analyze_large_chapter(chapter, concepts_from_summary)
     
+    # Генерируем дополнительные связи между понятиями, если их мало
+    return generate_additional_relationships(analyze_chapter_single_call(chapter, concepts_from_summary))
+
+def analyze_chapter_single_call(chapter, concepts_from_summary, placeholder_on_error=True):
+    """
+    Анализирует главу или часть главы одним запросом и возвращает разобранный ответ модели.
+    При ошибке возвращает базовый шаблон, а если placeholder_on_error=False - None (так анализируются
+    части главы: текст ошибки не должен попасть в главные мысли объединенного результата).
+    Дополнительные связи RELATES_TO здесь не добавляются: для главы, анализируемой по частям,
+    они добавляются один раз к объединенному результату
+    """
     # Выводим список первых 10 понятий для проверки
     if concepts_from_summary:
         print("Примеры найденных понятий:", concepts_from_summary[:10])
@@ -110,15 +223,15 @@ def analyze_chapter_with_grok(chapter):
     # Формируем промпт для Grok с учетом найденных понятий
     all_found_concepts = []  # Список всех понятий для сохранения
     
-    # Ограничиваем размер текста главы до 5000 символов для надежности
-    chapter_content = chapter['content'][:5000]
+    # Глава целиком помещается в бюджет токенов одного запроса
+    chapter_content = chapter['content']
     
     prompt = f"""
 Проанализируй следующую главу из курса по системному мышлению:
 
 Название: {chapter['title']}
 
-Содержание (первые 5000 символов):
+Содержание:
 {chapter_content}
 
 """
@@ -129,7 +242,7 @@ def analyze_chapter_with_grok(chapter):
         all_found_concepts = concepts_from_summary.copy()
         
         # Для промпта используем ограниченное количество понятий (API-запрос имеет ограничения)
-        concepts_to_analyze = concepts_from_summary[:30] if len(concepts_from_summary) > 30 else concepts_from_summary
+        concepts_to_analyze = concepts_from_summary[:CONCEPTS_PER_CALL]
         
         prompt += f"""
 В этой главе определены следующие основные понятия: {', '.join(concepts_to_analyze)}.
@@ -191,230 +304,51 @@ def analyze_chapter_with_grok(chapter):
 """
 
     try:
-        # Добавляем повторные попытки в случае ошибки
-        max_attempts = 3
-        current_attempt = 0
-        
-        while current_attempt < max_attempts:
-            try:
-                current_attempt += 1
-                print(f"Попытка {current_attempt} из {max_attempts} запроса к API")
-                
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://adapter-course.ru",
-                        "X-Title": "Adapter Course",
-                    },
-                    json={
-                        "model": AI_MODEL,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": 8000,
-                        "temperature": 0.7
-                    },
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result['choices'][0]['message']['content']
-                    
-                    # Извлекаем JSON из ответа
-                    try:
-                        # Попробуем найти JSON в ответе
-                        json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                        if json_match:
-                            content = json_match.group(1)
-                        
-                        # Попытка напрямую распарсить JSON
-                        try:
-                            parsed_data = json.loads(content)
-                        except json.JSONDecodeError as e:
-                            # Если не удалось распарсить целиком, попробуем найти самый большой валидный JSON
-                            print(f"Ошибка при парсинге JSON: {str(e)}. Пытаемся восстановить частичный ответ.")
-                            content_fixed = content
-                            
-                            # Пытаемся отрезать текст до начала фигурной скобки и после последней
-                            start_brace = content.find('{')
-                            end_brace = content.rfind('}')
-                            
-                            if start_brace != -1 and end_brace != -1 and end_brace > start_brace:
-                                content_fixed = content[start_brace:end_brace+1]
-                                
-                                # Пытаемся распарсить JSON после чистки
-                                try:
-                                    parsed_data = json.loads(content_fixed)
-                                    print("JSON восстановлен успешно после базовой чистки!")
-                                except json.JSONDecodeError:
-                                    # Если всё ещё не работает, пытаемся более агрессивную чистку с помощью regex
-                                    # Ищем паттерн, который может быть валидным JSON объектом
-                                    json_pattern = r'(\{[^{]*"main_ideas"\s*:\s*\[[^\[\]]*\][^}]*\})'
-                                    match = re.search(json_pattern, content_fixed)
-                                    if match:
-                                        try:
-                                            potential_json = match.group(1)
-                                            # Починка обрывающихся массивов и объектов
-                                            potential_json = re.sub(r',\s*]', ']', potential_json)
-                                            potential_json = re.sub(r',\s*}', '}', potential_json)
-                                            
-                                            parsed_data = json.loads(potential_json)
-                                            print("JSON восстановлен с помощью regex!")
-                                        except:
-                                            raise
-                                    else:
-                                        raise
-                            else:
-                                raise
-                        
-                        # Добавляем информацию о всех найденных понятиях
-                        if all_found_concepts:
-                            # Получаем список понятий, которые уже проанализированы моделью
-                            analyzed_concepts = [concept["name"] for concept in parsed_data.get("concepts", [])]
-                            
-                            # Добавляем базовые записи для понятий, которые не были проанализированы
-                            for concept_name in all_found_concepts:
-                                if concept_name not in analyzed_concepts:
-                                    parsed_data.setdefault("concepts", []).append({
-                                        "name": concept_name,
-                                        "definition": "Определение не найдено в тексте",
-                                        "example": "Пример не найден в тексте",
-                                        "questions": ["Вопрос на понимание понятия не сформулирован"]
-                                    })
-                            
-                            # Сохраняем в результате список всех найденных понятий
-                            parsed_data["all_found_concepts"] = all_found_concepts
-                        
-                        # Генерируем дополнительные связи между понятиями, если их мало
-                        parsed_data = generate_additional_relationships(parsed_data)
-                        
-                        return parsed_data
-                    except json.JSONDecodeError:
-                        print(f"Ошибка при разборе JSON для главы {chapter['title']}")
-                        print(f"Ответ API: {content[:200]}...")  # Печатаем только начало для отладки
-                        
-                        # Попытаемся восстановить неполный JSON
-                        try:
-                            # Ищем начало JSON-объекта
-                            if content.startswith('{'):
-                                # Попробуем найти максимально корректную часть JSON
-                                content_fixed = '{'
-                                bracket_count = 1
-                                for char in content[1:]:
-                                    if char == '{':
-                                        bracket_count += 1
-                                    elif char == '}':
-                                        bracket_count -= 1
-                                    content_fixed += char
-                                    if bracket_count == 0:
-                                        break
-                                
-                                if bracket_count == 0:
-                                    print("Попытка восстановить частичный JSON...")
-                                    parsed_data = json.loads(content_fixed)
-                                    print("JSON восстановлен успешно!")
-                                    return parsed_data
-                        except:
-                            print("Не удалось восстановить частичный JSON")
-                        
-                        if current_attempt < max_attempts:
-                            print(f"Повторная попытка через 5 секунд...")
-                            time.sleep(5)
-                            continue
-                        else:
-                            # Вместо None возвращаем базовый шаблон с информацией о главе
-                            print(f"Возвращаем базовый шаблон для главы {chapter['title']}")
-                            return {
-                                "main_ideas": [f"Не удалось проанализировать главу {chapter['title']} из-за ошибки API"],
-                                "concepts": [
-                                    {
-                                        "name": concept_name,
-                                        "definition": "Определение не получено из-за ошибки API",
-                                        "example": "Пример не получен из-за ошибки API", 
-                                        "questions": ["Вопросы не сформулированы из-за ошибки API"]
-                                    } for concept_name in concepts_from_summary[:5]  # Используем первые 5 понятий из саммари
-                                ] if concepts_from_summary else [],
-                                "relationships": []
-                            }
-                else:
-                    print(f"Ошибка API: {response.status_code}")
-                    if hasattr(response, 'text'):
-                        print(f"Текст ошибки: {response.text[:200]}...")
-                    
-                    if current_attempt < max_attempts:
-                        print(f"Повторная попытка через 5 секунд...")
-                        time.sleep(5)
-                        continue
-                    else:
-                        # Вместо None возвращаем базовый шаблон с информацией о главе
-                        print(f"Возвращаем базовый шаблон для главы {chapter['title']}")
-                        return {
-                            "main_ideas": [f"Не удалось проанализировать главу {chapter['title']} из-за сетевой ошибки"],
-                            "concepts": [
-                                {
-                                    "name": concept_name,
-                                    "definition": "Определение не получено из-за сетевой ошибки",
-                                    "example": "Пример не получен из-за сетевой ошибки", 
-                                    "questions": ["Вопросы не сформулированы из-за сетевой ошибки"]
-                                } for concept_name in concepts_from_summary[:5]  # Используем первые 5 понятий из саммари
-                            ] if concepts_from_summary else [],
-                            "relationships": []
-                        }
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Сетевая ошибка при обращении к API: {str(e)}")
-                
-                if current_attempt < max_attempts:
-                    print(f"Повторная попытка через 5 секунд...")
-                    time.sleep(5)
-                    continue
-                else:
-                    # Вместо None возвращаем базовый шаблон с информацией о главе
-                    print(f"Возвращаем базовый шаблон для главы {chapter['title']}")
-                    return {
-                        "main_ideas": [f"Не удалось проанализировать главу {chapter['title']} из-за сетевой ошибки"],
-                        "concepts": [
-                            {
-                                "name": concept_name,
-                                "definition": "Определение не получено из-за сетевой ошибки",
-                                "example": "Пример не получен из-за сетевой ошибки", 
-                                "questions": ["Вопросы не сформулированы из-за сетевой ошибки"]
-                            } for concept_name in concepts_from_summary[:5]  # Используем первые 5 понятий из саммари
-                        ] if concepts_from_summary else [],
-                        "relationships": []
-                    }
-                
-        # Если все попытки не удались, возвращаем базовый шаблон вместо None
-        print(f"Все попытки анализа главы {chapter['title']} не удались. Возвращаем базовый шаблон")
-        return {
-            "main_ideas": [f"Не удалось проанализировать главу {chapter['title']} после {max_attempts} попыток"],
-            "concepts": [
-                {
-                    "name": concept_name,
-                    "definition": "Определение не получено после нескольких попыток",
-                    "example": "Пример не получен после нескольких попыток", 
-                    "questions": ["Вопросы не сформулированы после нескольких попыток"]
-                } for concept_name in concepts_from_summary[:5]  # Используем первые 5 понятий из саммари
-            ] if concepts_from_summary else [],
-            "relationships": []
-        }
-            
+        parsed_data = request_chapter_analysis(prompt, len(concepts_from_summary) or CONCEPTS_PER_CALL,
+                                               f"главы {chapter['title']}")
+    except LLMError as e:
+        # Сетевые ошибки, 429 и 5xx уже повторены клиентом llm_client
+        print(f"Ошибка при обращении к API: {str(e)}")
+        if not placeholder_on_error:
+            return None
+        print(f"Возвращаем базовый шаблон для главы {chapter['title']}")
+        return placeholder_analysis(f"Не удалось проанализировать главу {chapter['title']} из-за сетевой ошибки",
+                                    "из-за сетевой ошибки", concepts_from_summary)
     except Exception as e:
         print(f"Ошибка при обработке главы {chapter['title']}: {str(e)}")
+        if not placeholder_on_error:
+            return None
+        return placeholder_analysis(f"Произошла ошибка при анализе главы {chapter['title']}: {str(e)}",
+                                    "из-за внутренней ошибки", concepts_from_summary)
+    
+    if parsed_data is None:
+        if not placeholder_on_error:
+            return None
         # Вместо None возвращаем базовый шаблон с информацией о главе
-        return {
-            "main_ideas": [f"Произошла ошибка при анализе главы {chapter['title']}: {str(e)}"],
-            "concepts": [
-                {
+        print(f"Все попытки анализа главы {chapter['title']} не удались. Возвращаем базовый шаблон")
+        return placeholder_analysis(
+            f"Не удалось проанализировать главу {chapter['title']} после {SCHEMA_MAX_ATTEMPTS} попыток",
+            "после нескольких попыток", concepts_from_summary)
+    
+    # Добавляем информацию о всех найденных понятиях
+    if all_found_concepts:
+        # Получаем список понятий, которые уже проанализированы моделью
+        analyzed_concepts = [concept["name"] for concept in parsed_data["concepts"]]
+        
+        # Добавляем базовые записи для понятий, которые не были проанализированы
+        for concept_name in all_found_concepts:
+            if concept_name not in analyzed_concepts:
+                parsed_data["concepts"].append({
                     "name": concept_name,
-                    "definition": "Определение не получено из-за внутренней ошибки",
-                    "example": "Пример не получен из-за внутренней ошибки", 
-                    "questions": ["Вопросы не сформулированы из-за внутренней ошибки"]
-                } for concept_name in concepts_from_summary[:5]  # Используем первые 5 понятий из саммари
-            ] if concepts_from_summary else [],
-            "relationships": []
-        }
+                    "definition": "Определение не найдено в тексте",
+                    "example": "Пример не найден в тексте",
+                    "questions": ["Вопрос на понимание понятия не сформулирован"]
+                })
+        
+        # Сохраняем в результате список всех найденных понятий
+        parsed_data["all_found_concepts"] = all_found_concepts
+    
+    return parsed_data
 
 def generate_additional_relationships(parsed_data):
     """Генерирует дополнительные связи между понятиями, если модель вернула мало связей"""
@@ -425,37 +359,156 @@ def generate_additional_relationships(parsed_data):
     if len(relationships) < 10 and len(concepts) > 5:
         print("Недостаточно связей, добавляем базовые связи RELATES_TO между понятиями")
         
-        # Берем первые 10 понятий с определениями (если таковых больше 5)
+        # Берем первые EXTRA_RELATIONSHIPS_MAX_CONCEPTS понятий с определениями
         defined_concepts = [c for c in concepts if c.get("definition") and c.get("definition") != "Определение не найдено в тексте"]
-        defined_concepts = defined_concepts[:10] if len(defined_concepts) > 10 else defined_concepts
+        defined_concepts = defined_concepts[:EXTRA_RELATIONSHIPS_MAX_CONCEPTS]
+        
+        # Уже существующие связи без учета направления, для проверки за постоянное время
+        existing_pairs = {frozenset((r.get("source"), r.get("target"))) for r in relationships if isinstance(r, dict)}
+        added_count = 0
         
         # Если у нас есть хотя бы 3 понятия с определениями, создаем связи между ними
         if len(defined_concepts) >= 3:
-            # Создаем базовые связи между понятиями
+            # Создаем базовые связи между понятиями, не более EXTRA_RELATIONSHIPS_MAX_PAIRS
             for i in range(len(defined_concepts) - 1):
+                if added_count >= EXTRA_RELATIONSHIPS_MAX_PAIRS:
+                    break
                 for j in range(i + 1, len(defined_concepts)):
+                    if added_count >= EXTRA_RELATIONSHIPS_MAX_PAIRS:
+                        break
                     source = defined_concepts[i]["name"]
                     target = defined_concepts[j]["name"]
                     
                     # Проверяем, что такой связи еще нет
-                    if not any(r.get("source") == source and r.get("target") == target for r in relationships) and \
-                       not any(r.get("source") == target and r.get("target") == source for r in relationships):
-                        relationships.append({
-                            "source": source,
-                            "target": target,
-                            "type": "RELATES_TO",
-                            "description": f"Понятия '{source}' и '{target}' связаны между собой в рамках этой главы"
-                        })
+                    pair = frozenset((source, target))
+                    if pair in existing_pairs:
+                        continue
+                    existing_pairs.add(pair)
+                    relationships.append({
+                        "source": source,
+                        "target": target,
+                        "type": "RELATES_TO",
+                        "description": f"Понятия '{source}' и '{target}' связаны между собой в рамках этой главы"
+                    })
+                    added_count += 1
         
-        print(f"Добавлено {len(relationships) - len(parsed_data.get('relationships', []))} новых связей")
+        print(f"Добавлено {added_count} новых связей")
     
     # Обновляем раздел relationships в данных
     parsed_data["relationships"] = relationships
     return parsed_data
 
+# Функция для вычисления свойств понятий главы перед пакетной записью в Neo4j
+def prepare_chapter_concepts(concepts, chapter_title, chapter_index, existing):
+    """
+    Вычисляет итоговые свойства понятий главы так же, как при поочередной записи:
+    накапливает определения и примеры с пометкой "[Из главы ...]" и дополняет chapters_mentions.
+    
+    Parameters:
+    - concepts: список понятий из анализа главы
+    - chapter_title: название главы
+    - chapter_index: индекс главы (с нуля)
+    - existing: словарь {имя: свойства} для понятий, уже существующих в базе
+    
+    Возвращает (rows, created_names): строки {name, props} в порядке первого упоминания
+    и множество имен понятий, которых еще нет в базе
+    """
+    current = {}
+    order = []
+    created_names = set()
+    
+    for concept in concepts:
+        # Проверка валидности данных понятия
+        if not isinstance(concept, dict) or "name" not in concept:
+            print(f"Пропускаем невалидное понятие в главе '{chapter_title}'")
+            continue
+        
+        concept_name = concept["name"]
+        if concept_name not in current:
+            order.append(concept_name)
+            if concept_name in existing:
+                current[concept_name] = dict(existing[concept_name])
+        
+        props = current.get(concept_name)
+        if props is None:
+            # Создаем новое понятие с непустыми полями и указанием главы
+            props = {
+                "definition": f"[Из главы '{chapter_title}']: {concept.get('definition', 'Определение не найдено в тексте')}",
+                "example": f"[Из главы '{chapter_title}']: {concept.get('example', 'Пример не найден в тексте')}",
+                "questions": concept.get("questions", ["Вопрос на понимание понятия не сформулирован"]),
+                # Инициализируем chapters_mentions как JSON строку с пустым объектом
+                "chapters_mentions": json.dumps({})
+            }
+            current[concept_name] = props
+            created_names.add(concept_name)
+        else:
+            # Обновляем определение существующего понятия если это новое определение из новой главы
+            # и только если текущее определение не содержит информацию из этой главы
+            current_def = props.get("definition") or ""
+            if concept.get("definition") and f"Из главы '{chapter_title}'" not in current_def:
+                formatted_definition = f"[Из главы '{chapter_title}']: {concept.get('definition')}"
+                if current_def and current_def != "Определение не найдено в тексте":
+                    # Если уже есть определение, добавляем новое через разделитель
+                    props["definition"] = f"{current_def}\n\n{formatted_definition}"
+                else:
+                    # Если определения нет или оно пустое, просто заменяем
+                    props["definition"] = formatted_definition
+                
+                # Аналогично для примера
+                current_example = props.get("example") or ""
+                if concept.get("example") and f"Из главы '{chapter_title}'" not in current_example:
+                    formatted_example = f"[Из главы '{chapter_title}']: {concept.get('example')}"
+                    if current_example and current_example != "Пример не найден в тексте":
+                        props["example"] = f"{current_example}\n\n{formatted_example}"
+                    else:
+                        props["example"] = formatted_example
+        
+        # Сохраняем определения по главам
+        if concept.get("definition"):
+            try:
+                # Если chapters_mentions - строка, пробуем её распарсить
+                chapters_mentions_str = props.get("chapters_mentions") or "{}"
+                if isinstance(chapters_mentions_str, str):
+                    chapters_mentions = json.loads(chapters_mentions_str)
+                else:
+                    # Если это не строка, создаем новый словарь
+                    chapters_mentions = {}
+                
+                # Сохраняем определение для этой главы
+                chapters_mentions[f"chapter_{chapter_index+1}"] = {
+                    "chapter_title": chapter_title,
+                    "definition": concept.get("definition", ""),
+                    "example": concept.get("example", "")
+                }
+                
+                # Преобразуем словарь в JSON-строку перед сохранением в Neo4j
+                props["chapters_mentions"] = json.dumps(chapters_mentions, ensure_ascii=False)
+            except Exception as e:
+                print(f"Ошибка при обновлении chapters_mentions для понятия '{concept_name}': {str(e)}")
+    
+    rows = [
+        {"name": name, "props": {key: value for key, value in current[name].items() if value is not None}}
+        for name in order
+    ]
+    return rows, created_names
+
+# Функция для экранирования типа связи в Cypher (тип связи нельзя передать параметром)
+def cypher_rel_type(rel_type):
+    return "`" + str(rel_type).replace("`", "``") + "`"
+
 # Функция для загрузки данных в Neo4j
-def load_to_neo4j(chapters_data, course_name="Системное саморазвитие"):
-    """Загружает результаты анализа в базу данных Neo4j для указанного курса"""
+def load_to_neo4j(chapters_data, course_name="Системное саморазвитие", on_chapter_loaded=None):
+    """
+    Загружает результаты анализа в базу данных Neo4j для указанного курса.
+    
+    Каждая глава записывается одной транзакцией из нескольких пакетных запросов UNWIND
+    вместо отдельных запросов на каждое понятие и связь.
+    
+    Parameters:
+    - chapters_data: список глав с анализом (None на месте главы означает, что ее нужно пропустить)
+    - course_name: название курса
+    - on_chapter_loaded: функция, вызываемая с индексом главы после записи главы в Neo4j
+    """
     try:
         # Подключение к Neo4j
         graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
@@ -466,11 +519,9 @@ def load_to_neo4j(chapters_data, course_name="Системное самораз
             print(f"Ошибка: Курс '{course_name}' не найден в базе данных")
             return False
         
+        warn_if_schema_missing(graph)
         print(f"Загрузка данных в курс '{course_name}'")
         
-        # Словарь для хранения созданных узлов по имени
-        nodes_cache = {}
-        
         # Счетчики
         chapter_count = 0
         concept_count = 0
@@ -493,156 +544,102 @@ def load_to_neo4j(chapters_data, course_name="Системное самораз
                 print(f"Пропускаем главу '{chapter_title}' - некорректный формат данных анализа")
                 continue
             
-            # Создаем узел главы
-            chapter_node = Node("Chapter", 
-                              title=chapter_title,
-                              main_ideas=chapter_data.get("main_ideas", []),
-                              course=course_name)  # Добавляем атрибут course
-            graph.create(chapter_node)
-            chapter_count += 1
-            
-            # Связываем главу с узлом курса
-            rel = Relationship(chapter_node, "PART_OF", course_node,
-                             description=f"Глава {i+1} курса {course_name}")
-            graph.create(rel)
-            
-            # Создаем узлы понятий и связываем их с главой
-            for concept in chapter_data.get("concepts", []):
-                # Проверка валидности данных понятия
-                if not isinstance(concept, dict) or "name" not in concept:
-                    print(f"Пропускаем невалидное понятие в главе '{chapter_title}'")
-                    continue
-                
-                concept_name = concept["name"]
-                
-                # Проверяем, есть ли уже такое понятие
-                concept_node = graph.nodes.match("Concept", name=concept_name).first()
-                
-                if not concept_node:
-                    # Создаем новый узел понятия с непустыми полями и указанием главы
-                    formatted_definition = f"[Из главы '{chapter_title}']: {concept.get('definition', 'Определение не найдено в тексте')}"
-                    formatted_example = f"[Из главы '{chapter_title}']: {concept.get('example', 'Пример не найден в тексте')}"
-                    
-                    concept_node = Node("Concept",
-                                      name=concept_name,
-                                      definition=formatted_definition,
-                                      example=formatted_example,
-                                      questions=concept.get("questions", ["Вопрос на понимание понятия не сформулирован"]))
-                    # Инициализируем chapters_mentions как JSON строку с пустым объектом
-                    concept_node["chapters_mentions"] = json.dumps({})
-                    graph.create(concept_node)
-                    concept_count += 1
-                else:
-                    # Обновляем определение существующего узла если это новое определение из новой главы
-                    # и только если текущее определение не содержит информацию из этой главы
-                    current_def = concept_node.get("definition", "")
-                    if concept.get("definition") and f"Из главы '{chapter_title}'" not in current_def:
-                        formatted_definition = f"[Из главы '{chapter_title}']: {concept.get('definition')}"
-                        if current_def and current_def != "Определение не найдено в тексте":
-                            # Если уже есть определение, добавляем новое через разделитель
-                            concept_node["definition"] = f"{current_def}\n\n{formatted_definition}"
-                        else:
-                            # Если определения нет или оно пустое, просто заменяем
-                            concept_node["definition"] = formatted_definition
-                        
-                        # Аналогично для примера
-                        current_example = concept_node.get("example", "")
-                        if concept.get("example") and f"Из главы '{chapter_title}'" not in current_example:
-                            formatted_example = f"[Из главы '{chapter_title}']: {concept.get('example')}"
-                            if current_example and current_example != "Пример не найден в тексте":
-                                concept_node["example"] = f"{current_example}\n\n{formatted_example}"
-                            else:
-                                concept_node["example"] = formatted_example
-                        
-                        graph.push(concept_node)
+            # Время изменения для инкрементных резервных копий
+            updated_at = updated_at_now()
+            tx = graph.begin()
+            try:
+                # Читаем текущие свойства уже существующих понятий главы одним запросом
+                names = list({c["name"] for c in chapter_data["concepts"] if isinstance(c, dict) and "name" in c})
+                existing = {
+                    record["name"]: {
+                        "definition": record["definition"],
+                        "example": record["example"],
+                        "chapters_mentions": record["chapters_mentions"]
+                    }
+                    for record in tx.run("""
+                        UNWIND $names AS name
+                        MATCH (c:Concept {name: name})
+                        RETURN c.name AS name, c.definition AS definition,
+                               c.example AS example, c.chapters_mentions AS chapters_mentions
+                    """, names=names).data()
+                }
+                concept_rows, created_names = prepare_chapter_concepts(chapter_data["concepts"], chapter_title, i, existing)
                 
-                # Сохраняем определения по главам
-                if concept.get("definition"):
-                    # Получаем текущие упоминания по главам
-                    try:
-                        # Если chapters_mentions - строка, пробуем её распарсить
-                        chapters_mentions_str = concept_node.get("chapters_mentions", "{}")
-                        if isinstance(chapters_mentions_str, str):
-                            chapters_mentions = json.loads(chapters_mentions_str)
-                        else:
-                            # Если это не строка, создаем новый словарь
-                            chapters_mentions = {}
-                        
-                        # Сохраняем определение для этой главы
-                        chapter_key = f"chapter_{i+1}"
-                        chapters_mentions[chapter_key] = {
-                            "chapter_title": chapter_title,
-                            "definition": concept.get("definition", ""),
-                            "example": concept.get("example", "")
-                        }
-                        
-                        # Преобразуем словарь в JSON-строку перед сохранением в Neo4j
-                        concept_node["chapters_mentions"] = json.dumps(chapters_mentions, ensure_ascii=False)
-                        graph.push(concept_node)
-                    except Exception as e:
-                        print(f"Ошибка при обновлении chapters_mentions для понятия '{concept_name}': {str(e)}")
+                # Создаем узел главы и связываем его с узлом курса
+                chapter_id = tx.evaluate("""
+                    MATCH (course:Course) WHERE id(course) = $course_id
+                    CREATE (ch:Chapter {title: $title, main_ideas: $main_ideas, course: $course_name, updated_at: $updated_at})
+                    CREATE (ch)-[:PART_OF {description: $description, updated_at: $updated_at}]->(course)
+                    RETURN id(ch)
+                """, course_id=course_node.identity, title=chapter_title,
+                    main_ideas=chapter_data.get("main_ideas", []), course_name=course_name,
+                    description=f"Глава {i+1} курса {course_name}", updated_at=updated_at)
+                chapter_count += 1
                 
-                # Сохраняем узел в кэше для использования при создании связей
-                nodes_cache[concept_name] = concept_node
+                # Создаем и обновляем узлы понятий
+                tx.run("""
+                    UNWIND $rows AS row
+                    MERGE (c:Concept {name: row.name})
+                    SET c += row.props, c.updated_at = $updated_at
+                """, rows=concept_rows, updated_at=updated_at)
+                concept_count += len(created_names)
                 
-                # Проверяем, существует ли уже связь между понятием и главой
-                rel_matcher = RelationshipMatcher(graph)
-                existing_rel = rel_matcher.match(
-                    (concept_node, chapter_node), 
-                    r_type="MENTIONED_IN"
-                ).first()
+                # Связываем понятия с новой главой (MENTIONED_IN) и с курсом (PART_OF, если связи еще нет)
+                link_rows = [{
+                    "name": row["name"],
+                    "mention_description": f"Понятие {row['name']} упоминается в главе {i+1} курса {course_name}",
+                    "course_description": f"Понятие {row['name']} является частью курса {course_name}"
+                } for row in concept_rows]
+                relationship_count += tx.evaluate("""
+                    MATCH (ch:Chapter) WHERE id(ch) = $chapter_id
+                    UNWIND $rows AS row
+                    MATCH (c:Concept {name: row.name})
+                    CREATE (c)-[:MENTIONED_IN {description: row.mention_description, updated_at: $updated_at}]->(ch)
+                    RETURN count(*)
+                """, chapter_id=chapter_id, rows=link_rows, updated_at=updated_at) or 0
+                relationship_count += tx.evaluate("""
+                    MATCH (course:Course) WHERE id(course) = $course_id
+                    UNWIND $rows AS row
+                    MATCH (c:Concept {name: row.name})
+                    WHERE NOT (c)-[:PART_OF]->(course)
+                    CREATE (c)-[:PART_OF {description: row.course_description, updated_at: $updated_at}]->(course)
+                    RETURN count(*)
+                """, course_id=course_node.identity, rows=link_rows, updated_at=updated_at) or 0
                 
-                if not existing_rel:
-                    # Создаем связь "MENTIONED_IN" между понятием и главой
-                    rel = Relationship(concept_node, "MENTIONED_IN", chapter_node,
-                                     description=f"Понятие {concept_name} упоминается в главе {i+1} курса {course_name}")
-                    graph.create(rel)
-                    relationship_count += 1
+                # Создаем связи между понятиями: по одному запросу на тип связи,
+                # повторы внутри главы отбрасываем заранее
+                rels_by_type = {}
+                seen_rels = set()
+                for rel_data in chapter_data.get("relationships", []):
+                    if not isinstance(rel_data, dict) or not all(rel_data.get(key) for key in ("source", "target", "type")):
+                        continue
+                    rel_key = (rel_data["source"], rel_data["target"], rel_data["type"])
+                    if rel_key in seen_rels:
+                        continue
+                    seen_rels.add(rel_key)
+                    rels_by_type.setdefault(rel_data["type"], []).append({
+                        "source": rel_data["source"],
+                        "target": rel_data["target"],
+                        "description": rel_data.get("description", "")
+                    })
                 
-                # Также создаем связь PART_OF между понятием и узлом курса
-                existing_rel_course = rel_matcher.match(
-                    (concept_node, course_node), 
-                    r_type="PART_OF"
-                ).first()
+                for rel_type, rel_rows in rels_by_type.items():
+                    rel_type_cypher = cypher_rel_type(rel_type)
+                    relationship_count += tx.evaluate(f"""
+                        UNWIND $rows AS row
+                        MATCH (source:Concept {{name: row.source}}), (target:Concept {{name: row.target}})
+                        WHERE NOT (source)-[:{rel_type_cypher}]->(target)
+                        CREATE (source)-[:{rel_type_cypher} {{description: row.description, updated_at: $updated_at}}]->(target)
+                        RETURN count(*)
+                    """, rows=rel_rows, updated_at=updated_at) or 0
                 
-                if not existing_rel_course:
-                    rel_course = Relationship(concept_node, "PART_OF", course_node,
-                                           description=f"Понятие {concept_name} является частью курса {course_name}")
-                    graph.create(rel_course)
-                    relationship_count += 1
+                graph.commit(tx)
+            except Exception:
+                graph.rollback(tx)
+                raise
             
-            # Создаем связи между понятиями
-            for rel_data in chapter_data.get("relationships", []):
-                source_name = rel_data["source"]
-                target_name = rel_data["target"]
-                rel_type = rel_data["type"]
-                
-                # Проверяем, есть ли понятия в кэше или в базе
-                source_node = nodes_cache.get(source_name)
-                if not source_node:
-                    source_node = graph.nodes.match("Concept", name=source_name).first()
-                    if source_node:
-                        nodes_cache[source_name] = source_node
-                
-                target_node = nodes_cache.get(target_name)
-                if not target_node:
-                    target_node = graph.nodes.match("Concept", name=target_name).first()
-                    if target_node:
-                        nodes_cache[target_name] = target_node
-                
-                # Если оба понятия найдены, создаем связь между ними
-                if source_node and target_node:
-                    # Проверяем, существует ли уже такая связь
-                    existing_rel = rel_matcher.match(
-                        (source_node, target_node), 
-                        r_type=rel_type
-                    ).first()
-                    
-                    if not existing_rel:
-                        rel = Relationship(source_node, rel_type, target_node,
-                                         description=rel_data.get("description", ""))
-                        graph.create(rel)
-                        relationship_count += 1
+            if on_chapter_loaded:
+                on_chapter_loaded(i)
         
         print(f"Загрузка в Neo4j завершена: создано {chapter_count} глав, {concept_count} понятий, {relationship_count} связей")
         return True
@@ -651,37 +648,24 @@ def load_to_neo4j(chapters_data, course_name="Системное самораз
         print(f"Ошибка при загрузке данных в Neo4j: {str(e)}")
         return False
 
-# Функция для анализа больших глав с разбиением на части
-def analyze_large_chapter(chapter, all_concepts):
-    """Анализирует большую главу, разбивая ее на части или обрабатывая понятия группами"""
-    print(f"Глава слишком большая или содержит слишком много понятий. Разбиваем на части.")
+# Функция для анализа одной группы понятий большой главы
+def analyze_concept_group(chapter, concept_group, i, groups_count, content=None):
+    """
+    Анализирует группу понятий главы и возвращает частичный результат или None при ошибке.
+    content - часть главы, в которой упоминаются понятия группы (по умолчанию вся глава)
+    """
+    print(f"Анализ группы понятий {i+1}/{groups_count}: {', '.join(concept_group)}")
+    if content is None:
+        content = chapter['content']
     
-    # Если найдено очень много понятий, разделим их на группы по 10 (уменьшено с 20)
-    if len(all_concepts) > 10:
-        concept_groups = [all_concepts[i:i+10] for i in range(0, len(all_concepts), 10)]
-        print(f"Разделили {len(all_concepts)} понятий на {len(concept_groups)} групп")
-        
-        # Создаем базовый шаблон результата
-        result = {
-            "main_ideas": [],
-            "concepts": [],
-            "relationships": []
-        }
-        
-        # Отслеживаем, какие понятия уже обработаны
-        processed_concepts = set()
-        
-        for i, concept_group in enumerate(concept_groups):
-            print(f"Анализ группы понятий {i+1}/{len(concept_groups)}: {', '.join(concept_group)}")
-            
-            # Формируем промпт только для этой группы понятий
-            prompt = f"""
-Проанализируй следующую главу из курса по системному мышлению:
+    # Формируем промпт только для этой группы понятий
+    prompt = f"""
+Проанализируй следующий фрагмент главы из курса по системному мышлению:
 
 Название: {chapter['title']}
 
-Содержание (первые 5000 символов):
-{chapter['content'][:5000]}
+Содержание фрагмента:
+{content}
 
 В этой главе определены следующие основные понятия: {', '.join(concept_group)}.
 
@@ -728,201 +712,265 @@ def analyze_large_chapter(chapter, all_concepts):
 
 УБЕДИСЬ, что в ответе есть все {len(concept_group)} понятий из списка! Отвечай только в формате JSON, без дополнительного текста.
 """
-            
-            # Делаем запрос к API и обрабатываем результат
-            try:
-                # Стандартная часть кода для запроса API (аналогично существующему коду)
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://adapter-course.ru",
-                        "X-Title": "Adapter Course",
-                    },
-                    json={
-                        "model": AI_MODEL,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": 8000,
-                        "temperature": 0.7
-                    },
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    content = response.json()['choices'][0]['message']['content']
-                    
-                    # Обработка ответа по аналогии с существующим кодом
-                    try:
-                        json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                        if json_match:
-                            content = json_match.group(1)
-                        
-                        # Обработка JSON с учетом ошибок
-                        try:
-                            part_data = json.loads(content)
-                            
-                            # Проверяем структуру данных
-                            if not isinstance(part_data, dict):
-                                print(f"Некорректный формат JSON для группы {i+1} - получен не словарь")
-                                continue
-                            
-                            # Проверяем наличие обязательных полей
-                            if not isinstance(part_data.get("main_ideas"), list):
-                                print(f"Отсутствуют или некорректны main_ideas в ответе для группы {i+1}")
-                                part_data["main_ideas"] = [f"Идея для группы понятий {i+1}"]
-                            
-                            if not isinstance(part_data.get("concepts"), list):
-                                print(f"Отсутствуют или некорректны concepts в ответе для группы {i+1}")
-                                part_data["concepts"] = []
-                            
-                            if not isinstance(part_data.get("relationships"), list):
-                                print(f"Отсутствуют или некорректны relationships в ответе для группы {i+1}")
-                                part_data["relationships"] = []
-                            
-                            # Проверяем, все ли понятия из группы присутствуют в ответе
-                            received_concepts = {c["name"] for c in part_data.get("concepts", []) if isinstance(c, dict) and "name" in c}
-                            missing_concepts = set(concept_group) - received_concepts
-                            
-                            if missing_concepts:
-                                print(f"ВНИМАНИЕ: {len(missing_concepts)} понятий не обработаны в группе {i+1}: {', '.join(missing_concepts)}")
-                                
-                                # Создаем базовые определения для отсутствующих понятий
-                                for missing in missing_concepts:
-                                    part_data.setdefault("concepts", []).append({
-                                        "name": missing,
-                                        "definition": f"Определение понятия не получено от API. Требуется анализ.",
-                                        "example": "Пример не получен от API",
-                                        "questions": ["Вопрос на понимание не сформулирован"]
-                                    })
-                                    print(f"Добавлено базовое определение для понятия '{missing}'")
-                            
-                            # Отмечаем, какие понятия были обработаны
-                            for concept in part_data.get("concepts", []):
-                                if isinstance(concept, dict) and "name" in concept:
-                                    processed_concepts.add(concept["name"])
-                            
-                            # Объединяем результаты
-                            result["main_ideas"].extend(part_data.get("main_ideas", []))
-                            result["concepts"].extend(part_data.get("concepts", []))
-                            result["relationships"].extend(part_data.get("relationships", []))
-                            
-                            print(f"Успешно обработано {len(part_data.get('concepts', []))} понятий в группе {i+1}")
-                        except json.JSONDecodeError as e:
-                            print(f"Ошибка при разборе JSON группы {i+1}: {str(e)}")
-                            # Пытаемся восстановить JSON
-                            try:
-                                # Ищем начало и конец фигурных скобок
-                                start_brace = content.find('{')
-                                end_brace = content.rfind('}')
-                                
-                                if start_brace != -1 and end_brace != -1 and end_brace > start_brace:
-                                    # Вырезаем потенциальный JSON
-                                    content_fixed = content[start_brace:end_brace+1]
-                                    
-                                    # Чистим некорректные запятые в конце массивов и объектов
-                                    content_fixed = re.sub(r',\s*]', ']', content_fixed)
-                                    content_fixed = re.sub(r',\s*}', '}', content_fixed)
-                                    
-                                    # Восстанавливаем кавычки (часто возникает при ошибках парсинга)
-                                    content_fixed = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', content_fixed)
-                                    
-                                    # Пробуем распарсить восстановленный JSON
-                                    part_data = json.loads(content_fixed)
-                                    
-                                    # Проверяем структуру и объединяем
-                                    if isinstance(part_data, dict):
-                                        # Проверяем и инициализируем необходимые поля
-                                        if not isinstance(part_data.get("main_ideas"), list):
-                                            part_data["main_ideas"] = [f"Восстановленная идея для группы {i+1}"]
-                                            
-                                        if not isinstance(part_data.get("concepts"), list):
-                                            part_data["concepts"] = []
-                                            
-                                        if not isinstance(part_data.get("relationships"), list):
-                                            part_data["relationships"] = []
-                                        
-                                        # Проверяем и добавляем отсутствующие понятия
-                                        received_concepts = {c["name"] for c in part_data.get("concepts", []) if isinstance(c, dict) and "name" in c}
-                                        missing_concepts = set(concept_group) - received_concepts
-                                        
-                                        if missing_concepts:
-                                            print(f"ВНИМАНИЕ: {len(missing_concepts)} понятий не обработаны в группе {i+1} после восстановления JSON")
-                                            
-                                            # Создаем базовые определения для отсутствующих понятий
-                                            for missing in missing_concepts:
-                                                part_data.setdefault("concepts", []).append({
-                                                    "name": missing,
-                                                    "definition": f"Определение понятия не получено из восстановленного JSON",
-                                                    "example": "Пример не получен",
-                                                    "questions": ["Вопрос на понимание не сформулирован"]
-                                                })
-                                                print(f"Добавлено базовое определение для понятия '{missing}'")
-                                        
-                                        # Отмечаем, какие понятия были обработаны
-                                        for concept in part_data.get("concepts", []):
-                                            if isinstance(concept, dict) and "name" in concept:
-                                                processed_concepts.add(concept["name"])
-                                        
-                                        # Объединяем результаты
-                                        result["main_ideas"].extend(part_data.get("main_ideas", []))
-                                        result["concepts"].extend(part_data.get("concepts", []))
-                                        result["relationships"].extend(part_data.get("relationships", []))
-                                        
-                                        print(f"Успешно восстановлен и обработан JSON для группы {i+1}")
-                                else:
-                                    print(f"Не удалось найти корректные границы JSON для группы {i+1}")
-                            except Exception as nested_e:
-                                print(f"Не удалось восстановить JSON для группы {i+1}: {str(nested_e)}")
-                            # В любом случае продолжаем обработку следующих групп
-                    except Exception as e:
-                        print(f"Ошибка при обработке ответа API для группы {i+1}: {str(e)}")
-                else:
-                    print(f"Ошибка API для группы {i+1}: {response.status_code}")
-            except Exception as e:
-                print(f"Ошибка запроса для группы {i+1}: {str(e)}")
-            
-            # Небольшая пауза между запросами
-            time.sleep(5)
-        
-        # После обработки всех групп проверяем, какие понятия все еще не обработаны
-        all_missing = set(all_concepts) - processed_concepts
-        if all_missing:
-            print(f"ВНИМАНИЕ: {len(all_missing)} понятий не были обработаны ни в одной группе: {', '.join(all_missing)}")
-            
-            # Добавляем отсутствующие понятия с минимальной информацией
-            for missing in all_missing:
-                result["concepts"].append({
-                    "name": missing,
-                    "definition": "Определение понятия не получено в результате анализа",
-                    "example": "Пример не получен в результате анализа",
-                    "questions": ["Вопрос на понимание понятия не сформулирован"]
-                })
-                print(f"Добавлено минимальное определение для понятия '{missing}'")
-        
-        # Дедупликация и финальные корректировки
-        # Удаляем дубликаты идей
-        if result["main_ideas"]:
-            result["main_ideas"] = list(set(result["main_ideas"]))[:3]  # Не более 3 главных идей
-        
-        # Удаляем дубликаты понятий (по имени)
-        unique_concepts = {}
-        for concept in result["concepts"]:
-            if concept["name"] not in unique_concepts:
-                unique_concepts[concept["name"]] = concept
-        result["concepts"] = list(unique_concepts.values())
-        
-        print(f"Итоговый результат содержит {len(result['concepts'])} понятий из {len(all_concepts)} исходных")
-        
-        # Связи оставляем как есть, они могут повторяться для разных групп
+    
+    # Делаем запрос к API и проверяем ответ по схеме
+    try:
+        part_data = request_chapter_analysis(prompt, len(concept_group), f"группы {i+1}")
+    except LLMError as e:
+        print(f"Ошибка API для группы {i+1}: {str(e)}")
+        return None
+    except Exception as e:
+        print(f"Ошибка запроса для группы {i+1}: {str(e)}")
+        return None
+    if part_data is None:
+        return None
+    
+    # Проверяем, все ли понятия из группы присутствуют в ответе
+    received_concepts = {c["name"] for c in part_data["concepts"]}
+    missing_concepts = set(concept_group) - received_concepts
+    
+    if missing_concepts:
+        print(f"ВНИМАНИЕ: {len(missing_concepts)} понятий не обработаны в группе {i+1}: {', '.join(missing_concepts)}")
         
-        return result
+        # Создаем базовые определения для отсутствующих понятий
+        for missing in missing_concepts:
+            part_data["concepts"].append({
+                "name": missing,
+                "definition": f"Определение понятия не получено от API. Требуется анализ.",
+                "example": "Пример не получен от API",
+                "questions": ["Вопрос на понимание не сформулирован"]
+            })
+            print(f"Добавлено базовое определение для понятия '{missing}'")
+    
+    print(f"Успешно обработано {len(part_data['concepts'])} понятий в группе {i+1}")
+    return part_data
+
+def is_placeholder_concept(concept):
+    """Понятие-заглушка, добавленное, когда модель не вернула определение"""
+    definition = concept.get("definition") or ""
+    return not definition or "не получено" in definition or definition == "Определение не найдено в тексте"
+
+def select_main_ideas(parts, limit=3):
+    """
+    Выбирает главные мысли главы из результатов ее частей. Сначала идут мысли, которые
+    повторяются в нескольких частях, затем - первые мысли частей раньше вторых; если мыслей
+    одного ранга больше, чем осталось мест, они берутся из частей, равномерно распределенных
+    по главе, а не только из первых
+    """
+    ideas = {}
+    for part_index, part_data in enumerate(parts):
+        if not part_data:
+            continue
+        for position, idea in enumerate(part_data.get("main_ideas", [])):
+            key = " ".join(idea.lower().split())
+            if not key:
+                continue
+            if key in ideas:
+                ideas[key]["count"] += 1
+            else:
+                ideas[key] = {"idea": idea, "count": 1, "position": position, "part": part_index}
+
+    # Группы мыслей одного ранга в порядке частей
+    groups = {}
+    for item in sorted(ideas.values(), key=lambda item: item["part"]):
+        groups.setdefault((-item["count"], item["position"]), []).append(item["idea"])
+
+    selected = []
+    for rank in sorted(groups):
+        group = groups[rank]
+        slots = limit - len(selected)
+        if slots <= 0:
+            break
+        if len(group) <= slots:
+            selected.extend(group)
+        elif slots == 1:
+            selected.append(group[len(group) // 2])
+        else:
+            selected.extend(group[round(k * (len(group) - 1) / (slots - 1))] for k in range(slots))
+    return selected
+
+def merge_chapter_parts(parts, all_concepts):
+    """
+    Объединяет результаты анализа частей главы в один анализ главы.
+
+    Главные мысли выбираются по всем частям (select_main_ideas), связи берутся без повторов в порядке частей. Если понятие встретилось
+    в нескольких частях, берется первое настоящее определение (заглушки заменяются),
+    а вопросы объединяются.
+    """
+    concepts = {}
+    relationships = {}
+    for part_data in parts:
+        if not part_data:
+            continue
+        for concept in part_data.get("concepts", []):
+            if not isinstance(concept, dict) or not concept.get("name"):
+                continue
+            current = concepts.get(concept["name"])
+            if current is None or (is_placeholder_concept(current) and not is_placeholder_concept(concept)):
+                concepts[concept["name"]] = dict(concept)
+            elif not is_placeholder_concept(concept):
+                questions = current.setdefault("questions", [])
+                for question in concept.get("questions", []):
+                    if question not in questions:
+                        questions.append(question)
+        for rel in part_data.get("relationships", []):
+            if isinstance(rel, dict):
+                relationships.setdefault((rel.get("source"), rel.get("target"), rel.get("type")), rel)
+
+    # Понятия, которые не вернула ни одна часть, добавляем с минимальной информацией
+    all_missing = [name for name in all_concepts if name not in concepts]
+    if all_missing:
+        print(f"ВНИМАНИЕ: {len(all_missing)} понятий не были обработаны ни в одной части: {', '.join(all_missing)}")
+        for missing in all_missing:
+            concepts[missing] = {
+                "name": missing,
+                "definition": "Определение понятия не получено в результате анализа",
+                "example": "Пример не получен в результате анализа",
+                "questions": ["Вопрос на понимание понятия не сформулирован"]
+            }
+
+    return {
+        "main_ideas": select_main_ideas(parts),  # Не более 3 главных идей
+        "concepts": list(concepts.values()),
+        "relationships": list(relationships.values())
+    }
+
+def assign_concepts_to_windows(content, windows, concepts):
+    """
+    Распределяет понятия по окнам главы: каждое понятие попадает в окно, где оно упоминается
+    впервые (обычно там же дается определение). Понятия без упоминаний попадают в последнее
+    окно, где обычно находится саммари раздела
+    """
+    index = MentionIndex(content, concepts, limit=1)
+    assigned = [[] for _ in windows]
+    for name in concepts:
+        offsets = index.offsets(name)
+        window_index = len(windows) - 1
+        if offsets:
+            position = offsets[0][0]
+            for j, (start, end) in enumerate(windows):
+                if position < end:
+                    window_index = j
+                    break
+        assigned[window_index].append(name)
+    return assigned
+
+# Функция для анализа больших глав с разбиением на части
+def analyze_large_chapter(chapter, all_concepts):
+    """
+    Анализирует главу, которая не помещается в один запрос (map-reduce).
+
+    Глава делится на окна по границам абзацев (не больше CHAPTER_WINDOW_TOKENS токенов).
+    Если список понятий известен, каждое понятие анализируется один раз - в окне, где оно
+    впервые упоминается, группами не больше CONCEPTS_PER_GROUP; окна без понятий из списка
+    (или все окна, если список пуст) анализируются целиком, чтобы не потерять их главные мысли
+    и связи. Части обрабатываются параллельно и объединяются в один анализ; части, анализ
+    которых не удался, в объединение не попадают
+    """
+    content = chapter['content']
+    windows = split_into_windows(content, CHAPTER_WINDOW_TOKENS)
+    print(f"Глава слишком большая или содержит слишком много понятий. "
+          f"Разбиваем на {len(windows)} частей по {CHAPTER_WINDOW_TOKENS} токенов.")
+    
+    tasks = []
+    all_concepts = list(dict.fromkeys(all_concepts))
+    if all_concepts:
+        assigned = assign_concepts_to_windows(content, windows, all_concepts)
+        for (start, end), names in zip(windows, assigned):
+            if not names:
+                tasks.append((content[start:end], []))
+            for k in range(0, len(names), CONCEPTS_PER_GROUP):
+                tasks.append((content[start:end], names[k:k + CONCEPTS_PER_GROUP]))
+        groups_count = sum(1 for _, names in tasks if names)
+        print(f"Разделили {len(all_concepts)} понятий на {groups_count} групп по частям главы, "
+              f"{len(tasks) - groups_count} частей без понятий из списка анализируются целиком")
     else:
-        # Если понятий не слишком много, но глава большая, просто уменьшаем размер текста
-        print("Глава слишком большая, анализируем только первую часть")
-        chapter_copy = chapter.copy()
-        chapter_copy['content'] = chapter['content'][:7000]  # Берем только первые 7000 символов
-        return analyze_chapter_with_grok(chapter_copy)  # Рекурсивный вызов с уменьшенным содержимым
+        tasks = [(content[start:end], []) for start, end in windows]
+    
+    def analyze_part(task_index):
+        window_text, concept_group = tasks[task_index]
+        if concept_group:
+            return analyze_concept_group(chapter, concept_group, task_index, len(tasks), window_text)
+        # В окне нет понятий из списка - анализируем его одним запросом, как отдельную главу
+        print(f"Анализ части {task_index+1}/{len(tasks)} главы {chapter['title']}")
+        return analyze_chapter_single_call({"title": chapter["title"], "content": window_text}, [],
+                                           placeholder_on_error=False)
+    
+    # Части отправляются одновременно, темп запросов ограничивает общий лимитер llm_client
+    with ThreadPoolExecutor(max_workers=max(1, min(len(tasks), GROUP_CONCURRENCY))) as executor:
+        parts = list(executor.map(analyze_part, range(len(tasks))))
+    
+    failed = sum(1 for part_data in parts if part_data is None)
+    if failed == len(parts):
+        print(f"Не удалось проанализировать ни одну часть главы {chapter['title']}. Возвращаем базовый шаблон")
+        return placeholder_analysis(f"Не удалось проанализировать главу {chapter['title']}",
+                                    "после нескольких попыток", all_concepts)
+    if failed:
+        print(f"ВНИМАНИЕ: не удалось проанализировать {failed} из {len(parts)} частей главы {chapter['title']}")
+    
+    # Объединяем результаты частей в исходном порядке
+    result = merge_chapter_parts(parts, all_concepts)
+    print(f"Итоговый результат содержит {len(result['concepts'])} понятий из {len(all_concepts)} исходных")
+    
+    if all_concepts:
+        result["all_found_concepts"] = all_concepts
+    
+    # Генерируем дополнительные связи между понятиями, если их мало
+    return generate_additional_relationships(result)
+
+# Функция для анализа одной главы с обработкой ошибок и тайм-аута
+def analyze_chapter_safely(chapter, i, total):
+    """Анализирует главу и всегда возвращает словарь анализа (при ошибке - с описанием ошибки)"""
+    print(f"\nАнализ главы {i+1}/{total}: {chapter['title']}")
+    
+    # Добавляем тайм-аут для всего процесса анализа главы
+    max_chapter_time = 600  # макс. 10 минут на главу (увеличено с 5 минут)
+    start_time = time.time()
+    
+    try:
+        with metrics.span("chapter.analyze"):
+            chapter_analysis = analyze_chapter_with_grok(chapter)
+        
+        # Проверка тайм-аута
+        if time.time() - start_time > max_chapter_time:
+            print(f"Превышено время анализа главы {chapter['title']} ({max_chapter_time} сек). Принудительно завершаем анализ.")
+            # Создаем пустой анализ с сообщением об ошибке
+            chapter_analysis = {
+                "main_ideas": [f"Превышено время анализа главы {chapter['title']}"],
+                "concepts": [],
+                "relationships": []
+            }
+    except Exception as e:
+        print(f"КРИТИЧЕСКАЯ ОШИБКА при анализе главы {chapter['title']}: {str(e)}")
+        chapter_analysis = {
+            "main_ideas": [f"Критическая ошибка при анализе главы {chapter['title']}: {str(e)}"],
+            "concepts": [],
+            "relationships": []
+        }
+    
+    # Если chapter_analysis всё равно None, создаем пустой анализ
+    if chapter_analysis is None:
+        print(f"Ошибка: analyze_chapter_with_grok вернул None для главы {chapter['title']}")
+        chapter_analysis = {
+            "main_ideas": [f"Ошибка анализа главы {chapter['title']}"],
+            "concepts": [],
+            "relationships": []
+        }
+    
+    # Генерация дополнительных связей между понятиями
+    return generate_additional_relationships(chapter_analysis)
+
+# Функция для сохранения промежуточных результатов анализа главы
+def save_chapter_analysis(chapter_analysis, i):
+    results_dir = "results"
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    
+    results_file = os.path.join(results_dir, f"chapter_{i+1}_analysis.json")
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(chapter_analysis, f, ensure_ascii=False, indent=2)
+    print(f"Результаты анализа сохранены в {results_file}")
+    return results_file
 
 def main():
     parser = argparse.ArgumentParser(description="Анализ курса с помощью Grok AI и запись в Neo4j")
@@ -931,8 +979,19 @@ def main():
     parser.add_argument("--course-format", type=str, default="auto", 
                         choices=["auto", "chapter-based", "glossary-based"],
                         help="Формат курса: auto - автоопределение, chapter-based - понятия в главах, glossary-based - список понятий в конце")
+    parser.add_argument("--chapter-concurrency", type=int, default=CHAPTER_CONCURRENCY,
+                        help=f"Количество глав, анализируемых одновременно (по умолчанию: {CHAPTER_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кеш ответов LLM")
+    parser.add_argument("--refresh", action="store_true", help="Не читать ответы из кеша, но обновлять его")
+    parser.add_argument("--resume", action="store_true",
+                        help="Продолжить прерванный запуск: пропустить уже проанализированные и загруженные главы")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="Файл для метрик запуска: .json или .prom (формат Prometheus); по умолчанию METRICS_FILE")
     args = parser.parse_args()
     
+    configure_cache(enabled=not args.no_cache, refresh=args.refresh)
+    metrics.setup(args.metrics_file)
+    
     course_name = args.course
     course_file = args.file
     
@@ -957,7 +1016,8 @@ def main():
         course_node = graph.nodes.match("Course", name=course_name).first()
         if not course_node:
             print(f"Создание узла для курса '{course_name}'...")
-            course_node = Node("Course", name=course_name, description=f"Курс {course_name}")
+            course_node = Node("Course", name=course_name, description=f"Курс {course_name}",
+                               updated_at=updated_at_now())
             graph.create(course_node)
         
         # Для курса с понятиями в главах используем обычный анализ
@@ -966,64 +1026,54 @@ def main():
             chapters = split_into_chapters(course_text)
             print(f"Найдено {len(chapters)} глав в курсе")
             
-            # Анализ каждой главы и сохранение результатов
-            chapters_data = []
+            # Журнал запуска позволяет продолжить прерванный анализ с флагом --resume
+            journal = RunJournal.for_run("adapter", course_name)
+            if not args.resume:
+                journal.reset()
+            
+            chapters_data = [None] * len(chapters)
+            pending = []
             for i, chapter in enumerate(chapters):
-                print(f"\nАнализ главы {i+1}/{len(chapters)}: {chapter['title']}")
-                
-                # Добавляем тайм-аут для всего процесса анализа главы
-                max_chapter_time = 600  # макс. 10 минут на главу (увеличено с 5 минут)
-                start_time = time.time()
-                
-                try:
-                    chapter_analysis = analyze_chapter_with_grok(chapter)
-                    
-                    # Проверка тайм-аута
-                    if time.time() - start_time > max_chapter_time:
-                        print(f"Превышено время анализа главы {chapter['title']} ({max_chapter_time} сек). Принудительно завершаем анализ.")
-                        # Создаем пустой анализ с сообщением об ошибке
-                        chapter_analysis = {
-                            "main_ideas": [f"Превышено время анализа главы {chapter['title']}"],
-                            "concepts": [],
-                            "relationships": []
+                entry = journal.get(f"chapter:{i+1}", ANALYZED)
+                if entry and entry.get("title") == chapter["title"] and os.path.exists(entry["file"]):
+                    with open(entry["file"], "r", encoding="utf-8") as f:
+                        chapters_data[i] = {
+                            "title": chapter["title"],
+                            "analysis": json.load(f)
                         }
-                except Exception as e:
-                    print(f"КРИТИЧЕСКАЯ ОШИБКА при анализе главы {chapter['title']}: {str(e)}")
-                    chapter_analysis = {
-                        "main_ideas": [f"Критическая ошибка при анализе главы {chapter['title']}: {str(e)}"],
-                        "concepts": [],
-                        "relationships": []
-                    }
+                    print(f"Глава {i+1} уже проанализирована, результат загружен из {entry['file']}")
+                else:
+                    pending.append(i)
+            
+            # Анализ глав выполняется параллельно, файл каждой главы сохраняется по мере готовности
+            print(f"Анализ {len(pending)} глав в {args.chapter_concurrency} потоков")
+            with ThreadPoolExecutor(max_workers=max(1, args.chapter_concurrency)) as executor:
+                futures = {executor.submit(analyze_chapter_safely, chapters[i], i, len(chapters)): i
+                           for i in pending}
                 
-                # Если chapter_analysis всё равно None, создаем пустой анализ
-                if chapter_analysis is None:
-                    print(f"Ошибка: analyze_chapter_with_grok вернул None для главы {chapter['title']}")
-                    chapter_analysis = {
-                        "main_ideas": [f"Ошибка анализа главы {chapter['title']}"],
-                        "concepts": [],
-                        "relationships": []
+                for future in as_completed(futures):
+                    i = futures[future]
+                    chapter_analysis = future.result()
+                    
+                    # Результаты собираются в порядке глав, чтобы load_to_neo4j получил их как прежде
+                    chapters_data[i] = {
+                        "title": chapters[i]["title"],
+                        "analysis": chapter_analysis
                     }
-                
-                # Генерация дополнительных связей между понятиями
-                chapter_analysis = generate_additional_relationships(chapter_analysis)
-                
-                chapters_data.append({
-                    "title": chapter["title"],
-                    "analysis": chapter_analysis
-                })
-                
-                # Сохранение промежуточных результатов в JSON-файл
-                results_dir = "results"
-                if not os.path.exists(results_dir):
-                    os.makedirs(results_dir)
-                
-                results_file = os.path.join(results_dir, f"chapter_{i+1}_analysis.json")
-                with open(results_file, "w", encoding="utf-8") as f:
-                    json.dump(chapter_analysis, f, ensure_ascii=False, indent=2)
-                print(f"Результаты анализа сохранены в {results_file}")
+                    results_file = save_chapter_analysis(chapter_analysis, i)
+                    journal.mark(f"chapter:{i+1}", ANALYZED, title=chapters[i]["title"], file=results_file)
+            
+            # Главы, уже записанные в Neo4j при прошлом запуске, заменяем на None,
+            # чтобы load_to_neo4j пропустил их, сохранив нумерацию глав
+            chapters_to_load = [
+                None if journal.is_done(f"chapter:{i+1}", PERSISTED) else chapter_info
+                for i, chapter_info in enumerate(chapters_data)
+            ]
             
             # Загрузка результатов в Neo4j
-            load_to_neo4j(chapters_data, course_name)
+            with metrics.span("neo4j.load_course"):
+                load_to_neo4j(chapters_to_load, course_name,
+                              on_chapter_loaded=lambda i: journal.mark(f"chapter:{i+1}", PERSISTED))
             print(f"Анализ курса '{course_name}' успешно завершен и данные загружены в Neo4j")
         
         # Для курса с глоссарием в конце используем анализ понятий из глоссария
@@ -1043,15 +1093,16 @@ def main():
                                       definition=f"[Из глоссария курса '{course_name}']: Определение не найдено в тексте", 
                                       example=f"[Из глоссария курса '{course_name}']: Пример не найден в тексте", 
                                       questions=["Вопрос на понимание понятия не сформулирован"],
-                                      chapters_mentions={})
+                                      chapters_mentions={},
+                                      updated_at=updated_at_now())
                     graph.create(concept_node)
                     
                     # Связываем понятие с курсом
-                    rel = Relationship(concept_node, "PART_OF", course_node)
+                    rel = Relationship(concept_node, "PART_OF", course_node, updated_at=updated_at_now())
                     graph.create(rel)
                 elif not graph.exists(Relationship(concept_node, "PART_OF", course_node)):
                     # Если понятие уже существует, но не связано с текущим курсом
-                    rel = Relationship(concept_node, "PART_OF", course_node)
+                    rel = Relationship(concept_node, "PART_OF", course_node, updated_at=updated_at_now())
                     graph.create(rel)
             
             print(f"Все понятия из глоссария успешно добавлены в Neo4j")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import json
+
+# Схема ответа модели при анализе главы или группы понятий главы.
+# Передается в API как response_format (json_schema) и используется для проверки ответа.
+# В строгом режиме API все свойства должны быть перечислены в required.
+CONCEPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "definition": {"type": "string"},
+        "example": {"type": "string"},
+        "questions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["name", "definition", "example", "questions"],
+    "additionalProperties": False,
+}
+
+RELATIONSHIP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source": {"type": "string"},
+        "target": {"type": "string"},
+        "type": {"type": "string"},
+        "description": {"type": "string"},
+    },
+    "required": ["source", "target", "type", "description"],
+    "additionalProperties": False,
+}
+
+CHAPTER_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "main_ideas": {"type": "array", "items": {"type": "string"}},
+        "concepts": {"type": "array", "items": CONCEPT_SCHEMA},
+        "relationships": {"type": "array", "items": RELATIONSHIP_SCHEMA},
+    },
+    "required": ["main_ideas", "concepts", "relationships"],
+    "additionalProperties": False,
+}
+
+# Схема углубленного анализа одного понятия (analyze_concepts_in_depth.py)
+CONCEPT_DETAILS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "definition": {"type": "string"},
+        "chapter_variations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "chapter": {"type": "string"},
+                    "definition": {"type": "string"},
+                },
+                "required": ["chapter", "definition"],
+                "additionalProperties": False,
+            },
+        },
+        "example": {"type": "string"},
+        "questions": {"type": "array", "items": {"type": "string"}},
+        "related_concepts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "relationship_type": {"type": "string"},
+                    "description": {"type": "string"},
+                },
+                "required": ["name", "relationship_type", "description"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["name", "definition", "chapter_variations", "example", "questions", "related_concepts"],
+    "additionalProperties": False,
+}
+
+# Ответ с анализом нескольких понятий в одном запросе
+CONCEPT_DETAILS_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "concepts": {"type": "array", "items": CONCEPT_DETAILS_SCHEMA},
+    },
+    "required": ["concepts"],
+    "additionalProperties": False,
+}
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+}
+
+# Ответ в блоке ```json ... ``` (модели без поддержки response_format иногда его добавляют)
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+class SchemaError(ValueError):
+    """Ответ модели не является JSON или не соответствует схеме"""
+
+def response_format(name, schema):
+    """Параметр response_format запроса для структурированного ответа по схеме"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema},
+    }
+
+def validate(data, schema, path="$"):
+    """Возвращает список нарушений схемы (поддерживаются type, properties, required, items)"""
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(data, expected):
+        return [f"{path}: ожидается {schema['type']}, получено {type(data).__name__}"]
+
+    errors = []
+    if schema["type"] == "object":
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: нет обязательного поля {key}")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate(data[key], subschema, f"{path}.{key}"))
+    elif schema["type"] == "array" and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+def _load_json(content):
+    fence = _FENCE_RE.match(content)
+    if fence:
+        content = fence.group(1)
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        raise SchemaError(f"ответ не является JSON: {str(e)}")
+
+def parse_structured(content, schema):
+    """
+    Разбирает ответ модели и проверяет его по схеме.
+    Возвращает данные или выбрасывает SchemaError с описанием первых нарушений
+    """
+    data = _load_json(content)
+    errors = validate(data, schema)
+    if errors:
+        raise SchemaError("; ".join(errors[:5]))
+    return data
+
+def parse_chapter_analysis(content):
+    """
+    Разбирает ответ с анализом главы (или группы понятий главы) и возвращает словарь
+    с полями main_ideas, concepts и relationships. Понятия без названия отбрасываются
+    """
+    data = parse_structured(content, CHAPTER_ANALYSIS_SCHEMA)
+    return {
+        "main_ideas": data["main_ideas"],
+        "concepts": [concept for concept in data["concepts"] if concept["name"].strip()],
+        "relationships": data["relationships"],
+    }
+
+def parse_concept_details_list(content):
+    """
+    Разбирает ответ с анализом нескольких понятий: {"concepts": [...]} или просто массив.
+    Возвращает понятия, прошедшие проверку схемы (остальные отбрасываются);
+    если ответ не JSON или в нем нет массива понятий, выбрасывает SchemaError
+    """
+    data = _load_json(content)
+    if isinstance(data, dict):
+        data = data.get("concepts")
+    if not isinstance(data, list):
+        raise SchemaError("в ответе нет массива понятий")
+    return [item for item in data if not validate(item, CONCEPT_DETAILS_SCHEMA)]
@@ -4,13 +4,20 @@
 import json
 import os
 import re
-import time
-import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from py2neo import Graph, Node, Relationship, NodeMatcher, RelationshipMatcher
 from dotenv import load_dotenv
 from course_format_detector import get_course_format
 from extract_concepts import extract_course_concepts
+from llm_client import chat_completion, configure_cache, LLMError, LLM_MAX_OUTPUT_TOKENS
+from run_journal import RunJournal, ANALYZED, PERSISTED
+from neo4j_schema import warn_if_schema_missing, updated_at_now
+from mention_index import MentionIndex
+from json_stream import JSONStreamParser
+from analysis_schema import (CONCEPT_DETAILS_SCHEMA, CONCEPT_DETAILS_LIST_SCHEMA, SchemaError, response_format,
+                             validate, parse_structured, parse_concept_details_list)
+import metrics
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -24,6 +31,18 @@ NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 RESULTS_DIR = os.getenv("RESULTS_DIR", "results") + "/concepts"
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "20"))
 MAX_CONCEPTS_TO_ANALYZE = int(os.getenv("MAX_CONCEPTS_TO_ANALYZE", "500"))
+CONCEPT_CONCURRENCY = int(os.getenv("CONCEPT_CONCURRENCY", "1"))
+# Сколько понятий анализировать одним запросом (1 - каждое понятие отдельным запросом)
+CONCEPT_PACK_SIZE = int(os.getenv("CONCEPT_PACK_SIZE", "1"))
+# Раунды упакованного анализа: понятия, пропущенные моделью, отправляются в следующий раунд,
+# а после последнего раунда анализируются по одному
+PACK_MAX_ROUNDS = 2
+# Лимит токенов ответа на одно понятие пакета: размер пакета не больше LLM_MAX_OUTPUT_TOKENS / CONCEPT_OUTPUT_TOKENS
+CONCEPT_OUTPUT_TOKENS = 4000
+# Попытки получить ответ, прошедший проверку схемы
+SCHEMA_MAX_ATTEMPTS = 3
+CONCEPT_DETAILS_FORMAT = response_format("concept_details", CONCEPT_DETAILS_SCHEMA)
+CONCEPT_DETAILS_LIST_FORMAT = response_format("concept_details_list", CONCEPT_DETAILS_LIST_SCHEMA)
 AI_MODEL = os.getenv("AI_MODEL", "x-ai/grok-2-1212")
 
 # Проверка наличия необходимых переменных
@@ -46,7 +65,15 @@ def ensure_results_dir():
         print(f"Создана директория {RESULTS_DIR} для сохранения результатов")
 
 # Функция для получения всех понятий курса для анализа
-def get_undefined_concepts(course_name, graph=None):
+def get_undefined_concepts(course_name, graph=None, include_analyzed=False):
+    """
+    Возвращает понятия курса для анализа
+    
+    Parameters:
+    - course_name: название курса
+    - graph: существующее подключение к Neo4j (опционально)
+    - include_analyzed: вернуть и понятия, у которых уже есть AI анализ (повторный анализ)
+    """
     try:
         if not graph:
             graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
@@ -60,11 +87,12 @@ def get_undefined_concepts(course_name, graph=None):
         # Получаем все понятия, связанные с курсом
         cypher = """
         MATCH (c:Course {name: $course_name})<-[:PART_OF]-(concept:Concept)
+        WHERE $include_analyzed OR NOT coalesce(concept.definition, '') CONTAINS '[AI анализ всех определений]:'
         RETURN concept.name AS name, concept.definition as definition, concept.example as example, concept.chapters_mentions as chapters_mentions
         LIMIT $limit
         """
         
-        result = graph.run(cypher, course_name=course_name, limit=MAX_CONCEPTS_TO_ANALYZE).data()
+        result = graph.run(cypher, course_name=course_name, include_analyzed=include_analyzed, limit=MAX_CONCEPTS_TO_ANALYZE).data()
         
         # Теперь мы возвращаем все данные о понятиях, включая определения и упоминания по главам
         concepts_data = []
@@ -97,14 +125,15 @@ def get_undefined_concepts(course_name, graph=None):
         print(f"Ошибка при получении понятий: {str(e)}")
         return []
 
-# Функция для анализа понятия с учетом определений из разных глав
-def analyze_concept_with_api(concept_data, defined_concepts, course_text, course_name):
+def concept_prompt_context(concept_data, course_text, mention_index=None):
+    """
+    Собирает для промпта определения понятия из разных глав и контексты его упоминаний в тексте курса.
+    Возвращает (список определений и примеров по главам, текст упоминаний)
+    """
     concept_name = concept_data["name"]
     chapters_mentions = concept_data["chapters_mentions"]
     current_definition = concept_data.get("definition", "")
     
-    print(f"\nАнализ понятия: {concept_name}")
-    
     # Парсим существующее определение, чтобы извлечь определения по главам
     chapter_definitions = []
     
@@ -145,21 +174,24 @@ def analyze_concept_with_api(concept_data, defined_concepts, course_text, course
                 chapter_definitions.append(f"Пример из главы \"{chapter_title}\": \"{example}\"")
     
     # Контекст для анализа понятия
-    # Ищем контекст упоминания понятия в тексте курса
-    search_pattern = r'(?i)(?:[^\w]|^)' + re.escape(concept_name) + r'(?:[^\w]|$)'
-    matches = list(re.finditer(search_pattern, course_text))
-    
-    # Получаем контекст из каждого упоминания (300 символов до и после)
-    contexts = []
-    for match in matches[:5]:  # Ограничиваем количество контекстов
-        start = max(0, match.start() - 300)
-        end = min(len(course_text), match.end() + 300)
-        context = course_text[start:end]
-        contexts.append(context)
+    # Ищем контекст упоминания понятия в тексте курса (300 символов до и после первых 5 упоминаний)
+    if mention_index is None:
+        mention_index = MentionIndex(course_text, [concept_name])
+    contexts = mention_index.contexts(concept_name)
     
     # Объединяем контексты
     context_text = "\n---\n".join(contexts)
     
+    return chapter_definitions, context_text
+
+# Функция для анализа понятия с учетом определений из разных глав
+def analyze_concept_with_api(concept_data, defined_concepts, course_text, course_name, mention_index=None):
+    concept_name = concept_data["name"]
+    
+    print(f"\nАнализ понятия: {concept_name}")
+    
+    chapter_definitions, context_text = concept_prompt_context(concept_data, course_text, mention_index)
+    
     # Список уже определенных понятий для использования в промпте
     defined_list = ", ".join([c["name"] for c in defined_concepts[:30]])
     
@@ -207,121 +239,142 @@ def analyze_concept_with_api(concept_data, defined_concepts, course_text, course
     Мне нужно единое полное определение, которое объединяет и учитывает все аспекты понятия из разных глав.
     """
     
-    # API запрос к Grok через OpenRouter
-    max_attempts = 3
-    for attempt in range(max_attempts):
+    # API запрос к Grok через OpenRouter со структурированным ответом по схеме
+    # Сетевые ошибки, 429 и 5xx повторяет llm_client; здесь сразу повторяем только ответы, не прошедшие проверку схемы
+    for attempt in range(SCHEMA_MAX_ATTEMPTS):
+        print(f"Попытка {attempt + 1} из {SCHEMA_MAX_ATTEMPTS} запроса к API")
         try:
-            print(f"Попытка {attempt + 1} из {max_attempts} запроса к API")
-            
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://adapter-course.ru",
-                    "X-Title": "Adapter Course",
-                },
-                json={
-                    "model": AI_MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 8000,
-                    "temperature": 0.7
-                },
-                timeout=180
-            )
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                if "choices" in response_data and len(response_data["choices"]) > 0:
-                    message_content = response_data["choices"][0]["message"]["content"]
-                    
-                    # Попытка извлечь JSON из ответа
-                    try:
-                        # Найти JSON в ответе
-                        json_pattern = r'```json\s*([\s\S]*?)\s*```|```\s*([\s\S]*?)\s*```|(\{[\s\S]*\})'
-                        json_match = re.search(json_pattern, message_content)
-                        
-                        if json_match:
-                            # Определяем, какая группа содержит JSON
-                            for group in range(1, 4):
-                                if json_match.group(group):
-                                    json_str = json_match.group(group)
-                                    break
-                        else:
-                            # Если не нашли JSON в кодовых блоках, попробуем найти объект напрямую
-                            json_str = message_content
-                        
-                        # Очистка от возможных дополнительных символов
-                        json_str = json_str.strip()
-                        
-                        # Пытаемся распарсить JSON
-                        try:
-                            result = json.loads(json_str)
-                        except json.JSONDecodeError as e:
-                            print(f"Ошибка при разборе JSON: {str(e)}. Пытаемся восстановить частичный ответ.")
-                            
-                            # Пытаемся восстановить частичный JSON
-                            start_brace = json_str.find('{')
-                            end_brace = json_str.rfind('}')
-                            
-                            if start_brace != -1 and end_brace != -1 and end_brace > start_brace:
-                                json_str_fixed = json_str[start_brace:end_brace+1]
-                                
-                                try:
-                                    # Исправляем обрывающиеся массивы и объекты
-                                    json_str_fixed = re.sub(r',\s*]', ']', json_str_fixed)
-                                    json_str_fixed = re.sub(r',\s*}', '}', json_str_fixed)
-                                    
-                                    result = json.loads(json_str_fixed)
-                                    print("JSON успешно восстановлен после обработки!")
-                                except json.JSONDecodeError:
-                                    # Если всё ещё не работает, проверяем минимальную структуру
-                                    base_pattern = r'\{\s*"name"\s*:\s*"([^"]+)"\s*,\s*"definition"\s*:\s*"([^"]+)"'
-                                    match = re.search(base_pattern, json_str)
-                                    
-                                    if match:
-                                        # Создаем минимальный валидный JSON с основными полями
-                                        name = match.group(1)
-                                        definition = match.group(2)
-                                        
-                                        result = {
-                                            "name": name,
-                                            "definition": definition,
-                                            "example": "Пример не удалось восстановить из частичного ответа",
-                                            "questions": ["Вопросы не удалось восстановить из частичного ответа"],
-                                            "related_concepts": []
-                                        }
-                                        print(f"Создан минимальный валидный JSON для понятия '{name}'")
-                                    else:
-                                        raise
-                            else:
-                                raise
-                                
-                        print(f"Анализ понятия '{concept_name}' успешно завершен")
-                        return result
-                    except json.JSONDecodeError:
-                        print(f"Не удалось извлечь JSON из ответа API. Попытка {attempt + 1}")
-                        print("Ответ API:", message_content[:100] + "..." if len(message_content) > 100 else message_content)
-                else:
-                    print(f"Отсутствуют данные в ответе API. Попытка {attempt + 1}")
-            else:
-                print(f"Ошибка API запроса: {response.status_code}. Попытка {attempt + 1}")
-                print(response.text)
-            
-            # Если это была не последняя попытка, подождем перед следующей
-            if attempt < max_attempts - 1:
-                time.sleep(5 * (attempt + 1))  # Увеличиваем время ожидания с каждой попыткой
-                
-        except Exception as e:
-            print(f"Ошибка при выполнении API запроса: {str(e)}. Попытка {attempt + 1}")
-            
-            # Если это была не последняя попытка, подождем перед следующей
-            if attempt < max_attempts - 1:
-                time.sleep(5 * (attempt + 1))
+            # При повторной попытке не берем ответ из кеша: закешированный ответ не прошел проверку
+            message_content = chat_completion(prompt, max_tokens=8000, temperature=0.7, timeout=180,
+                                              refresh=attempt > 0, response_format=CONCEPT_DETAILS_FORMAT)
+        except LLMError as e:
+            print(f"Ошибка при выполнении API запроса: {str(e)}")
+            return None
+        
+        with metrics.span("json.parse"):
+            try:
+                result = parse_structured(message_content, CONCEPT_DETAILS_SCHEMA)
+            except SchemaError as e:
+                metrics.count("json.schema_violations")
+                print(f"Ответ для понятия '{concept_name}' не соответствует схеме: {str(e)}")
+                continue
+        
+        print(f"Анализ понятия '{concept_name}' успешно завершен")
+        return result
     
-    print(f"Не удалось проанализировать понятие '{concept_name}' после {max_attempts} попыток")
+    metrics.count("json.failed")
+    print(f"Не удалось проанализировать понятие '{concept_name}' после {SCHEMA_MAX_ATTEMPTS} попыток")
     return None
 
+def normalize_concept_name(name):
+    """Название понятия для сопоставления ответа модели с запрошенными понятиями"""
+    return " ".join(name.lower().replace("ё", "е").split())
+
+# Функция для анализа нескольких понятий одним запросом
+def analyze_concepts_packed(concepts, defined_concepts, course_text, course_name, mention_index=None, refresh=False):
+    """
+    Анализирует несколько понятий одним запросом: общая часть промпта (инструкции, список
+    понятий курса и формат ответа) отправляется один раз, а модель возвращает массив объектов
+    того же формата, что и при анализе одного понятия.
+
+    Возвращает словарь {название понятия: результат} только для понятий, которые модель вернула
+    и которые прошли проверку схемы. Пропущенные понятия вызывающий код отправляет повторно.
+    Если ответ оборван, используются понятия, полученные целиком
+    """
+    names = [c["name"] for c in concepts]
+    print(f"\nАнализ {len(names)} понятий одним запросом: {', '.join(names)}")
+    
+    # Список уже определенных понятий для использования в промпте
+    defined_list = ", ".join([c["name"] for c in defined_concepts[:30]])
+    quoted_names = ", ".join(f'"{name}"' for name in names)
+    
+    prompt = f"""
+    Ты эксперт по системному мышлению. Я прохожу курс '{course_name}' и хочу лучше понять понятия: {quoted_names}.
+    
+    В курсе также используются следующие понятия: {defined_list}
+    """
+    
+    for concept_data in concepts:
+        chapter_definitions, context_text = concept_prompt_context(concept_data, course_text, mention_index)
+        prompt += f"""
+    === Понятие "{concept_data['name']}" ===
+    """
+        # Если есть определения из разных глав, включаем их в промпт
+        if chapter_definitions:
+            prompt += f"""
+    Вот как это понятие определяется в разных главах курса:
+    
+    {chr(10).join(chapter_definitions)}
+    """
+        prompt += f"""
+    Вот несколько упоминаний этого понятия в тексте курса:
+    
+    {context_text}
+    """
+    
+    prompt += f"""
+    Пожалуйста, дай мне информацию о каждом из этих понятий ({len(names)}) в следующем JSON-формате:
+    
+    {{
+        "concepts": [
+            {{
+                "name": "название понятия точно как в списке выше",
+                "definition": "полное определение понятия, учитывающее все контексты из разных глав",
+                "chapter_variations": [
+                    {{"chapter": "название главы", "definition": "определение в контексте этой главы"}}
+                ],
+                "example": "наиболее ясный практический пример использования понятия",
+                "questions": ["вопрос для проверки понимания 1", "вопрос для проверки понимания 2", "вопрос для проверки понимания 3"],
+                "related_concepts": [
+                    {{"name": "связанное понятие 1", "relationship_type": "тип связи", "description": "описание связи"}},
+                    {{"name": "связанное понятие 2", "relationship_type": "тип связи", "description": "описание связи"}}
+                ]
+            }}
+        ]
+    }}
+    
+    В массиве concepts должен быть ровно один объект для каждого понятия: {quoted_names}.
+    
+    Типы связей могут быть: RELATES_TO, PART_OF, IS_A, PREREQUISITE_FOR, EXAMPLE_OF, CONTRASTS_WITH, EVOLVED_FROM, USED_IN.
+    
+    Твоя задача - помочь мне глубоко понять эти понятия во всех их контекстах и связать их с другими понятиями курса.
+    Особенно обрати внимание на различия в определениях каждого понятия в разных главах, если они есть.
+    Для каждого понятия мне нужно единое полное определение, которое объединяет и учитывает все аспекты понятия из разных глав.
+    """
+    
+    # Ответ на несколько понятий длиннее: лимит токенов растет с размером пакета, но не выше лимита модели
+    stream_parser = JSONStreamParser(("concepts",))
+    try:
+        content = chat_completion(prompt, max_tokens=min(CONCEPT_OUTPUT_TOKENS * len(names), LLM_MAX_OUTPUT_TOKENS),
+                                  temperature=0.7, timeout=300,
+                                  refresh=refresh, stream_handler=stream_parser,
+                                  response_format=CONCEPT_DETAILS_LIST_FORMAT)
+    except LLMError as e:
+        print(f"Ошибка при выполнении API запроса: {str(e)}")
+        return {}
+    
+    with metrics.span("json.parse"):
+        try:
+            items = parse_concept_details_list(content)
+        except SchemaError as e:
+            metrics.count("json.schema_violations")
+            print(f"Ответ на пакет понятий не разобран: {str(e)}")
+            # Если ответ оборван, используем понятия, полученные целиком
+            items = [item for item in stream_parser.items["concepts"] if not validate(item, CONCEPT_DETAILS_SCHEMA)]
+            if items:
+                metrics.count("json.salvaged")
+    
+    requested = {normalize_concept_name(name): name for name in names}
+    results = {}
+    for item in items:
+        name = requested.get(normalize_concept_name(item["name"]))
+        if name is not None and name not in results:
+            # Понятие записывается в базу под тем названием, под которым оно было запрошено
+            item["name"] = name
+            results[name] = item
+    print(f"Получен анализ {len(results)} из {len(names)} понятий пакета")
+    return results
+
 # Функция для обновления понятия в базе данных
 def update_concept_in_db(concept_data, course_name, graph=None):
     if not graph:
@@ -341,6 +394,9 @@ def update_concept_in_db(concept_data, course_name, graph=None):
         concept_name = concept_data["name"]
         concept_node = matcher.match("Concept", name=concept_name).first()
         
+        # Время изменения для инкрементных резервных копий
+        updated_at = updated_at_now()
+        
         if not concept_node:
             # Создаем новый узел с пометкой об источнике определения
             ai_definition = f"[AI анализ всех определений]: {concept_data.get('definition', '')}"
@@ -350,7 +406,8 @@ def update_concept_in_db(concept_data, course_name, graph=None):
                               name=concept_name,
                               definition=ai_definition,
                               example=ai_example,
-                              questions=concept_data.get("questions", []))
+                              questions=concept_data.get("questions", []),
+                              updated_at=updated_at)
             # Сохраняем chapter_variations как JSON строку, если они есть
             if "chapter_variations" in concept_data:
                 concept_node["chapter_variations"] = json.dumps(concept_data["chapter_variations"], ensure_ascii=False)
@@ -361,7 +418,8 @@ def update_concept_in_db(concept_data, course_name, graph=None):
             
             # Создаем связь с курсом
             course_rel = Relationship(concept_node, "PART_OF", course,
-                                    description=f"Понятие {concept_name} является частью курса {course_name}")
+                                    description=f"Понятие {concept_name} является частью курса {course_name}",
+                                    updated_at=updated_at)
             graph.create(course_rel)
             print(f"Создан новый узел понятия '{concept_name}'")
         else:
@@ -391,6 +449,7 @@ def update_concept_in_db(concept_data, course_name, graph=None):
             if "chapter_variations" in concept_data:
                 concept_node["chapter_variations"] = json.dumps(concept_data["chapter_variations"], ensure_ascii=False)
             
+            concept_node["updated_at"] = updated_at
             graph.push(concept_node)
             print(f"Обновлен узел понятия '{concept_name}'")
         
@@ -407,14 +466,15 @@ def update_concept_in_db(concept_data, course_name, graph=None):
             # Находим или создаем связанное понятие
             related_node = matcher.match("Concept", name=related_name).first()
             if not related_node:
-                related_node = Node("Concept", name=related_name)
+                related_node = Node("Concept", name=related_name, updated_at=updated_at)
                 # Инициализируем chapters_mentions как пустой JSON объект
                 related_node["chapters_mentions"] = json.dumps({})
                 graph.create(related_node)
                 
                 # Создаем связь с курсом
                 course_rel = Relationship(related_node, "PART_OF", course,
-                                        description=f"Понятие {related_name} является частью курса {course_name}")
+                                        description=f"Понятие {related_name} является частью курса {course_name}",
+                                        updated_at=updated_at)
                 graph.create(course_rel)
                 
                 print(f"Создан новый узел для связанного понятия '{related_name}'")
@@ -422,7 +482,8 @@ def update_concept_in_db(concept_data, course_name, graph=None):
             # Проверяем, существует ли уже связь между понятиями
             existing_rel = rel_matcher.match((concept_node, related_node), r_type=rel_type).first()
             if not existing_rel:
-                rel = Relationship(concept_node, rel_type, related_node, description=description)
+                rel = Relationship(concept_node, rel_type, related_node, description=description,
+                                   updated_at=updated_at)
                 graph.create(rel)
                 relationship_count += 1
         
@@ -433,8 +494,25 @@ def update_concept_in_db(concept_data, course_name, graph=None):
         print(f"Ошибка при обновлении понятия в Neo4j: {str(e)}")
         return False
 
+# Функция для сохранения результата анализа понятия
+def save_concept_result(result, concept_name, course_name, graph, journal=None):
+    """Записывает результат анализа понятия в JSON-файл и в Neo4j, отмечая оба шага в журнале запуска"""
+    # Сохраняем результат в файл
+    file_path = os.path.join(RESULTS_DIR, f"{concept_name.replace(' ', '_')}.json")
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    print(f"Результаты для понятия '{concept_name}' сохранены в {file_path}")
+    if journal:
+        journal.mark(f"concept:{concept_name}", ANALYZED, file=file_path)
+    
+    # Обновляем понятие в базе данных
+    if update_concept_in_db(result, course_name, graph) and journal:
+        journal.mark(f"concept:{concept_name}", PERSISTED)
+
 # Функция для анализа пакета понятий
-def analyze_batch_of_concepts(concepts_data, course_text, course_name, graph=None):
+def analyze_batch_of_concepts(concepts_data, course_text, course_name, graph=None, concurrency=1, journal=None, mention_index=None,
+                              pack_size=1):
     """
     Анализирует пакет понятий и сохраняет результаты
     
@@ -443,52 +521,163 @@ def analyze_batch_of_concepts(concepts_data, course_text, course_name, graph=Non
     - course_text: текст курса
     - course_name: название курса
     - graph: существующее подключение к Neo4j (опционально)
+    - concurrency: количество понятий, анализируемых одновременно
+    - journal: журнал запуска для продолжения прерванного анализа (опционально)
+    - mention_index: индекс упоминаний понятий в тексте курса (опционально, иначе строится по пакету)
+    - pack_size: количество понятий в одном запросе к API (1 - каждое понятие отдельным запросом)
     """
     if not graph:
         graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
     
     ensure_results_dir()
     
-    # Анализируем каждое понятие по отдельности
-    for concept_data in concepts_data:
-        concept_name = concept_data["name"]
+    if mention_index is None:
+        mention_index = MentionIndex(course_text, [c["name"] for c in concepts_data])
+    
+    def analyze(concept_data):
         # Отфильтровываем текущее понятие из списка для связей
-        other_concepts = [c for c in concepts_data if c["name"] != concept_name]
-        
-        # Анализируем понятие
-        try:
-            result = analyze_concept_with_api(concept_data, other_concepts, course_text, course_name)
+        other_concepts = [c for c in concepts_data if c["name"] != concept_data["name"]]
+        with metrics.span("concept.analyze"):
+            return analyze_concept_with_api(concept_data, other_concepts, course_text, course_name, mention_index)
+    
+    def analyze_pack(pack, refresh):
+        # Отфильтровываем понятия пакета из списка для связей
+        pack_names = {c["name"] for c in pack}
+        other_concepts = [c for c in concepts_data if c["name"] not in pack_names]
+        with metrics.span("concept.analyze_pack"):
+            return analyze_concepts_packed(pack, other_concepts, course_text, course_name, mention_index, refresh)
+    
+    # Понятия, уже обработанные в прерванном запуске, не отправляем в API повторно
+    pending_concepts = []
+    for concept_data in concepts_data:
+        unit = f"concept:{concept_data['name']}"
+        if journal and journal.is_done(unit, PERSISTED):
+            print(f"Понятие '{concept_data['name']}' уже проанализировано и записано в Neo4j, пропускаем")
+            continue
+        entry = journal.get(unit, ANALYZED) if journal else None
+        if entry and os.path.exists(entry["file"]):
+            # Анализ сохранен в файл, но не записан в базу - записываем без запроса к API
+            with open(entry["file"], 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            if update_concept_in_db(result, course_name, graph):
+                journal.mark(unit, PERSISTED)
+            continue
+        pending_concepts.append(concept_data)
+    
+    if pack_size > 1:
+        pending_concepts = analyze_packs(pending_concepts, analyze_pack, pack_size, concurrency,
+                                         lambda result, name: save_concept_result(result, name, course_name, graph, journal))
+        if pending_concepts:
+            print(f"Анализируем по одному {len(pending_concepts)} понятий, пропущенных в ответах на пакеты")
+    
+    if concurrency <= 1:
+        # Анализируем каждое понятие по отдельности
+        for concept_data in pending_concepts:
+            concept_name = concept_data["name"]
             
-            if result:
-                # Обновляем понятие в базе данных
-                update_concept_in_db(result, course_name, graph)
-                
-                # Сохраняем результат в файл
-                file_path = os.path.join(RESULTS_DIR, f"{concept_name.replace(' ', '_')}.json")
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(result, f, ensure_ascii=False, indent=2)
+            # Анализируем понятие
+            try:
+                result = analyze(concept_data)
                 
-                print(f"Результаты для понятия '{concept_name}' сохранены в {file_path}")
+                if result:
+                    save_concept_result(result, concept_name, course_name, graph, journal)
+                else:
+                    print(f"Не удалось проанализировать понятие '{concept_name}'")
+            except Exception as e:
+                print(f"Ошибка при анализе понятия '{concept_name}': {str(e)}")
+        
+        return True
+    
+    # Параллельный режим: запросы к API выполняются в пуле потоков,
+    # а запись в Neo4j и файлы идет только из текущего потока, поэтому записи не конкурируют
+    print(f"Параллельный анализ {len(pending_concepts)} понятий в {concurrency} потоков")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(analyze, concept_data): concept_data["name"] for concept_data in pending_concepts}
+        
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            concept_name = futures[future]
+            try:
+                result = future.result()
                 
-                # Пауза между запросами к API, чтобы не превысить лимиты
-                time.sleep(2)
-            else:
-                print(f"Не удалось проанализировать понятие '{concept_name}'")
-        except Exception as e:
-            print(f"Ошибка при анализе понятия '{concept_name}': {str(e)}")
+                if result:
+                    save_concept_result(result, concept_name, course_name, graph, journal)
+                else:
+                    print(f"Не удалось проанализировать понятие '{concept_name}'")
+            except Exception as e:
+                print(f"Ошибка при анализе понятия '{concept_name}': {str(e)}")
+            
+            print(f"Обработано {done_count}/{len(futures)} понятий пакета")
     
     return True
 
-def analyze_all_undefined_concepts(course_name, course_file=None):
+def max_pack_size():
+    """Сколько понятий помещается в один ответ модели (LLM_MAX_OUTPUT_TOKENS)"""
+    return max(1, LLM_MAX_OUTPUT_TOKENS // CONCEPT_OUTPUT_TOKENS)
+
+def analyze_packs(pending_concepts, analyze_pack, pack_size, concurrency, save):
+    """
+    Анализирует понятия пакетами по pack_size в один запрос. Понятия, которые модель пропустила
+    в ответе, автоматически отправляются в пакеты следующего раунда (при повторе ответ не берется
+    из кеша). Результаты записываются через save(result, name) из текущего потока.
+    Возвращает понятия, не проанализированные за PACK_MAX_ROUNDS раундов
+    """
+    for round_index in range(PACK_MAX_ROUNDS):
+        if not pending_concepts:
+            break
+        packs = [pending_concepts[i:i + pack_size] for i in range(0, len(pending_concepts), pack_size)]
+        print(f"Раунд {round_index + 1}: {len(pending_concepts)} понятий в {len(packs)} запросах по {pack_size}")
+        
+        analyzed = set()
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(packs)))) as executor:
+            futures = {executor.submit(analyze_pack, pack, round_index > 0): pack for pack in packs}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Ошибка при анализе пакета понятий: {str(e)}")
+                    continue
+                for name, result in results.items():
+                    try:
+                        save(result, name)
+                        analyzed.add(name)
+                    except Exception as e:
+                        print(f"Ошибка при сохранении понятия '{name}': {str(e)}")
+        
+        # Пропущенные понятия повторяем в исходном порядке, чтобы состав пакетов не зависел от порядка ответов
+        missing = [c for c in pending_concepts if c["name"] not in analyzed]
+        if missing:
+            metrics.count("concept.requeued", len(missing))
+            print(f"Модель пропустила {len(missing)} понятий: {', '.join(c['name'] for c in missing)}")
+        pending_concepts = missing
+    return pending_concepts
+
+def analyze_all_undefined_concepts(course_name, course_file=None, concurrency=1, resume=False, pack_size=1,
+                                   redo=False):
     """
     Анализирует все понятия курса, которые требуют дополнительного анализа
     
     Parameters:
     - course_name: название курса
     - course_file: путь к файлу курса (опционально)
+    - concurrency: количество понятий, анализируемых одновременно
+    - resume: продолжить прерванный запуск, пропуская уже обработанные понятия
+    - pack_size: количество понятий в одном запросе к API
+    - redo: заново анализировать и понятия, у которых уже есть AI анализ
     """
+    # Размер пакета выбирается по лимиту ответа модели, а не наоборот
+    if pack_size > max_pack_size():
+        print(f"Размер пакета уменьшен с {pack_size} до {max_pack_size()}: ответ на {pack_size} понятий "
+              f"не помещается в LLM_MAX_OUTPUT_TOKENS={LLM_MAX_OUTPUT_TOKENS}")
+        pack_size = max_pack_size()
+    
+    # Журнал запуска
+    journal = RunJournal.for_run("analyze_concepts", course_name)
+    if not resume:
+        journal.reset()
+    
     # Подключение к Neo4j
     graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    warn_if_schema_missing(graph)
     
     # Получение текста курса
     course_text = ""
@@ -499,12 +688,15 @@ def analyze_all_undefined_concepts(course_name, course_file=None):
             return False
     
     # Получаем все понятия курса для анализа
-    concepts_data = get_undefined_concepts(course_name, graph)
+    concepts_data = get_undefined_concepts(course_name, graph, include_analyzed=redo)
     
     if not concepts_data:
         print(f"Все понятия курса '{course_name}' уже имеют определения")
         return True
     
+    # Индекс упоминаний строится один раз на весь текст курса для всех понятий
+    mention_index = MentionIndex(course_text, [c["name"] for c in concepts_data])
+    
     # Если количество понятий превышает BATCH_SIZE, разбиваем на пакеты
     if len(concepts_data) > BATCH_SIZE:
         print(f"Разбиваем {len(concepts_data)} понятий на пакеты по {BATCH_SIZE}")
@@ -512,10 +704,12 @@ def analyze_all_undefined_concepts(course_name, course_file=None):
         
         for i, batch in enumerate(batches):
             print(f"\nАнализ пакета {i+1}/{len(batches)} ({len(batch)} понятий)")
-            analyze_batch_of_concepts(batch, course_text, course_name, graph)
+            analyze_batch_of_concepts(batch, course_text, course_name, graph, concurrency, journal, mention_index,
+                                      pack_size)
     else:
         # Анализируем все понятия сразу
-        analyze_batch_of_concepts(concepts_data, course_text, course_name, graph)
+        analyze_batch_of_concepts(concepts_data, course_text, course_name, graph, concurrency, journal, mention_index,
+                                  pack_size)
     
     print(f"Углубленный анализ понятий для курса '{course_name}' завершен")
     return True
@@ -548,10 +742,24 @@ def parse_args():
                         help='Формат курса: auto - автоопределение, chapter-based - понятия в главах, glossary-based - список понятий в конце')
     parser.add_argument('--extract-concepts', action='store_true', 
                         help='Извлечь понятия из курса и добавить их в базу данных без их анализа')
+    parser.add_argument('--concurrency', type=int, default=CONCEPT_CONCURRENCY,
+                        help=f'Количество понятий, анализируемых одновременно (по умолчанию: {CONCEPT_CONCURRENCY})')
+    parser.add_argument('--pack-size', type=int, default=CONCEPT_PACK_SIZE,
+                        help=f'Количество понятий, анализируемых одним запросом к API (по умолчанию: {CONCEPT_PACK_SIZE})')
+    parser.add_argument('--no-cache', action='store_true', help='Не использовать кеш ответов LLM')
+    parser.add_argument('--refresh', action='store_true', help='Не читать ответы из кеша, но обновлять его')
+    parser.add_argument('--resume', action='store_true',
+                        help='Продолжить прерванный запуск: пропустить уже проанализированные и записанные понятия')
+    parser.add_argument('--redo', action='store_true',
+                        help='Заново проанализировать и понятия, у которых уже есть AI анализ')
+    parser.add_argument('--metrics-file', type=str, default=None,
+                        help='Файл для метрик запуска: .json или .prom (формат Prometheus); по умолчанию METRICS_FILE')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
+    configure_cache(enabled=not args.no_cache, refresh=args.refresh)
+    metrics.setup(args.metrics_file)
     
     if args.list:
         print("Список доступных курсов:")
@@ -585,7 +793,8 @@ if __name__ == "__main__":
             course_node = graph.nodes.match("Course", name=args.course).first()
             if not course_node:
                 print(f"Создание узла для курса '{args.course}'...")
-                course_node = Node("Course", name=args.course, description=f"Курс {args.course}")
+                course_node = Node("Course", name=args.course, description=f"Курс {args.course}",
+                                   updated_at=updated_at_now())
                 graph.create(course_node)
             
             # Извлечение понятий
@@ -600,17 +809,17 @@ if __name__ == "__main__":
                 concept_node = graph.nodes.match("Concept", name=concept_name).first()
                 if not concept_node:
                     # Создаем новый узел
-                    concept_node = Node("Concept", name=concept_name)
+                    concept_node = Node("Concept", name=concept_name, updated_at=updated_at_now())
                     graph.create(concept_node)
                     created_count += 1
                     
                     # Связываем понятие с курсом
-                    rel = Relationship(concept_node, "PART_OF", course_node)
+                    rel = Relationship(concept_node, "PART_OF", course_node, updated_at=updated_at_now())
                     graph.create(rel)
                     linked_count += 1
                 elif not graph.exists(Relationship(concept_node, "PART_OF", course_node)):
                     # Если понятие уже существует, но не связано с текущим курсом
-                    rel = Relationship(concept_node, "PART_OF", course_node)
+                    rel = Relationship(concept_node, "PART_OF", course_node, updated_at=updated_at_now())
                     graph.create(rel)
                     linked_count += 1
             
@@ -634,7 +843,8 @@ if __name__ == "__main__":
             print(f"Используется файл курса: {args.file}")
         
         course_file = args.file if args.file else None
-        success = analyze_all_undefined_concepts(args.course, course_file)
+        success = analyze_all_undefined_concepts(args.course, course_file, args.concurrency, args.resume,
+                                                 args.pack_size, args.redo)
         
         if success:
             print("\nАнализ понятий успешно завершен!")
@@ -3,12 +3,15 @@
 
 import os
 import json
+import gzip
+import hashlib
 import time
 import argparse
 import shutil
 from datetime import datetime
-from py2neo import Graph, Node, Relationship
+from py2neo import Graph
 from dotenv import load_dotenv
+from neo4j_schema import updated_at_now
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -18,8 +21,183 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 
-def backup_database(output_dir=None):
-    """Создает резервную копию базы данных Neo4j"""
+# Количество узлов или связей, записываемых одной транзакцией при восстановлении
+RESTORE_BATCH_SIZE = int(os.getenv("RESTORE_BATCH_SIZE", "1000"))
+# Количество узлов или связей, читаемых одним запросом при создании резервной копии
+BACKUP_PAGE_SIZE = int(os.getenv("BACKUP_PAGE_SIZE", "1000"))
+
+# Версия формата резервной копии: сжатый NDJSON и файл-манифест рядом с ним
+BACKUP_FORMAT_VERSION = "2.0"
+BACKUP_DATA_SUFFIX = ".ndjson.gz"
+BACKUP_MANIFEST_SUFFIX = ".manifest.json"
+
+# Метки узлов, которые попадают в резервную копию
+BACKUP_NODE_FILTER = "(n:Course OR n:Chapter OR n:Concept)"
+
+# Инкрементная копия начинается чуть раньше предыдущей копии, чтобы не пропустить записи,
+# которые выполнялись одновременно с ней (повторно выгруженные записи при восстановлении просто обновляются)
+BACKUP_OVERLAP_MS = int(os.getenv("BACKUP_OVERLAP_MS", "60000"))
+
+def manifest_path_for(data_path):
+    """Путь к манифесту для файла данных резервной копии"""
+    return data_path[:-len(BACKUP_DATA_SUFFIX)] + BACKUP_MANIFEST_SUFFIX
+
+def data_path_for(manifest_path):
+    """Путь к файлу данных резервной копии для манифеста"""
+    return manifest_path[:-len(BACKUP_MANIFEST_SUFFIX)] + BACKUP_DATA_SUFFIX
+
+def read_manifest(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def file_sha256(path):
+    """Контрольная сумма файла, читаемого частями"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_backup_nodes(graph, page_size=None, since=None):
+    """
+    Постранично читает узлы курсов, глав и понятий, упорядочивая их по id.
+    Если указан since, читаются только узлы с updated_at не раньше since.
+    """
+    page_size = page_size or BACKUP_PAGE_SIZE
+    condition = "AND n.updated_at >= $since" if since is not None else ""
+    query = f"""
+        MATCH (n) WHERE id(n) > $after AND {BACKUP_NODE_FILTER} {condition}
+        RETURN id(n) AS id, labels(n) AS labels, properties(n) AS properties
+        ORDER BY id(n) LIMIT $page_size
+    """
+    after = -1
+    while True:
+        page = graph.run(query, after=after, page_size=page_size, since=since).data()
+        for record in page:
+            yield {"kind": "node", "id": record["id"], "labels": record["labels"], "properties": record["properties"]}
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+def iter_backup_relationships(graph, page_size=None, since=None):
+    """
+    Постранично читает связи между курсами, главами и понятиями, упорядочивая их по id.
+    Если указан since, читаются только связи с updated_at не раньше since.
+    """
+    page_size = page_size or BACKUP_PAGE_SIZE
+    condition = "AND r.updated_at >= $since" if since is not None else ""
+    query = f"""
+        MATCH (a)-[r]->(b) WHERE id(r) > $after
+          AND {BACKUP_NODE_FILTER.replace("n:", "a:")} AND {BACKUP_NODE_FILTER.replace("n:", "b:")} {condition}
+        RETURN id(r) AS id, type(r) AS type, id(a) AS source, id(b) AS target, properties(r) AS properties
+        ORDER BY id(r) LIMIT $page_size
+    """
+    after = -1
+    while True:
+        page = graph.run(query, after=after, page_size=page_size, since=since).data()
+        for record in page:
+            yield {
+                "kind": "relationship",
+                "id": record["id"],
+                "type": record["type"],
+                "source": record["source"],
+                "target": record["target"],
+                "properties": record["properties"]
+            }
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+def iter_live_ids(graph, kind, page_size=None):
+    """
+    Постранично читает id всех узлов ("node") или связей ("relationship"), которые попадают
+    в резервную копию, в порядке возрастания
+    """
+    page_size = page_size or BACKUP_PAGE_SIZE
+    if kind == "node":
+        query = f"""
+            MATCH (n) WHERE id(n) > $after AND {BACKUP_NODE_FILTER}
+            RETURN id(n) AS id ORDER BY id(n) LIMIT $page_size
+        """
+    else:
+        query = f"""
+            MATCH (a)-[r]->(b) WHERE id(r) > $after
+              AND {BACKUP_NODE_FILTER.replace("n:", "a:")} AND {BACKUP_NODE_FILTER.replace("n:", "b:")}
+            RETURN id(r) AS id ORDER BY id(r) LIMIT $page_size
+        """
+    after = -1
+    while True:
+        page = graph.run(query, after=after, page_size=page_size).data()
+        for record in page:
+            yield record["id"]
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+def id_ranges(ids):
+    """Сжимает возрастающую последовательность id в список отрезков [первый, последний]"""
+    ranges = []
+    for id_ in ids:
+        if ranges and id_ == ranges[-1][1] + 1:
+            ranges[-1][1] = id_
+        else:
+            ranges.append([id_, id_])
+    return ranges
+
+def ids_from_ranges(ranges):
+    """Множество id из списка отрезков [первый, последний]"""
+    return {id_ for first, last in ranges for id_ in range(first, last + 1)}
+
+def find_latest_manifest(backup_dir):
+    """Возвращает (путь, манифест) самой свежей резервной копии формата 2.0 в директории или (None, None)"""
+    latest_path, latest = None, None
+    if not os.path.exists(backup_dir):
+        return None, None
+    for name in os.listdir(backup_dir):
+        if not (name.startswith("neo4j_backup_") and name.endswith(BACKUP_MANIFEST_SUFFIX)):
+            continue
+        path = os.path.join(backup_dir, name)
+        try:
+            manifest = read_manifest(path)
+        except Exception:
+            continue
+        if manifest.get("snapshot_ts") is None:
+            continue
+        if latest is None or manifest["snapshot_ts"] > latest["snapshot_ts"]:
+            latest_path, latest = path, manifest
+    return latest_path, latest
+
+def backup_chain(backup_file):
+    """
+    Возвращает цепочку резервных копий [(путь к данным, манифест), ...] от полной копии
+    до указанной: инкрементная копия ссылается на предыдущую через поле base манифеста
+    """
+    chain = []
+    data_path = backup_file
+    while True:
+        manifest = read_manifest(manifest_path_for(data_path))
+        chain.append((data_path, manifest))
+        if manifest.get("type", "full") == "full":
+            break
+        data_path = os.path.join(os.path.dirname(data_path), manifest["base"])
+        if len(chain) > 1000 or not os.path.exists(data_path):
+            raise ValueError(f"Не найдена предыдущая резервная копия цепочки: {data_path}")
+    chain.reverse()
+    return chain
+
+def backup_database(output_dir=None, incremental=False):
+    """
+    Создает резервную копию базы данных Neo4j.
+    
+    Узлы и связи читаются страницами и сразу пишутся в сжатый файл NDJSON
+    (по одной записи на строку), поэтому расход памяти не зависит от размера базы.
+    Рядом сохраняется манифест с количеством записей и контрольной суммой файла.
+    
+    В инкрементном режиме выгружаются только узлы и связи, измененные (по свойству updated_at)
+    после предыдущей резервной копии в той же директории. Удаления в такую копию не попадают,
+    поэтому в манифест записываются id всех существующих узлов и связей: при восстановлении
+    все, чего нет в этом списке, удаляется.
+    """
     if output_dir is None:
         output_dir = "backups"
     
@@ -35,77 +213,413 @@ def backup_database(output_dir=None):
         print(f"Ошибка подключения к Neo4j: {str(e)}")
         return False
     
+    # Момент снимка: следующая инкрементная копия выгрузит записи, измененные после него
+    snapshot_ts = updated_at_now()
+    
+    since = None
+    base_manifest = None
+    if incremental:
+        base_manifest_path, base_manifest = find_latest_manifest(output_dir)
+        if base_manifest is None:
+            print(f"Ошибка: в директории {output_dir} нет резервной копии, от которой можно сделать инкрементную. Сначала создайте полную копию.")
+            return False
+        since = base_manifest["snapshot_ts"] - BACKUP_OVERLAP_MS
+        print(f"Инкрементная копия относительно {base_manifest['file']}")
+    
     # Формируем имя файла с временной меткой
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(output_dir, f"neo4j_backup_{timestamp}.json")
+    created_at = datetime.now()
+    timestamp = created_at.strftime("%Y%m%d_%H%M%S")
+    suffix = "_incremental" if incremental else ""
+    backup_file = os.path.join(output_dir, f"neo4j_backup_{timestamp}{suffix}{BACKUP_DATA_SUFFIX}")
+    manifest_file = manifest_path_for(backup_file)
     
-    # Получаем все узлы и отношения из базы
     print("Получение узлов и отношений из базы данных...")
     
-    # Получаем все курсы
-    courses = graph.run("""
-        MATCH (c:Course)
-        RETURN c
-    """).data()
-    
-    # Получаем все главы
-    chapters = graph.run("""
-        MATCH (ch:Chapter)
-        RETURN ch
-    """).data()
-    
-    # Получаем все понятия
-    concepts = graph.run("""
-        MATCH (c:Concept)
-        RETURN c
-    """).data()
-    
-    # Получаем все отношения
-    relationships = graph.run("""
-        MATCH ()-[r]->()
-        RETURN DISTINCT type(r) AS type, count(r) AS count
-    """).data()
-    
-    # Подробные данные о связях
-    relationships_data = graph.run("""
-        MATCH (n1)-[r]->(n2)
-        RETURN id(n1) AS source_id, n1.name AS source_name, labels(n1) AS source_labels,
-               id(n2) AS target_id, n2.name AS target_name, labels(n2) AS target_labels,
-               type(r) AS relationship_type, r.description AS description
-    """).data()
-    
-    # Формируем структуру бэкапа
-    backup_data = {
-        "metadata": {
-            "created_at": datetime.now().isoformat(),
+    node_counts = {}
+    relationship_types = {}
+    relationship_count = 0
+    tmp_file = backup_file + ".tmp"
+    try:
+        with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+            for record in iter_backup_nodes(graph, since=since):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                for label in record["labels"]:
+                    node_counts[label] = node_counts.get(label, 0) + 1
+            for record in iter_backup_relationships(graph, since=since):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                relationship_types[record["type"]] = relationship_types.get(record["type"], 0) + 1
+                relationship_count += 1
+        
+        # Список существующих id читается после данных: узел, удаленный во время копии,
+        # будет удален и при восстановлении, а созданный во время копии попадет в следующую
+        live_ids = None
+        if incremental:
+            live_ids = {
+                "nodes": id_ranges(iter_live_ids(graph, "node")),
+                "relationships": id_ranges(iter_live_ids(graph, "relationship"))
+            }
+        os.replace(tmp_file, backup_file)
+        
+        # Манифест пишется последним: его наличие означает, что копия завершена
+        manifest = {
+            "format": "ndjson.gz",
+            "version": BACKUP_FORMAT_VERSION,
+            "type": "incremental" if incremental else "full",
+            "created_at": created_at.isoformat(),
+            "snapshot_ts": snapshot_ts,
+            "since": since,
+            "base": base_manifest["file"] if incremental else None,
             "neo4j_uri": NEO4J_URI,
-            "version": "1.0"
-        },
-        "nodes": {
-            "courses": courses,
-            "chapters": chapters,
-            "concepts": concepts
-        },
-        "relationships": {
-            "summary": relationships,
-            "details": relationships_data
+            "file": os.path.basename(backup_file),
+            "sha256": file_sha256(backup_file),
+            "counts": {
+                "nodes": node_counts,
+                "relationships": relationship_count,
+                "relationship_types": relationship_types
+            },
+            "live_ids": live_ids
         }
-    }
-    
-    # Сохраняем в JSON файл
-    try:
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2)
+        with open(manifest_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_file + ".tmp", manifest_file)
+        
         print(f"Резервная копия успешно создана: {backup_file}")
-        print(f"Содержит: {len(courses)} курсов, {len(chapters)} глав, {len(concepts)} понятий, {len(relationships_data)} связей")
+        print(f"Содержит: {node_counts.get('Course', 0)} курсов, {node_counts.get('Chapter', 0)} глав, "
+              f"{node_counts.get('Concept', 0)} понятий, {relationship_count} связей")
         
         return backup_file
     except Exception as e:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
         print(f"Ошибка при создании резервной копии: {str(e)}")
         return False
 
+def chunked(items, size):
+    """Разбивает список на части не более size элементов"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def cypher_name(name):
+    """Экранирует метку или тип связи для подстановки в Cypher"""
+    return "`" + str(name).replace("`", "``") + "`"
+
+def node_key_property(label):
+    """Свойство, по которому узел узнается в описании связей бэкапа (у глав - название)"""
+    return "title" if label == "Chapter" else "name"
+
+def create_nodes_batched(graph, labels, props_list, batch_size=None):
+    """
+    Создает узлы с одним набором меток пакетами UNWIND, по транзакции на пакет.
+    Возвращает список новых id в порядке props_list.
+    """
+    batch_size = batch_size or RESTORE_BATCH_SIZE
+    query = f"""
+        UNWIND $rows AS row
+        CREATE (n:{":".join(cypher_name(label) for label in labels)})
+        SET n = row.props
+        RETURN row.idx AS idx, id(n) AS id
+    """
+    new_ids = [None] * len(props_list)
+    rows = [{"idx": idx, "props": props} for idx, props in enumerate(props_list)]
+    for batch in chunked(rows, batch_size):
+        tx = graph.begin()
+        try:
+            for record in tx.run(query, rows=batch).data():
+                new_ids[record["idx"]] = record["id"]
+            graph.commit(tx)
+        except Exception:
+            graph.rollback(tx)
+            raise
+    return new_ids
+
+def run_batched(graph, query, rows, batch_size=None):
+    """Выполняет запрос UNWIND $rows пакетами, по транзакции на пакет, и возвращает все записи результата"""
+    batch_size = batch_size or RESTORE_BATCH_SIZE
+    records = []
+    for batch in chunked(rows, batch_size):
+        tx = graph.begin()
+        try:
+            records.extend(tx.run(query, rows=batch).data())
+            graph.commit(tx)
+        except Exception:
+            graph.rollback(tx)
+            raise
+    return records
+
+def update_nodes_batched(graph, rows, batch_size=None):
+    """Заменяет свойства существующих узлов: rows - список {id, props}"""
+    run_batched(graph, """
+        UNWIND $rows AS row
+        MATCH (n) WHERE id(n) = row.id
+        SET n = row.props
+    """, rows, batch_size)
+
+def update_relationships_batched(graph, rows, batch_size=None):
+    """Заменяет свойства существующих связей: rows - список {id, properties}"""
+    run_batched(graph, """
+        UNWIND $rows AS row
+        MATCH ()-[r]->() WHERE id(r) = row.id
+        SET r = row.properties
+    """, rows, batch_size)
+
+def create_relationships_batched(graph, rel_rows, batch_size=None, id_map=None):
+    """
+    Создает связи пакетами UNWIND, по транзакции на пакет.
+    rel_rows - список словарей {type, source, target, properties}, где source и target - новые id узлов.
+    Если в строке есть original_id, новый id связи сохраняется в id_map.
+    Тип связи нельзя передать параметром, поэтому строки группируются по типу.
+    Возвращает количество созданных связей.
+    """
+    batch_size = batch_size or RESTORE_BATCH_SIZE
+    rows_by_type = {}
+    for row in rel_rows:
+        rows_by_type.setdefault(row["type"], []).append(row)
+    
+    created_count = 0
+    for rel_type, rows in rows_by_type.items():
+        query = f"""
+            UNWIND $rows AS row
+            MATCH (a) WHERE id(a) = row.source
+            MATCH (b) WHERE id(b) = row.target
+            CREATE (a)-[r:{cypher_name(rel_type)}]->(b)
+            SET r = row.properties
+            RETURN row.original_id AS original_id, id(r) AS id
+        """
+        for record in run_batched(graph, query, rows, batch_size):
+            created_count += 1
+            if id_map is not None and record["original_id"] is not None:
+                id_map[record["original_id"]] = record["id"]
+    return created_count
+def delete_restored_relationships(graph, original_ids, rel_id_map, rel_ends):
+    """Удаляет восстановленные связи по их id в копии и убирает их из карт"""
+    new_ids = [rel_id_map.pop(original_id) for original_id in original_ids]
+    for original_id in original_ids:
+        rel_ends.pop(original_id, None)
+    run_batched(graph, """
+        UNWIND $rows AS id
+        MATCH ()-[r]->() WHERE id(r) = id
+        DELETE r
+    """, new_ids)
+
+def delete_restored_nodes(graph, original_ids, id_map, rel_id_map, node_labels, rel_ends):
+    """Удаляет восстановленные узлы (вместе с их связями) по их id в копии и убирает их из карт"""
+    removed = set(original_ids)
+    new_ids = [id_map.pop(original_id) for original_id in removed]
+    for original_id in removed:
+        node_labels.pop(original_id, None)
+    run_batched(graph, """
+        UNWIND $rows AS id
+        MATCH (n) WHERE id(n) = id
+        DETACH DELETE n
+    """, new_ids)
+    # Связи этих узлов удалены вместе с ними
+    for rel_id, (_, source, target) in list(rel_ends.items()):
+        if source in removed or target in removed:
+            rel_id_map.pop(rel_id, None)
+            del rel_ends[rel_id]
+
+def delete_missing_records(graph, live_ids, id_map, rel_id_map, node_labels, rel_ends):
+    """
+    Удаляет восстановленные узлы и связи, которых нет в списке существующих id инкрементной копии
+    (они были удалены после предыдущей копии цепочки).
+    Возвращает (количество удаленных узлов, количество удаленных связей)
+    """
+    live_nodes = ids_from_ranges(live_ids["nodes"])
+    live_relationships = ids_from_ranges(live_ids["relationships"])
+    missing_relationships = [rel_id for rel_id in rel_id_map if rel_id not in live_relationships]
+    delete_restored_relationships(graph, missing_relationships, rel_id_map, rel_ends)
+    missing_nodes = [node_id for node_id in id_map if node_id not in live_nodes]
+    delete_restored_nodes(graph, missing_nodes, id_map, rel_id_map, node_labels, rel_ends)
+    return len(missing_nodes), len(missing_relationships)
+
+def restore_ndjson_backup(graph, backup_file, id_map=None, rel_id_map=None, node_labels=None, rel_ends=None):
+    """
+    Восстанавливает узлы и связи из сжатого файла NDJSON, читая его построчно.
+    Узлы создаются пакетами по набору меток, связи - пакетами по типу.
+    Узлы и связи, которые уже есть в картах id (восстановлены из предыдущей копии цепочки),
+    не создаются заново, а получают свойства из этой копии. Neo4j повторно использует id удаленных
+    записей, поэтому если у узла с тем же id другие метки (у связи - другой тип или концы),
+    это новая запись: восстановленная ранее удаляется, а новая создается.
+    
+    Parameters:
+    - graph: подключение к Neo4j
+    - backup_file: путь к файлу данных резервной копии
+    - id_map: словарь id узла в копии -> новый id (заполняется по ходу восстановления)
+    - rel_id_map: словарь id связи в копии -> новый id (заполняется по ходу восстановления)
+    - node_labels: словарь id узла в копии -> его метки
+    - rel_ends: словарь id связи в копии -> [тип, id начала в копии, id конца в копии]
+    
+    Возвращает (количество узлов, количество связей, количество пропущенных связей)
+    """
+    if id_map is None:
+        id_map = {}
+    if rel_id_map is None:
+        rel_id_map = {}
+    if node_labels is None:
+        node_labels = {}
+    if rel_ends is None:
+        rel_ends = {}
+    node_batches = {}
+    rel_rows = []
+    nodes_count = 0
+    rels_count = 0
+    rels_skipped_count = 0
+    
+    def flush_nodes(labels):
+        batch = node_batches.pop(labels)
+        replaced = [original_id for original_id, _ in batch
+                    if original_id in id_map and node_labels.get(original_id) != set(labels)]
+        if replaced:
+            delete_restored_nodes(graph, replaced, id_map, rel_id_map, node_labels, rel_ends)
+        updates = [{"id": id_map[original_id], "props": props} for original_id, props in batch if original_id in id_map]
+        creates = [(original_id, props) for original_id, props in batch if original_id not in id_map]
+        if updates:
+            update_nodes_batched(graph, updates)
+        new_ids = create_nodes_batched(graph, list(labels), [props for _, props in creates])
+        for (original_id, _), new_id in zip(creates, new_ids):
+            id_map[original_id] = new_id
+        for original_id, _ in batch:
+            node_labels[original_id] = set(labels)
+        return len(batch)
+    
+    def flush_relationships():
+        replaced = [row["original_id"] for row in rel_rows
+                    if row["original_id"] in rel_id_map and rel_ends.get(row["original_id"]) != row["ends"]]
+        if replaced:
+            delete_restored_relationships(graph, replaced, rel_id_map, rel_ends)
+        updates = [{"id": rel_id_map[row["original_id"]], "properties": row["properties"]}
+                   for row in rel_rows if row["original_id"] in rel_id_map]
+        creates = [row for row in rel_rows if row["original_id"] not in rel_id_map]
+        if updates:
+            update_relationships_batched(graph, updates)
+        create_relationships_batched(graph, creates, id_map=rel_id_map)
+        for row in rel_rows:
+            rel_ends[row["original_id"]] = row["ends"]
+        count = len(rel_rows)
+        rel_rows.clear()
+        return count
+    
+    print("Восстановление узлов...")
+    nodes_done = False
+    with gzip.open(backup_file, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record["kind"] == "node":
+                labels = tuple(record["labels"])
+                node_batches.setdefault(labels, []).append((record["id"], record["properties"]))
+                if len(node_batches[labels]) >= RESTORE_BATCH_SIZE:
+                    nodes_count += flush_nodes(labels)
+            elif record["kind"] == "relationship":
+                # Узлы записаны в файл раньше связей, дописываем оставшиеся пакеты узлов
+                if not nodes_done:
+                    for labels in list(node_batches):
+                        nodes_count += flush_nodes(labels)
+                    nodes_done = True
+                    print("Восстановление связей...")
+                
+                source_id = id_map.get(record["source"])
+                target_id = id_map.get(record["target"])
+                if source_id is None or target_id is None:
+                    rels_skipped_count += 1
+                    continue
+                rel_rows.append({
+                    "original_id": record["id"],
+                    "type": record["type"],
+                    "source": source_id,
+                    "target": target_id,
+                    "properties": record["properties"],
+                    "ends": [record["type"], record["source"], record["target"]]
+                })
+                if len(rel_rows) >= RESTORE_BATCH_SIZE:
+                    rels_count += flush_relationships()
+    
+    for labels in list(node_batches):
+        nodes_count += flush_nodes(labels)
+    if rel_rows:
+        rels_count += flush_relationships()
+    
+    return nodes_count, rels_count, rels_skipped_count
+
+def restore_legacy_backup(graph, backup_data):
+    """Восстанавливает узлы и связи из резервной копии формата 1.0 (один JSON-документ)"""
+    # Восстанавливаем узлы пакетами: новые id возвращаются прямо из запросов создания
+    print("Восстановление узлов...")
+    # Карта (метка, имя или название) -> новый id узла
+    key_to_new_id = {}
+    created_nodes_count = 0
+    concepts_count = 0
+    for label, section, node_key in (("Course", "courses", "c"), ("Chapter", "chapters", "ch"), ("Concept", "concepts", "c")):
+        props_list = [node_data[node_key] for node_data in backup_data["nodes"][section]]
+        new_ids = create_nodes_batched(graph, [label], props_list)
+        name_prop = node_key_property(label)
+        for props, new_id in zip(props_list, new_ids):
+            # Как и раньше, при совпадении имен связи привязываются к первому узлу
+            key_to_new_id.setdefault((label, props.get(name_prop)), new_id)
+        created_nodes_count += len(new_ids)
+        if label == "Concept":
+            concepts_count = len(new_ids)
+    
+    print(f"Восстановлено узлов (Курсы, Главы, Понятия): {created_nodes_count}")
+    print(f"Из них понятий: {concepts_count}")
+    
+    # --- Создание маппинга: original_id -> new_id по имени и метке узла из описания связи ---
+    print("Построение карты ID старых и новых узлов...")
+    original_id_to_new_id = {}
+    mapping_errors = 0
+    for rel_data in backup_data["relationships"]["details"]:
+        for side in ("source", "target"):
+            original_id = rel_data[f"{side}_id"]
+            if original_id in original_id_to_new_id:
+                continue
+            labels = rel_data[f"{side}_labels"]
+            label = labels[0] if labels else None
+            name = rel_data[f"{side}_name"]
+            new_id = key_to_new_id.get((label, name))
+            # Узлы без имени (например, главы в копиях версии 1.0) сопоставить нельзя - их связи пропускаются
+            if new_id is None and name and label:
+                print(f"Предупреждение: Не удалось найти новый узел для original_id {original_id} (Имя: '{rel_data[f'{side}_name']}', Метка: {label})")
+                mapping_errors += 1
+            original_id_to_new_id[original_id] = new_id
+    
+    found_count = sum(1 for new_id in original_id_to_new_id.values() if new_id is not None)
+    print(f"Завершено построение карты: Найдено {found_count} узлов из {len(original_id_to_new_id)}. Ошибок/ненайденных: {mapping_errors}")
+    if mapping_errors > 0:
+        print("ПРЕДУПРЕЖДЕНИЕ: Не все узлы из связей бэкапа были найдены в новой базе. Некоторые связи могут быть не восстановлены.")
+    
+    # Восстанавливаем связи пакетами, используя маппинг ID
+    print("Восстановление связей...")
+    rel_rows = []
+    rels_skipped_count = 0
+    for rel_data in backup_data["relationships"]["details"]:
+        source_id = original_id_to_new_id.get(rel_data["source_id"])
+        target_id = original_id_to_new_id.get(rel_data["target_id"])
+        
+        # Создаем связь, если оба узла были найдены в карте
+        if source_id is not None and target_id is not None:
+            rel_rows.append({
+                "type": rel_data["relationship_type"],
+                "source": source_id,
+                "target": target_id,
+                # Убедимся, что description существует, иначе пустая строка
+                "properties": {"description": rel_data.get("description") or ""}
+            })
+        else:
+            rels_skipped_count += 1
+    
+    rels_created_count = create_relationships_batched(graph, rel_rows)
+    
+    print(f"Восстановлено связей: {rels_created_count}")
+    if rels_skipped_count > 0:
+        print(f"Пропущено связей из-за отсутствия узлов в карте: {rels_skipped_count}")
+
 def restore_database(backup_file):
-    """Восстанавливает базу данных из резервной копии, используя маппинг ID для связей."""
+    """
+    Восстанавливает базу данных из резервной копии, используя маппинг ID для связей.
+    Принимает файл данных (.ndjson.gz), его манифест или резервную копию формата 1.0 (.json).
+    Для инкрементной копии восстанавливается вся цепочка: полная копия и все инкрементные копии после нее.
+    """
+    if backup_file.endswith(BACKUP_MANIFEST_SUFFIX):
+        backup_file = data_path_for(backup_file)
     if not os.path.exists(backup_file):
         print(f"Ошибка: файл резервной копии не найден: {backup_file}")
         return False
@@ -118,13 +632,25 @@ def restore_database(backup_file):
         print(f"Ошибка подключения к Neo4j: {str(e)}")
         return False
     
-    # Загружаем данные из резервной копии
+    # Загружаем данные (формат 1.0) или манифест резервной копии и проверяем контрольную сумму
+    legacy = not backup_file.endswith(BACKUP_DATA_SUFFIX)
     try:
-        with open(backup_file, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
+        if legacy:
+            with open(backup_file, 'r', encoding='utf-8') as f:
+                backup_data = json.load(f)
+            created_at = backup_data['metadata']['created_at']
+        else:
+            chain = backup_chain(backup_file)
+            for data_path, manifest in chain:
+                if file_sha256(data_path) != manifest["sha256"]:
+                    print(f"Ошибка: контрольная сумма файла {data_path} не совпадает с манифестом")
+                    return False
+            if len(chain) > 1:
+                print(f"Цепочка восстановления: полная копия и {len(chain) - 1} инкрементных")
+            created_at = chain[-1][1]["created_at"]
         
         print(f"Загружена резервная копия: {backup_file}")
-        print(f"Дата создания: {backup_data['metadata']['created_at']}")
+        print(f"Дата создания: {created_at}")
     except Exception as e:
         print(f"Ошибка при чтении файла резервной копии: {str(e)}")
         return False
@@ -143,143 +669,47 @@ def restore_database(backup_file):
     print("Очистка базы данных...")
     graph.run("MATCH (n) DETACH DELETE n")
     
-    # Восстанавливаем узлы
-    print("Восстановление узлов...")
-    created_nodes_count = 0
-    # Восстанавливаем курсы
-    for course_data in backup_data["nodes"]["courses"]:
-        course_props = course_data["c"]
-        course_node = Node("Course", **course_props)
-        graph.create(course_node)
-        created_nodes_count += 1
-        # print(f"Восстановлен курс: {course_props.get('name', 'Без имени')}")
-    
-    # Восстанавливаем главы
-    for chapter_data in backup_data["nodes"]["chapters"]:
-        chapter_props = chapter_data["ch"]
-        chapter_node = Node("Chapter", **chapter_props)
-        graph.create(chapter_node)
-        created_nodes_count += 1
-        # print(f"Восстановлена глава: {chapter_props.get('title', 'Без названия')}") # Используем 'title' для глав, если есть
-    
-    # Восстанавливаем понятия
-    concepts_count = 0
-    for concept_data in backup_data["nodes"]["concepts"]:
-        concept_props = concept_data["c"]
-        concept_node = Node("Concept", **concept_props)
-        graph.create(concept_node)
-        created_nodes_count += 1
-        concepts_count += 1
-    
-    print(f"Восстановлено узлов (Курсы, Главы, Понятия): {created_nodes_count}")
-    print(f"Из них понятий: {concepts_count}")
-    
-    # --- Создание маппинга: original_id -> new_node_object ---
-    print("Построение карты ID старых и новых узлов...")
-    original_id_to_new_node = {}
-    nodes_found_for_mapping = 0
-    mapping_errors = 0
-    
-    # Собираем все уникальные ID из связей
-    all_original_ids = set()
-    for rel_data in backup_data["relationships"]["details"]:
-        all_original_ids.add(rel_data["source_id"])
-        all_original_ids.add(rel_data["target_id"])
-    
-    print(f"Найдено {len(all_original_ids)} уникальных ID узлов в связях бэкапа.")
-    
-    # Ищем новые узлы по имени/метке для каждого уникального ID
-    # Используем данные из details, так как там есть и ID, и имя, и метки
-    processed_ids_for_map = set()
-    for rel_data in backup_data["relationships"]["details"]:
-        # Обрабатываем source_id, если еще не обработан
-        source_id = rel_data["source_id"]
-        if source_id not in processed_ids_for_map:
-            source_name = rel_data["source_name"]
-            source_label = rel_data["source_labels"][0] if rel_data["source_labels"] else None
-            if source_name and source_label:
-                # Используем имя 'title' для глав, если метка Chapter
-                name_prop = 'title' if source_label == 'Chapter' else 'name'
-                query = f"MATCH (n:{source_label}) WHERE n.{name_prop} = $name RETURN n LIMIT 1"
-                try:
-                    # Используем graph.evaluate() который вернет один узел или None
-                    node = graph.evaluate(query, name=source_name)
-                    if node:
-                        original_id_to_new_node[source_id] = node
-                        nodes_found_for_mapping += 1
-                    else:
-                        print(f"Предупреждение: Не удалось найти новый узел для original_id {source_id} (Имя: '{source_name}', Метка: {source_label})")
-                        mapping_errors += 1
-                except Exception as e:
-                    print(f"Ошибка при поиске узла для карты {source_id} (Имя: '{source_name}', Метка: {source_label}): {e}")
-                    mapping_errors += 1
-            processed_ids_for_map.add(source_id)
-        
-        # Обрабатываем target_id, если еще не обработан
-        target_id = rel_data["target_id"]
-        if target_id not in processed_ids_for_map:
-            target_name = rel_data["target_name"]
-            target_label = rel_data["target_labels"][0] if rel_data["target_labels"] else None
-            if target_name and target_label:
-                name_prop = 'title' if target_label == 'Chapter' else 'name'
-                query = f"MATCH (n:{target_label}) WHERE n.{name_prop} = $name RETURN n LIMIT 1"
-                try:
-                    node = graph.evaluate(query, name=target_name)
-                    if node:
-                        original_id_to_new_node[target_id] = node
-                        # Не увеличиваем nodes_found_for_mapping здесь, чтобы считать уникальные узлы
-                    else:
-                        print(f"Предупреждение: Не удалось найти новый узел для original_id {target_id} (Имя: '{target_name}', Метка: {target_label})")
-                        mapping_errors += 1
-                except Exception as e:
-                    print(f"Ошибка при поиске узла для карты {target_id} (Имя: '{target_name}', Метка: {target_label}): {e}")
-                    mapping_errors += 1
-            processed_ids_for_map.add(target_id)
-    
-    print(f"Завершено построение карты: Найдено {len(original_id_to_new_node)} узлов из {len(all_original_ids)}. Ошибок/ненайденных: {mapping_errors}")
-    if mapping_errors > 0:
-        print("ПРЕДУПРЕЖДЕНИЕ: Не все узлы из связей бэкапа были найдены в новой базе. Некоторые связи могут быть не восстановлены.")
-    
-    # Восстанавливаем связи, используя маппинг ID
-    print("Восстановление связей...")
-    rels_created_count = 0
-    rels_skipped_count = 0
-    for rel_data in backup_data["relationships"]["details"]:
-        source_id = rel_data["source_id"]
-        target_id = rel_data["target_id"]
-        
-        # Получаем новые узлы из карты
-        source_node = original_id_to_new_node.get(source_id)
-        target_node = original_id_to_new_node.get(target_id)
-        
-        # Создаем связь, если оба узла были найдены в карте
-        if source_node and target_node:
-            rel_type = rel_data["relationship_type"]
-            # Убедимся, что description существует, иначе пустая строка
-            properties = {"description": rel_data.get("description", "")}
-            # Добавим другие свойства связи, если они есть в бэкапе
-            # for key, value in rel_data.items():
-            #     if key not in ["source_id", "source_name", "source_labels",
-            #                     "target_id", "target_name", "target_labels",
-            #                     "relationship_type", "description"]:
-            #         properties[key] = value
-            
-            rel = Relationship(source_node, rel_type, target_node, **properties)
-            graph.create(rel)
-            rels_created_count += 1
-        else:
-            rels_skipped_count += 1
-            # print(f"Пропуск связи: не найден один или оба узла в карте для {source_id} -> {target_id}")
-    
-    print(f"Восстановлено связей: {rels_created_count}")
-    if rels_skipped_count > 0:
-        print(f"Пропущено связей из-за отсутствия узлов в карте: {rels_skipped_count}")
+    if legacy:
+        restore_legacy_backup(graph, backup_data)
+    else:
+        # Карты id общие для всей цепочки: следующие копии обновляют уже восстановленные узлы и связи
+        id_map = {}
+        rel_id_map = {}
+        node_labels = {}
+        rel_ends = {}
+        for data_path, manifest in chain:
+            print(f"Применение резервной копии {os.path.basename(data_path)}")
+            nodes_count, rels_count, rels_skipped_count = restore_ndjson_backup(
+                graph, data_path, id_map, rel_id_map, node_labels, rel_ends
+            )
+            print(f"Восстановлено узлов: {nodes_count}")
+            print(f"Восстановлено связей: {rels_count}")
+            if rels_skipped_count > 0:
+                print(f"Пропущено связей из-за отсутствия узлов в карте: {rels_skipped_count}")
+            if manifest.get("type") != "incremental":
+                continue
+            if manifest.get("live_ids") is None:
+                print("Предупреждение: в манифесте нет списка существующих узлов и связей (копия создана "
+                      "старой версией скрипта), удаленные после предыдущей копии данные останутся в базе")
+                continue
+            nodes_deleted, rels_deleted = delete_missing_records(
+                graph, manifest["live_ids"], id_map, rel_id_map, node_labels, rel_ends
+            )
+            if nodes_deleted or rels_deleted:
+                print(f"Удалено узлов и связей, удаленных после предыдущей копии: {nodes_deleted} и {rels_deleted}")
     
     print(f"Восстановление из резервной копии успешно завершено")
     return True
 
+def format_backup_date(created_at):
+    """Дата создания резервной копии в виде ДД.ММ.ГГГГ ЧЧ:ММ:СС"""
+    try:
+        return datetime.fromisoformat(created_at).strftime("%d.%m.%Y %H:%M:%S")
+    except (TypeError, ValueError):
+        return "Некорректный формат"
+
 def list_backups(backup_dir=None):
-    """Выводит список доступных резервных копий"""
+    """Выводит список доступных резервных копий (для копий формата 2.0 читается только манифест)"""
     if backup_dir is None:
         backup_dir = "backups"
     
@@ -287,7 +717,10 @@ def list_backups(backup_dir=None):
         print(f"Директория с резервными копиями не найдена: {backup_dir}")
         return False
     
-    backup_files = [f for f in os.listdir(backup_dir) if f.startswith("neo4j_backup_") and f.endswith(".json")]
+    backup_files = [
+        f for f in os.listdir(backup_dir)
+        if f.startswith("neo4j_backup_") and (f.endswith(BACKUP_MANIFEST_SUFFIX) or f.endswith(".json"))
+    ]
     
     if not backup_files:
         print(f"Резервные копии не найдены в директории: {backup_dir}")
@@ -295,7 +728,31 @@ def list_backups(backup_dir=None):
     
     print(f"Доступные резервные копии ({len(backup_files)}):")
     for i, backup_file in enumerate(sorted(backup_files, reverse=True)):
-        # Получаем дату создания из имени файла
+        file_path = os.path.join(backup_dir, backup_file)
+        
+        if backup_file.endswith(BACKUP_MANIFEST_SUFFIX):
+            data_path = data_path_for(file_path)
+            print(f"{i+1}. {os.path.basename(data_path)}")
+            try:
+                manifest = read_manifest(file_path)
+                counts = manifest["counts"]
+                print(f"   Дата: {format_backup_date(manifest.get('created_at'))}")
+                if manifest.get("type") == "incremental":
+                    print(f"   Тип: инкрементная (после {manifest['base']})")
+                else:
+                    print("   Тип: полная")
+                if os.path.exists(data_path):
+                    print(f"   Размер: {os.path.getsize(data_path) / (1024 * 1024):.2f} МБ")
+                else:
+                    print("   Файл данных не найден")
+                print(f"   Содержит: {counts['nodes'].get('Course', 0)} курсов, {counts['nodes'].get('Chapter', 0)} глав, "
+                      f"{counts['nodes'].get('Concept', 0)} понятий, {counts['relationships']} связей")
+            except Exception:
+                print("   Не удалось прочитать манифест")
+            print()
+            continue
+        
+        # Резервная копия формата 1.0: один JSON-документ без манифеста
         try:
             timestamp = backup_file.replace("neo4j_backup_", "").replace(".json", "")
             date_str = f"{timestamp[6:8]}.{timestamp[4:6]}.{timestamp[0:4]} {timestamp[9:11]}:{timestamp[11:13]}:{timestamp[13:15]}"
@@ -303,11 +760,10 @@ def list_backups(backup_dir=None):
             date_str = "Некорректный формат"
         
         # Получаем размер файла
-        file_path = os.path.join(backup_dir, backup_file)
         file_size = os.path.getsize(file_path) / (1024 * 1024)  # в МБ
         
         # Выводим информацию
-        print(f"{i+1}. {backup_file}")
+        print(f"{i+1}. {backup_file} (формат 1.0)")
         print(f"   Дата: {date_str}")
         print(f"   Размер: {file_size:.2f} МБ")
         
@@ -334,6 +790,8 @@ def main():
     # Команда backup
     backup_parser = subparsers.add_parser("backup", help="Создать резервную копию базы данных")
     backup_parser.add_argument("--output-dir", type=str, default="backups", help="Директория для сохранения резервной копии")
+    backup_parser.add_argument("--incremental", action="store_true",
+                               help="Сохранить только изменения после предыдущей резервной копии в этой директории")
     
     # Команда restore
     restore_parser = subparsers.add_parser("restore", help="Восстановить базу данных из резервной копии")
@@ -346,7 +804,7 @@ def main():
     args = parser.parse_args()
     
     if args.command == "backup":
-        backup_database(args.output_dir)
+        backup_database(args.output_dir, args.incremental)
     elif args.command == "restore":
         restore_database(args.file)
     elif args.command == "list":
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Средняя длина токена в символах для русского текста (оценка без токенизатора модели)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3"))
+
+# Граница абзацев: пустая строка
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+# Граница предложений внутри слишком длинного абзаца
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+def estimate_tokens(text):
+    """Оценка количества токенов в тексте"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def _paragraph_spans(text):
+    """Возвращает (начало, конец) абзацев текста"""
+    spans = []
+    start = 0
+    for match in _PARAGRAPH_RE.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+def _split_long_span(text, start, end, max_chars):
+    """Делит слишком длинный абзац по предложениям, а предложение длиннее окна - по длине"""
+    pieces = []
+    piece_start = start
+    last_boundary = None
+    for match in _SENTENCE_RE.finditer(text, start, end):
+        boundary = match.start()
+        if boundary - piece_start > max_chars and last_boundary is not None:
+            pieces.append((piece_start, last_boundary))
+            piece_start = last_boundary
+        last_boundary = match.end()
+    if end - piece_start > max_chars and last_boundary is not None and last_boundary > piece_start:
+        pieces.append((piece_start, last_boundary))
+        piece_start = last_boundary
+    pieces.append((piece_start, end))
+
+    result = []
+    for piece_start, piece_end in pieces:
+        while piece_end - piece_start > max_chars:
+            result.append((piece_start, piece_start + max_chars))
+            piece_start += max_chars
+        if piece_end > piece_start:
+            result.append((piece_start, piece_end))
+    return result
+
+def split_into_windows(text, max_tokens):
+    """
+    Делит текст на окна не больше max_tokens токенов по границам абзацев.
+
+    Абзацы собираются в окно по порядку, пока оно помещается в бюджет; абзац, который
+    сам не помещается, делится по предложениям. Возвращает список (начало, конец)
+    в символах исходного текста, поэтому окна можно сопоставлять с позициями упоминаний.
+    """
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    if len(text) <= max_chars:
+        return [(0, len(text))] if text else []
+
+    windows = []
+    window_start = None
+    window_end = None
+    for start, end in _paragraph_spans(text):
+        parts = [(start, end)] if end - start <= max_chars else _split_long_span(text, start, end, max_chars)
+        for part_start, part_end in parts:
+            if window_start is not None and part_end - window_start > max_chars:
+                windows.append((window_start, window_end))
+                window_start = None
+            if window_start is None:
+                window_start = part_start
+            window_end = part_end
+    if window_start is not None:
+        windows.append((window_start, window_end))
+    return windows
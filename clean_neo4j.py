@@ -4,6 +4,7 @@
 from py2neo import Graph, Node, Relationship
 import os
 from dotenv import load_dotenv
+from neo4j_schema import ensure_schema
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -23,6 +24,9 @@ def clean_neo4j():
         print("Удаление всех узлов и связей...")
         graph.run("MATCH (n) DETACH DELETE n")
         
+        # Ограничения и индексы при удалении данных сохраняются, создаем их, если их еще нет
+        ensure_schema(graph)
+        
         # Создание корневого узла верхнего уровня
         print("Создание корневого узла 'Курсы саморазвития'...")
         root_node = Node("CourseRoot", name="Курсы саморазвития", description="Корневой узел для всех курсов по саморазвитию")
@@ -4,6 +4,7 @@
 from py2neo import Graph, Node, Relationship
 import os
 from dotenv import load_dotenv
+from neo4j_schema import ensure_schema, updated_at_now
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -22,6 +23,9 @@ def create_course(course_name, course_description=None):
         # Подключение к Neo4j
         graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
         
+        # Создаем ограничения и индексы, если их еще нет
+        ensure_schema(graph)
+        
         # Проверяем, существует ли уже такой курс
         existing_course = graph.nodes.match("Course", name=course_name).first()
         if existing_course:
@@ -30,7 +34,7 @@ def create_course(course_name, course_description=None):
         
         # Создаем новый узел курса
         print(f"Создание корневого узла для курса '{course_name}'...")
-        course_node = Node("Course", name=course_name, description=course_description)
+        course_node = Node("Course", name=course_name, description=course_description, updated_at=updated_at_now())
         graph.create(course_node)
         
         print(f"Корневой узел для курса '{course_name}' успешно создан")
@@ -4,10 +4,12 @@
 import os
 import json
 import re
-import requests
 import argparse
 from py2neo import Graph, Node, Relationship
 from dotenv import load_dotenv
+from llm_client import chat_completion, configure_cache
+from neo4j_schema import updated_at_now
+import metrics
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -66,48 +68,25 @@ def detect_chapters_with_ai(course_text, course_name):
     try:
         print("Отправка запроса к API для выделения глав в курсе...")
         
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://adapter-course.ru",
-                "X-Title": "Adapter Course"
-            },
-            json={
-                "model": AI_MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 3000,
-                "temperature": 0.7
-            },
-            timeout=60
-        )
+        message_content = chat_completion(prompt, max_tokens=3000, temperature=0.7, timeout=60)
         
-        if response.status_code == 200:
-            response_data = response.json()
-            message_content = response_data["choices"][0]["message"]["content"]
-            
-            # Извлечение JSON из ответа
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```|```\s*([\s\S]*?)\s*```|(\[[\s\S]*\])', message_content)
-            
-            if json_match:
-                # Определяем, какая группа содержит JSON
-                for group in range(1, 4):
-                    if json_match.group(group):
-                        json_str = json_match.group(group)
-                        break
-            else:
-                # Если не нашли JSON в кодовых блоках, попробуем найти массив напрямую
-                json_str = message_content
-            
-            # Очистка от возможных дополнительных символов
-            json_str = json_str.strip()
-            result = json.loads(json_str)
-            return result
+        # Извлечение JSON из ответа
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```|```\s*([\s\S]*?)\s*```|(\[[\s\S]*\])', message_content)
+        
+        if json_match:
+            # Определяем, какая группа содержит JSON
+            for group in range(1, 4):
+                if json_match.group(group):
+                    json_str = json_match.group(group)
+                    break
         else:
-            print(f"Ошибка API: {response.status_code}")
-            print(response.text)
-            return None
+            # Если не нашли JSON в кодовых блоках, попробуем найти массив напрямую
+            json_str = message_content
+        
+        # Очистка от возможных дополнительных символов
+        json_str = json_str.strip()
+        result = json.loads(json_str)
+        return result
     except Exception as e:
         print(f"Ошибка при запросе к API: {str(e)}")
         return None
@@ -158,53 +137,30 @@ def analyze_chapter_concepts(chapter, course_text, course_name):
     try:
         print(f"Анализ понятий для главы '{chapter_title}'...")
         
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://adapter-course.ru",
-                "X-Title": "Adapter Course"
-            },
-            json={
-                "model": AI_MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 3000,
-                "temperature": 0.7
-            },
-            timeout=60
-        )
+        message_content = chat_completion(prompt, max_tokens=3000, temperature=0.7, timeout=60)
         
-        if response.status_code == 200:
-            response_data = response.json()
-            message_content = response_data["choices"][0]["message"]["content"]
-            
-            # Извлечение JSON из ответа
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```|```\s*([\s\S]*?)\s*```|(\{[\s\S]*\})', message_content)
-            
-            if json_match:
-                # Определяем, какая группа содержит JSON
-                for group in range(1, 4):
-                    if json_match.group(group):
-                        json_str = json_match.group(group)
-                        break
-            else:
-                # Если не нашли JSON в кодовых блоках, попробуем найти объект напрямую
-                json_str = message_content
-            
-            # Очистка от возможных дополнительных символов
-            json_str = json_str.strip()
-            result = json.loads(json_str)
-            
-            # Добавляем информацию о главе
-            result["chapter_title"] = chapter_title
-            result["chapter_description"] = chapter.get("description", "")
-            
-            return result
+        # Извлечение JSON из ответа
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```|```\s*([\s\S]*?)\s*```|(\{[\s\S]*\})', message_content)
+        
+        if json_match:
+            # Определяем, какая группа содержит JSON
+            for group in range(1, 4):
+                if json_match.group(group):
+                    json_str = json_match.group(group)
+                    break
         else:
-            print(f"Ошибка API: {response.status_code}")
-            print(response.text)
-            return None
+            # Если не нашли JSON в кодовых блоках, попробуем найти объект напрямую
+            json_str = message_content
+        
+        # Очистка от возможных дополнительных символов
+        json_str = json_str.strip()
+        result = json.loads(json_str)
+        
+        # Добавляем информацию о главе
+        result["chapter_title"] = chapter_title
+        result["chapter_description"] = chapter.get("description", "")
+        
+        return result
     except Exception as e:
         print(f"Ошибка при запросе к API: {str(e)}")
         return None
@@ -224,17 +180,21 @@ def create_chapters_in_neo4j(chapters_data, course_name, graph=None):
     for chapter in chapters_data:
         chapter_title = chapter["chapter_title"]
         chapter_description = chapter.get("chapter_description", "")
+        # Время изменения для инкрементных резервных копий
+        updated_at = updated_at_now()
         
         # Создаем узел главы
         chapter_node = Node("Chapter",
                            title=chapter_title,
                            description=chapter_description,
-                           course=course_name)
+                           course=course_name,
+                           updated_at=updated_at)
         graph.create(chapter_node)
         
         # Связываем главу с курсом
         rel = Relationship(chapter_node, "PART_OF", course_node,
-                          description=f"Глава '{chapter_title}' является частью курса '{course_name}'")
+                          description=f"Глава '{chapter_title}' является частью курса '{course_name}'",
+                          updated_at=updated_at)
         graph.create(rel)
         
         print(f"Создана глава '{chapter_title}' и связана с курсом")
@@ -253,12 +213,14 @@ def create_chapters_in_neo4j(chapters_data, course_name, graph=None):
                                   name=concept_name,
                                   definition=concept_data.get("definition", ""),
                                   example=concept_data.get("example", ""),
-                                  questions=concept_data.get("questions", []))
+                                  questions=concept_data.get("questions", []),
+                                  updated_at=updated_at)
                 graph.create(concept_node)
                 
                 # Связываем понятие с курсом
                 course_rel = Relationship(concept_node, "PART_OF", course_node,
-                                        description=f"Понятие '{concept_name}' является частью курса '{course_name}'")
+                                        description=f"Понятие '{concept_name}' является частью курса '{course_name}'",
+                                        updated_at=updated_at)
                 graph.create(course_rel)
             else:
                 # Обновляем существующий узел, если нет определения
@@ -266,12 +228,14 @@ def create_chapters_in_neo4j(chapters_data, course_name, graph=None):
                     concept_node["definition"] = concept_data.get("definition")
                     concept_node["example"] = concept_data.get("example", "")
                     concept_node["questions"] = concept_data.get("questions", [])
+                    concept_node["updated_at"] = updated_at
                     graph.push(concept_node)
             
             # Связываем понятие с главой (MENTIONED_IN)
             if not graph.exists(Relationship(concept_node, "MENTIONED_IN", chapter_node)):
                 chapter_rel = Relationship(concept_node, "MENTIONED_IN", chapter_node,
-                                         description=f"Понятие '{concept_name}' упоминается в главе '{chapter_title}'")
+                                         description=f"Понятие '{concept_name}' упоминается в главе '{chapter_title}'",
+                                         updated_at=updated_at)
                 graph.create(chapter_rel)
                 concepts_count += 1
         
@@ -292,7 +256,8 @@ def create_chapters_in_neo4j(chapters_data, course_name, graph=None):
             if source_node and target_node:
                 # Проверяем, существует ли уже такая связь
                 if not graph.exists(Relationship(source_node, rel_type, target_node)):
-                    rel = Relationship(source_node, rel_type, target_node, description=description)
+                    rel = Relationship(source_node, rel_type, target_node, description=description,
+                                       updated_at=updated_at)
                     graph.create(rel)
                     relationships_count += 1
         
@@ -304,8 +269,15 @@ def main():
     parser = argparse.ArgumentParser(description="Выявление структуры глав в курсе")
     parser.add_argument("--course", type=str, required=True, help="Название курса")
     parser.add_argument("--file", type=str, required=True, help="Путь к файлу курса")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кеш ответов LLM")
+    parser.add_argument("--refresh", action="store_true", help="Не читать ответы из кеша, но обновлять его")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="Файл для метрик запуска: .json или .prom (формат Prometheus); по умолчанию METRICS_FILE")
     args = parser.parse_args()
     
+    configure_cache(enabled=not args.no_cache, refresh=args.refresh)
+    metrics.setup(args.metrics_file)
+    
     # Подключение к Neo4j
     graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
     
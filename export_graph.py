@@ -15,6 +15,7 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
 
 def ensure_results_dir():
     """Убедитесь, что директория для результатов существует"""
@@ -22,84 +23,137 @@ def ensure_results_dir():
         os.makedirs(RESULTS_DIR)
         print(f"Создана директория {RESULTS_DIR} для сохранения результатов")
 
-def export_knowledge_graph(course_name=None):
-    """Экспортирует весь граф знаний или граф конкретного курса в JSON-файл"""
+# Условия отбора узлов и связей для экспорта одного курса:
+# сам курс, его главы и понятия (PART_OF) и их соседи среди глав и понятий
+COURSE_NODE_FILTER = """
+    (x:Course AND x.name = $course_name)
+    OR (x)-[:PART_OF]->(:Course {name: $course_name})
+    OR ((x:Chapter OR x:Concept) AND (
+        (x)--(:Chapter)-[:PART_OF]->(:Course {name: $course_name})
+        OR (x)--(:Concept)-[:PART_OF]->(:Course {name: $course_name})))
+"""
+COURSE_RELATIONSHIP_FILTER = """
+    (type(r) = 'PART_OF' AND b:Course AND b.name = $course_name)
+    OR ((a:Chapter OR a:Concept) AND (b:Chapter OR b:Concept) AND (
+        (a)-[:PART_OF]->(:Course {name: $course_name})
+        OR (b)-[:PART_OF]->(:Course {name: $course_name})))
+"""
+
+def iter_nodes(graph, course_name=None, page_size=EXPORT_PAGE_SIZE):
+    """Постранично читает узлы графа (или курса), упорядочивая их по id"""
+    condition = f"AND ({COURSE_NODE_FILTER})" if course_name else ""
+    query = f"""
+    MATCH (x) WHERE id(x) > $after {condition}
+    RETURN id(x) AS id, labels(x) AS labels, properties(x) AS properties
+    ORDER BY id(x) LIMIT $page_size
+    """
+    after = -1
+    while True:
+        page = graph.run(query, after=after, page_size=page_size, course_name=course_name).data()
+        for record in page:
+            yield {
+                "id": str(record["id"]),
+                "labels": record["labels"],
+                "properties": record["properties"]
+            }
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+def iter_relationships(graph, course_name=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Постранично читает связи графа (или курса), упорядочивая их по id.
+    Шаблон направленный, поэтому каждая связь попадает в экспорт один раз.
+    """
+    condition = f"AND ({COURSE_RELATIONSHIP_FILTER})" if course_name else ""
+    query = f"""
+    MATCH (a)-[r]->(b) WHERE id(r) > $after {condition}
+    RETURN id(r) AS id, type(r) AS type, id(a) AS start, id(b) AS end, properties(r) AS properties
+    ORDER BY id(r) LIMIT $page_size
+    """
+    after = -1
+    while True:
+        page = graph.run(query, after=after, page_size=page_size, course_name=course_name).data()
+        for record in page:
+            yield {
+                "id": str(record["id"]),
+                "type": record["type"],
+                "startNode": str(record["start"]),
+                "endNode": str(record["end"]),
+                "properties": record["properties"]
+            }
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+def write_json_export(f, nodes, relationships):
+    """Пишет экспорт в формате {"nodes": [...], "relationships": [...]} по одному элементу"""
+    counts = {}
+    f.write("{\n")
+    for section, items in (("nodes", nodes), ("relationships", relationships)):
+        if section != "nodes":
+            f.write(",\n")
+        f.write(f'  "{section}": [')
+        count = 0
+        for item in items:
+            f.write(",\n    " if count else "\n    ")
+            f.write(json.dumps(item, ensure_ascii=False))
+            count += 1
+        f.write("\n  ]" if count else "]")
+        counts[section] = count
+    f.write("\n}\n")
+    return counts["nodes"], counts["relationships"]
+
+def write_ndjson_export(f, nodes, relationships):
+    """Пишет экспорт построчно: каждый узел и каждая связь - отдельный JSON-объект с полем kind"""
+    counts = {"node": 0, "relationship": 0}
+    for kind, items in (("node", nodes), ("relationship", relationships)):
+        for item in items:
+            f.write(json.dumps({"kind": kind, **item}, ensure_ascii=False) + "\n")
+            counts[kind] += 1
+    return counts["node"], counts["relationship"]
+
+def export_knowledge_graph(course_name=None, output_format="json", page_size=EXPORT_PAGE_SIZE):
+    """
+    Экспортирует весь граф знаний или граф конкретного курса в файл.
+    
+    Узлы и связи читаются страницами и сразу пишутся в файл, поэтому
+    расход памяти не зависит от размера графа.
+    
+    Parameters:
+    - course_name: название курса (по умолчанию весь граф)
+    - output_format: "json" (один JSON-документ) или "ndjson" (по объекту на строку)
+    - page_size: количество узлов или связей, читаемых одним запросом
+    """
     try:
         ensure_results_dir()
         
         # Подключение к Neo4j
         graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
         
+        extension = "ndjson" if output_format == "ndjson" else "json"
         if course_name:
-            # Запрос для экспорта знаний конкретного курса
-            cypher_query = """
-            MATCH (c:Course {name: $course_name})
-            OPTIONAL MATCH (c)<-[r1:PART_OF]-(n)
-            OPTIONAL MATCH (n)-[r2]-(m)
-            WHERE (n:Chapter OR n:Concept) AND (m:Chapter OR m:Concept)
-            RETURN c, r1, n, r2, m
-            """
             print(f"Экспорт графа знаний для курса '{course_name}'...")
-            result = graph.run(cypher_query, course_name=course_name).data()
-            export_filename = f"course_{course_name.lower().replace(' ', '_')}_graph_export.json"
+            export_filename = f"course_{course_name.lower().replace(' ', '_')}_graph_export.{extension}"
         else:
-            # Запрос для экспорта всего графа знаний
-            cypher_query = """
-            MATCH (n)
-            OPTIONAL MATCH (n)-[r]-(m)
-            RETURN n, r, m
-            """
             print("Экспорт всего графа знаний...")
-            result = graph.run(cypher_query).data()
-            export_filename = "complete_graph_export.json"
-        
-        # Преобразование результатов в JSON
-        export_data = {
-            "nodes": [],
-            "relationships": []
-        }
-        
-        # Словарь для отслеживания уже добавленных узлов
-        processed_nodes = {}
+            export_filename = f"complete_graph_export.{extension}"
         
-        # Обработка результатов
-        for record in result:
-            # Обработка узлов
-            for node_key in ['c', 'n', 'm']:
-                if node_key in record and record[node_key] is not None:
-                    node = record[node_key]
-                    node_id = str(node.identity)
-                    
-                    if node_id not in processed_nodes:
-                        # Добавляем узел в экспорт
-                        node_data = {
-                            "id": node_id,
-                            "labels": list(node.labels),
-                            "properties": dict(node)
-                        }
-                        export_data["nodes"].append(node_data)
-                        processed_nodes[node_id] = True
-            
-            # Обработка отношений
-            for rel_key in ['r1', 'r2']:
-                if rel_key in record and record[rel_key] is not None:
-                    rel = record[rel_key]
-                    rel_data = {
-                        "id": str(rel.identity),
-                        "type": rel.type,
-                        "startNode": str(rel.start_node.identity),
-                        "endNode": str(rel.end_node.identity),
-                        "properties": dict(rel)
-                    }
-                    export_data["relationships"].append(rel_data)
+        nodes = iter_nodes(graph, course_name, page_size)
+        relationships = iter_relationships(graph, course_name, page_size)
         
-        # Сохранение в файл
+        # Пишем во временный файл, чтобы при ошибке не оставить неполный экспорт
         export_path = os.path.join(RESULTS_DIR, export_filename)
-        with open(export_path, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
+        tmp_path = export_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if output_format == "ndjson":
+                node_count, relationship_count = write_ndjson_export(f, nodes, relationships)
+            else:
+                node_count, relationship_count = write_json_export(f, nodes, relationships)
+        os.replace(tmp_path, export_path)
         
         print(f"Граф знаний экспортирован в {export_path}")
-        print(f"Всего экспортировано: {len(export_data['nodes'])} узлов, {len(export_data['relationships'])} связей")
+        print(f"Всего экспортировано: {node_count} узлов, {relationship_count} связей")
         return True
     except Exception as e:
         print(f"Ошибка при экспорте графа знаний: {str(e)}")
@@ -126,6 +180,10 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Экспорт графа знаний из Neo4j')
     parser.add_argument('--course', type=str, help='Название курса для экспорта (по умолчанию: все курсы)')
     parser.add_argument('--list', action='store_true', help='Вывести список всех курсов')
+    parser.add_argument('--format', type=str, choices=['json', 'ndjson'], default='json',
+                        help='Формат файла: json (по умолчанию) или ndjson (по объекту на строку)')
+    parser.add_argument('--page-size', type=int, default=EXPORT_PAGE_SIZE,
+                        help=f'Количество узлов или связей, читаемых одним запросом (по умолчанию {EXPORT_PAGE_SIZE})')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -137,4 +195,4 @@ if __name__ == "__main__":
         for i, course in enumerate(courses):
             print(f"{i+1}. {course}")
     else:
-        export_knowledge_graph(args.course) 
\ No newline at end of file
+        export_knowledge_graph(args.course, args.format, args.page_size) 
\ No newline at end of file
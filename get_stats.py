@@ -3,6 +3,8 @@
 
 from py2neo import Graph
 import os
+import json
+import argparse
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
@@ -13,78 +15,150 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 
-def get_course_stats():
+# Статистика по всем курсам одним запросом.
+# Связи между понятиями берутся через DISTINCT, поэтому связь между двумя понятиями курса
+# считается один раз, хотя шаблон находит ее с обеих сторон.
+STATS_QUERY = """
+MATCH (course:Course)
+CALL {
+    WITH course
+    OPTIONAL MATCH (course)<-[:PART_OF]-(concept:Concept)
+    RETURN count(concept) AS concepts,
+           count(CASE WHEN concept.definition IS NOT NULL AND concept.definition <> '' THEN 1 END) AS concepts_with_def
+}
+CALL {
+    WITH course
+    OPTIONAL MATCH (course)<-[:PART_OF]-(concept:Concept)
+    WHERE concept.definition IS NULL OR concept.definition = ''
+    WITH concept ORDER BY concept.name
+    RETURN collect(concept.name)[..10] AS concepts_without_def
+}
+CALL {
+    WITH course
+    OPTIONAL MATCH (course)<-[:PART_OF]-(c1:Concept)-[r]-(c2:Concept)
+    WHERE c1 <> c2
+    WITH DISTINCT r
+    WITH type(r) AS type, count(r) AS count
+    ORDER BY count DESC
+    RETURN collect(CASE WHEN type IS NOT NULL THEN {type: type, count: count} END) AS rel_types
+}
+RETURN course.name AS name, concepts, concepts_with_def, concepts_without_def, rel_types
+ORDER BY name
+"""
+
+# Только понятия без определений: без подсчета связей, который занимает большую часть времени запроса
+MISSING_DEFINITIONS_QUERY = """
+MATCH (course:Course)
+OPTIONAL MATCH (course)<-[:PART_OF]-(concept:Concept)
+WHERE concept.definition IS NULL OR concept.definition = ''
+WITH course, concept ORDER BY concept.name
+RETURN course.name AS name, count(concept) AS concepts_without_def_count,
+       collect(concept.name)[..10] AS concepts_without_def
+ORDER BY name
+"""
+
+def collect_missing_definitions(graph=None):
+    """Возвращает для каждого курса число понятий без определений и первые 10 из них"""
+    if graph is None:
+        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    
+    return [
+        {
+            "course": record["name"],
+            "concepts_without_definition": record["concepts_without_def_count"],
+            "concepts_without_definition_sample": record["concepts_without_def"]
+        }
+        for record in graph.run(MISSING_DEFINITIONS_QUERY).data()
+    ]
+
+def collect_course_stats(graph=None):
+    """Возвращает статистику по всем курсам в виде списка словарей"""
+    if graph is None:
+        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    
+    stats = []
+    for record in graph.run(STATS_QUERY).data():
+        concepts = record["concepts"]
+        concepts_with_def = record["concepts_with_def"]
+        stats.append({
+            "course": record["name"],
+            "concepts": concepts,
+            "concepts_with_definition": concepts_with_def,
+            "concepts_without_definition": concepts - concepts_with_def,
+            "definition_percent": round(concepts_with_def / concepts * 100 if concepts > 0 else 0, 1),
+            "relationships": sum(rel["count"] for rel in record["rel_types"]),
+            "relationship_types": record["rel_types"],
+            "concepts_without_definition_sample": record["concepts_without_def"]
+        })
+    return stats
+
+def get_course_stats(as_json=False):
     """Получает статистику по курсам в Neo4j"""
     try:
-        # Подключение к Neo4j
-        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        stats = collect_course_stats()
         
-        print("Статистика по курсам:")
+        if as_json:
+            print(json.dumps(stats, ensure_ascii=False, indent=2))
+            return stats
         
-        # Получаем список всех курсов
-        courses = graph.run("MATCH (c:Course) RETURN c.name AS name").data()
+        print("Статистика по курсам:")
         
-        for course in courses:
-            course_name = course["name"]
-            
-            # Общее количество понятий в курсе
-            concepts = graph.run(
-                "MATCH (c:Course {name: $name})<-[:PART_OF]-(concept:Concept) "
-                "RETURN count(concept) AS count",
-                name=course_name
-            ).data()[0]["count"]
-            
-            # Количество понятий с определениями
-            concepts_with_def = graph.run(
-                "MATCH (c:Course {name: $name})<-[:PART_OF]-(concept:Concept) "
-                "WHERE concept.definition IS NOT NULL AND concept.definition <> '' "
-                "RETURN count(concept) AS count",
-                name=course_name
-            ).data()[0]["count"]
-            
-            # Количество связей между понятиями
-            relationships = graph.run(
-                "MATCH (c:Course {name: $name})<-[:PART_OF]-(c1:Concept)-[r]-(c2:Concept) "
-                "WHERE c1 <> c2 RETURN count(r) AS count",
-                name=course_name
-            ).data()[0]["count"]
-            
-            # Статистика по типам связей
-            rel_types = graph.run(
-                "MATCH (c:Course {name: $name})<-[:PART_OF]-(c1:Concept)-[r]-(c2:Concept) "
-                "WHERE c1 <> c2 RETURN type(r) AS type, count(r) AS count "
-                "ORDER BY count DESC",
-                name=course_name
-            ).data()
-            
-            # Список понятий без определений
-            concepts_without_def = graph.run(
-                "MATCH (c:Course {name: $name})<-[:PART_OF]-(concept:Concept) "
-                "WHERE concept.definition IS NULL OR concept.definition = '' "
-                "RETURN concept.name AS name "
-                "ORDER BY concept.name "
-                "LIMIT 10",
-                name=course_name
-            ).data()
-            
+        for course in stats:
             # Вывод статистики
-            print(f"\n{course_name}:")
-            print(f"  Всего понятий: {concepts}")
-            print(f"  Понятий с определениями: {concepts_with_def} ({round(concepts_with_def/concepts*100 if concepts > 0 else 0, 1)}%)")
-            print(f"  Связей между понятиями: {relationships}")
+            print(f"\n{course['course']}:")
+            print(f"  Всего понятий: {course['concepts']}")
+            print(f"  Понятий с определениями: {course['concepts_with_definition']} ({course['definition_percent']}%)")
+            print(f"  Связей между понятиями: {course['relationships']}")
             
-            if rel_types:
+            if course["relationship_types"]:
                 print("  Типы связей:")
-                for rel in rel_types:
+                for rel in course["relationship_types"]:
                     print(f"    {rel['type']}: {rel['count']}")
             
-            if concepts_without_def:
+            if course["concepts_without_definition_sample"]:
                 print("  Примеры понятий без определений (первые 10):")
-                for concept in concepts_without_def:
-                    print(f"    - {concept['name']}")
+                for name in course["concepts_without_definition_sample"]:
+                    print(f"    - {name}")
         
+        return stats
     except Exception as e:
         print(f"Ошибка при получении статистики: {str(e)}")
+        return None
+
+def get_missing_definitions(as_json=False):
+    """Выводит по каждому курсу только понятия без определений"""
+    try:
+        missing = collect_missing_definitions()
+        
+        if as_json:
+            print(json.dumps(missing, ensure_ascii=False, indent=2))
+            return missing
+        
+        print("Понятия без определений:")
+        
+        for course in missing:
+            print(f"\n{course['course']}: {course['concepts_without_definition']}")
+            if course["concepts_without_definition_sample"]:
+                print("  Примеры (первые 10):")
+                for name in course["concepts_without_definition_sample"]:
+                    print(f"    - {name}")
+        
+        return missing
+    except Exception as e:
+        print(f"Ошибка при получении понятий без определений: {str(e)}")
+        return None
+
+def parse_args():
+    """Парсинг аргументов командной строки"""
+    parser = argparse.ArgumentParser(description='Статистика по курсам в Neo4j')
+    parser.add_argument('--json', action='store_true', help='Вывести статистику в формате JSON')
+    parser.add_argument('--check-missing-definitions', action='store_true',
+                        help='Показать только количество и примеры понятий без определений')
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    get_course_stats() 
\ No newline at end of file
+    args = parse_args()
+    if args.check_missing_definitions:
+        get_missing_definitions(args.json)
+    else:
+        get_course_stats(args.json)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+class JSONStreamParser:
+    """
+    Инкрементальный разбор JSON-ответа модели, который приходит по частям.
+
+    Следит за вложенностью скобок и строками и, как только закрывается объект -
+    элемент массива с одним из ключей `keys` (например, "concepts"), разбирает его
+    и передает в on_item(key, item). Текст до и после JSON (```json и пояснения)
+    пропускается. Элементы, которые не удалось разобрать, пропускаются.
+    """
+
+    def __init__(self, keys=("concepts",), on_item=None):
+        self.keys = set(keys)
+        self.on_item = on_item
+        self.reset()
+
+    def reset(self):
+        """Начинает разбор заново (например, при повторной попытке запроса)"""
+        self.items = {key: [] for key in self.keys}
+        self._text = []
+        self._length = 0
+        self._buffer = ""
+        self._buffer_start = 0
+        # Стек: [тип скобки, ключ] - для объекта последний прочитанный ключ, для массива его ключ
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._item_start = None
+        self._item_key = None
+        self._item_depth = None
+
+    def text(self):
+        """Весь полученный текст ответа"""
+        return "".join(self._text)
+
+    def count(self, key):
+        return len(self.items.get(key, []))
+
+    def feed(self, fragment):
+        """Обрабатывает очередной фрагмент текста и возвращает список новых элементов (ключ, элемент)"""
+        self._text.append(fragment)
+        offset = self._length
+        self._length += len(fragment)
+        self._buffer += fragment
+        completed = []
+
+        for pos, ch in enumerate(fragment, offset):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = self._slice(self._string_start + 1, pos)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == ":":
+                if self._stack and self._stack[-1][0] == "{":
+                    self._stack[-1][1] = self._decode_key(self._last_string)
+            elif ch == ",":
+                if self._stack and self._stack[-1][0] == "{":
+                    self._stack[-1][1] = None
+            elif ch == "{":
+                if self._item_start is None and self._stack and self._stack[-1][0] == "[" and self._stack[-1][1] in self.keys:
+                    self._item_start = pos
+                    self._item_key = self._stack[-1][1]
+                    self._item_depth = len(self._stack)
+                self._stack.append(["{", None])
+            elif ch == "[":
+                key = self._stack[-1][1] if self._stack and self._stack[-1][0] == "{" else None
+                self._stack.append(["[", key])
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if ch == "}" and self._item_start is not None and len(self._stack) == self._item_depth:
+                    item = self._parse_item(self._slice(self._item_start, pos + 1))
+                    key = self._item_key
+                    self._item_start = None
+                    if item is not None:
+                        self.items[key].append(item)
+                        completed.append((key, item))
+                        if self.on_item is not None:
+                            self.on_item(key, item)
+
+        self._trim()
+        return completed
+
+    def _slice(self, start, end):
+        return self._buffer[start - self._buffer_start:end - self._buffer_start]
+
+    def _trim(self):
+        """Оставляет в буфере только текст, который может понадобиться для разбора"""
+        keep_from = self._length
+        if self._item_start is not None:
+            keep_from = min(keep_from, self._item_start)
+        if self._in_string and self._string_start is not None:
+            keep_from = min(keep_from, self._string_start)
+        if keep_from > self._buffer_start:
+            self._buffer = self._buffer[keep_from - self._buffer_start:]
+            self._buffer_start = keep_from
+
+    @staticmethod
+    def _decode_key(raw):
+        if raw is None:
+            return None
+        try:
+            return json.loads(f'"{raw}"')
+        except ValueError:
+            return raw
+
+    @staticmethod
+    def _parse_item(text):
+        try:
+            item = json.loads(text)
+        except ValueError:
+            return None
+        return item if isinstance(item, dict) else None
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Конфигурация кеша ответов LLM
+LLM_CACHE = os.getenv("LLM_CACHE", "sqlite")  # sqlite, dir или off
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "500"))
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+
+def make_cache_key(model, prompt, max_tokens, temperature, response_format=None):
+    """
+    Вычисляет ключ кеша как хеш от параметров запроса.
+    response_format учитывается, только если задан, поэтому ключи прежних запросов не меняются
+    """
+    params = {
+        "model": model,
+        "prompt": prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    if response_format is not None:
+        params["response_format"] = response_format
+    payload = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SQLiteCache:
+    """Кеш ответов в одном файле SQLite"""
+
+    def __init__(self, path, max_bytes, max_age):
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, "responses.sqlite3")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if self.max_age and now - created_at > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """Удаляет устаревшие записи, затем самые давно использованные, пока кеш не уложится в лимит"""
+        removed = 0
+        with self._lock:
+            if self.max_age:
+                cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+                removed += cursor.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+            self._conn.commit()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": total}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+class DirectoryCache:
+    """Кеш ответов в виде файлов, разложенных по подкаталогам по первым символам ключа"""
+
+    def __init__(self, path, max_bytes, max_age):
+        self.root = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+
+    def _file_path(self, key):
+        return os.path.join(self.root, key[:2], f"{key[2:]}.json")
+
+    def _entries(self):
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.endswith(".json"):
+                    yield os.path.join(shard_dir, name)
+
+    def get(self, key):
+        file_path = self._file_path(key)
+        try:
+            stat = os.stat(file_path)
+            if self.max_age and time.time() - stat.st_mtime > self.max_age:
+                os.remove(file_path)
+                return None
+            with open(file_path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+            # Время доступа нужно для вытеснения давно неиспользуемых записей
+            os.utime(file_path, (time.time(), stat.st_mtime))
+            return value
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key, value):
+        file_path = self._file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Пишем во временный файл и переименовываем, чтобы параллельные читатели не видели неполную запись
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+
+    def evict(self):
+        """Удаляет устаревшие файлы, затем самые давно использованные, пока кеш не уложится в лимит"""
+        removed = 0
+        now = time.time()
+        entries = []
+        for file_path in self._entries():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if self.max_age and now - stat.st_mtime > self.max_age:
+                os.remove(file_path)
+                removed += 1
+            else:
+                entries.append((stat.st_atime, stat.st_size, file_path))
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes and total > self.max_bytes:
+            for _, size, file_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(file_path)
+                total -= size
+                removed += 1
+        return removed
+
+    def stats(self):
+        count = 0
+        total = 0
+        for file_path in self._entries():
+            count += 1
+            total += os.path.getsize(file_path)
+        return {"entries": count, "bytes": total}
+
+    def clear(self):
+        for file_path in list(self._entries()):
+            os.remove(file_path)
+
+def open_cache(backend=None, path=None):
+    """Создает кеш указанного типа или возвращает None, если кеш отключен"""
+    backend = backend or LLM_CACHE
+    path = path or LLM_CACHE_PATH
+    max_bytes = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+    max_age = LLM_CACHE_MAX_AGE_DAYS * 24 * 3600
+    if backend == "sqlite":
+        return SQLiteCache(path, max_bytes, max_age)
+    if backend == "dir":
+        return DirectoryCache(path, max_bytes, max_age)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление кешем ответов LLM")
+    parser.add_argument("command", choices=["stats", "evict", "clear"], help="Команда для выполнения")
+    parser.add_argument("--backend", type=str, choices=["sqlite", "dir"], default=None,
+                        help="Тип хранилища (по умолчанию из LLM_CACHE)")
+    parser.add_argument("--path", type=str, default=None, help="Путь к кешу (по умолчанию из LLM_CACHE_PATH)")
+    args = parser.parse_args()
+
+    cache = open_cache(args.backend, args.path)
+    if cache is None:
+        print("Кеш отключен (LLM_CACHE=off)")
+        return
+
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Записей в кеше: {stats['entries']}, размер: {stats['bytes'] / (1024 * 1024):.2f} МБ")
+    elif args.command == "evict":
+        print(f"Удалено записей: {cache.evict()}")
+    elif args.command == "clear":
+        cache.clear()
+        print("Кеш очищен")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import random
+import sqlite3
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from llm_cache import open_cache, make_cache_key
+from llm_rate_limit import (TokenBucketLimiter, LLM_RATE_LIMIT_PATH, LLM_RATE_BURST, LLM_RATE_MIN,
+                            LLM_RATE_GROWTH)
+import metrics
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Конфигурация клиента OpenRouter
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+AI_MODEL = os.getenv("AI_MODEL", "x-ai/grok-2-1212")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+# Максимальная длина ответа, которую принимает модель: больший max_tokens уменьшается до нее
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "16000"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Минимальный интервал между запросами, когда лимиты провайдера не мешают (задает максимальный темп)
+LLM_MIN_INTERVAL = float(os.getenv("LLM_MIN_INTERVAL", "0.2"))
+# Получать ответ потоком (stream=true, Server-Sent Events): позволяет оборвать зациклившийся ответ
+# и сохранить готовые объекты обрезанного ответа
+LLM_STREAM = os.getenv("LLM_STREAM", "1").lower() in ("1", "true", "yes", "on")
+# Запрашивать ответ по JSON-схеме (response_format), если скрипт ее передает
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1").lower() in ("1", "true", "yes", "on")
+
+# Коды ответа, при которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    """Ошибка обращения к LLM API после исчерпания всех попыток"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class StopStream(Exception):
+    """Выбрасывается обработчиком потока, чтобы прервать получение ответа (например, если модель зациклилась)"""
+
+class RateLimiter:
+    """
+    Ограничивает число одновременных запросов процесса, а темп их отправки - общим
+    для всех скриптов адаптивным token bucket (llm_rate_limit.py), который открывается
+    при первом запросе
+    """
+
+    def __init__(self, max_concurrency, min_interval):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._max_rate = 1.0 / max(min_interval, 0.001)
+        self._bucket = None
+        self._bucket_lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            with self._bucket_lock:
+                if self._bucket is None:
+                    try:
+                        self._bucket = TokenBucketLimiter(LLM_RATE_LIMIT_PATH, OPENROUTER_URL, self._max_rate,
+                                                          LLM_RATE_BURST, LLM_RATE_MIN, LLM_RATE_GROWTH)
+                    except sqlite3.Error as e:
+                        # Общий файл недоступен - лимит действует только внутри процесса
+                        print(f"Не удалось открыть общий лимит запросов {LLM_RATE_LIMIT_PATH}: {str(e)}")
+                        self._bucket = TokenBucketLimiter("off", OPENROUTER_URL, self._max_rate,
+                                                          LLM_RATE_BURST, LLM_RATE_MIN, LLM_RATE_GROWTH)
+        return self._bucket
+
+    def __enter__(self):
+        with metrics.span("llm.rate_limit_wait"):
+            self._semaphore.acquire()
+            try:
+                self.bucket.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._semaphore.release()
+        return False
+
+# Общий лимитер для всех потоков процесса
+rate_limiter = RateLimiter(LLM_MAX_CONCURRENCY, LLM_MIN_INTERVAL)
+
+_session = None
+_session_lock = threading.Lock()
+
+# Сбрасывается, если модель отклонила response_format (400): дальше запросы идут без схемы
+_structured_output = LLM_STRUCTURED_OUTPUT
+
+# Кеш ответов: "on" - читать и записывать, "refresh" - только записывать, "off" - не использовать
+_cache = None
+_cache_mode = "on"
+_cache_lock = threading.Lock()
+
+def configure_cache(enabled=True, refresh=False):
+    """Настраивает использование кеша ответов (флаги --no-cache и --refresh)"""
+    global _cache_mode
+    if not enabled:
+        _cache_mode = "off"
+    elif refresh:
+        _cache_mode = "refresh"
+    else:
+        _cache_mode = "on"
+
+def get_cache():
+    """Возвращает кеш ответов (при первом обращении открывает его и удаляет устаревшие записи)"""
+    global _cache
+    if _cache_mode == "off":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    cache = open_cache()
+                    if cache is not None:
+                        cache.evict()
+                    _cache = cache or False
+                except Exception as e:
+                    print(f"Не удалось открыть кеш ответов LLM: {str(e)}")
+                    _cache = False
+    return _cache or None
+
+def get_session():
+    """Возвращает общую HTTP-сессию с keep-alive и пулом соединений"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "https://adapter-course.ru",
+                    "X-Title": "Adapter Course",
+                })
+                _session = session
+    return _session
+
+def _feed_whole(stream_handler, content):
+    """Передает обработчику потока весь ответ сразу (ответ из кеша или без потока)"""
+    try:
+        stream_handler.feed(content)
+    except StopStream:
+        pass
+
+def _store(cache, cache_key, content, finish_reason):
+    """
+    Записывает ответ в кеш. Обрезанный ответ (finish_reason "length") и ответ, в котором API
+    не указал finish_reason, не кешируются, чтобы следующий запуск не получил неполный JSON
+    """
+    if cache is None:
+        return
+    if finish_reason in (None, "length"):
+        metrics.count("llm.cache_skipped")
+        return
+    try:
+        cache.set(cache_key, content)
+    except Exception as e:
+        print(f"Ошибка записи в кеш ответов LLM: {str(e)}")
+
+def _rejects_response_format(response):
+    """Ответ 400 относится к неподдерживаемому response_format, а не к другой ошибке запроса"""
+    text = response.text.lower()
+    return "response_format" in text or "json_schema" in text
+
+def backoff_delay(attempt):
+    """Время ожидания перед повторной попыткой (экспоненциально, с джиттером)"""
+    delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+def read_stream(response, stream_handler=None):
+    """
+    Читает ответ в формате Server-Sent Events и возвращает (текст, finish_reason, usage).
+    Каждый фрагмент текста сразу передается в stream_handler.feed; если обработчик
+    выбрасывает StopStream, чтение прекращается и finish_reason равен "stopped"
+    """
+    response.encoding = "utf-8"
+    parts = []
+    finish_reason = None
+    usage = None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            # Пустые строки разделяют события, строки с ":" - комментарии (keep-alive)
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            choice = (chunk.get("choices") or [{}])[0]
+            fragment = (choice.get("delta") or {}).get("content")
+            if fragment:
+                parts.append(fragment)
+                if stream_handler is not None:
+                    stream_handler.feed(fragment)
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    except StopStream:
+        finish_reason = "stopped"
+    finally:
+        response.close()
+    return "".join(parts), finish_reason, usage
+
+def chat_completion(prompt, max_tokens=8000, temperature=0.7, timeout=None, model=None, max_attempts=None, refresh=False,
+                    stream=None, stream_handler=None, response_format=None):
+    """
+    Отправляет промпт в OpenRouter и возвращает текст ответа модели.
+
+    Сетевые ошибки и 5xx повторяются с экспоненциальной паузой, а после 429 повтор ждет
+    в общем лимитере (Retry-After, x-ratelimit-reset), который заодно снижает темп всех запросов.
+    После исчерпания попыток или при неповторяемой ошибке выбрасывается LLMError.
+    Успешные ответы сохраняются в кеш по хешу модели, промпта, max_tokens и temperature
+    (обрезанные на max_tokens и оборванные ответы не кешируются).
+
+    В потоковом режиме (stream=True или LLM_STREAM) ответ читается по мере генерации, и
+    каждый фрагмент сразу передается в stream_handler.feed (например, JSONStreamParser),
+    чтобы обработчик мог оборвать зациклившийся ответ или сохранить готовые объекты обрезанного.
+    Если обработчик выбрасывает StopStream, генерация обрывается и возвращается полученный текст
+    (он не кешируется). Поток, закончившийся без finish_reason (соединение оборвалось до
+    последнего события), считается ошибкой и повторяется.
+    Без потока (и при ответе из кеша) обработчик получает весь текст одним фрагментом.
+    Перед повторной попыткой вызывается stream_handler.reset().
+
+    response_format (например, {"type": "json_schema", ...}) передается в API, чтобы модель
+    отвечала строго по JSON-схеме. Если модель не поддерживает структурированный ответ (400
+    с упоминанием response_format или json_schema), запрос повторяется без него, и до конца работы процесса response_format не отправляется.
+
+    Parameters:
+    - prompt: текст запроса пользователя
+    - max_tokens, temperature: параметры генерации (max_tokens не больше LLM_MAX_OUTPUT_TOKENS)
+    - timeout: таймаут чтения ответа в секундах (по умолчанию LLM_TIMEOUT)
+    - model: модель (по умолчанию AI_MODEL)
+    - max_attempts: количество попыток (по умолчанию LLM_MAX_ATTEMPTS)
+    - refresh: не читать ответ из кеша (например, если закешированный ответ не удалось разобрать)
+    - stream: получать ответ потоком (по умолчанию LLM_STREAM)
+    - stream_handler: объект с методами feed(текст) и reset() для обработки ответа по частям
+    - response_format: формат ответа (по умолчанию свободный текст; отключается LLM_STRUCTURED_OUTPUT=0)
+    """
+    global _structured_output
+    if timeout is None:
+        timeout = LLM_TIMEOUT
+    if max_attempts is None:
+        max_attempts = LLM_MAX_ATTEMPTS
+    if stream is None:
+        stream = LLM_STREAM
+    # Запрос с max_tokens больше лимита модели завершился бы ошибкой 400
+    max_tokens = min(max_tokens, LLM_MAX_OUTPUT_TOKENS)
+
+    payload = {
+        "model": model or AI_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    if response_format is not None and _structured_output:
+        payload["response_format"] = response_format
+
+    cache = get_cache()
+    cache_key = make_cache_key(payload["model"], prompt, max_tokens, temperature, payload.get("response_format"))
+    if cache is not None and not refresh and _cache_mode != "refresh":
+        try:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                metrics.count("llm.cache_hits")
+                if stream_handler is not None:
+                    _feed_whole(stream_handler, cached)
+                return cached
+        except Exception as e:
+            print(f"Ошибка чтения кеша ответов LLM: {str(e)}")
+
+    if stream:
+        payload["stream"] = True
+
+    session = get_session()
+    last_error = None
+    attempt = 0
+    while attempt < max_attempts:
+        rate_limited = False
+        if attempt > 0 and stream_handler is not None and hasattr(stream_handler, "reset"):
+            stream_handler.reset()
+        try:
+            with rate_limiter:
+                metrics.count("llm.requests")
+                with metrics.span("llm.request"):
+                    response = session.post(OPENROUTER_URL, json=payload, timeout=(LLM_CONNECT_TIMEOUT, timeout),
+                                            stream=stream)
+                    if stream and response.status_code == 200:
+                        content, finish_reason, usage = read_stream(response, stream_handler)
+        except requests.exceptions.RequestException as e:
+            metrics.count("llm.network_errors")
+            last_error = LLMError(f"Сетевая ошибка при обращении к API: {str(e)}")
+        else:
+            if response.status_code != 200:
+                metrics.count(f"llm.status_{response.status_code}")
+            if response.status_code == 200:
+                # Темп запросов растет, а заголовки x-ratelimit-* уточняют оставшийся лимит
+                rate_limiter.bucket.on_success(response.headers)
+            if response.status_code == 200 and stream:
+                usage = usage or {}
+                metrics.count("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+                metrics.count("llm.completion_tokens", usage.get("completion_tokens", 0))
+                if finish_reason == "length":
+                    metrics.count("llm.truncated")
+                    print(f"Ответ модели обрезан на max_tokens={max_tokens}")
+                if finish_reason == "stopped":
+                    # Ответ прерван обработчиком - в кеш его не записываем
+                    metrics.count("llm.stream_stopped")
+                    return content
+                if finish_reason is not None:
+                    _store(cache, cache_key, content, finish_reason)
+                    return content
+                # Соединение оборвалось до последнего события: ответ неполный, повторяем запрос
+                metrics.count("llm.stream_incomplete")
+                last_error = LLMError("Поток ответа оборвался до завершения генерации", response.status_code)
+            elif response.status_code == 200:
+                try:
+                    data = response.json()
+                    content = data["choices"][0]["message"]["content"]
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    last_error = LLMError(f"Некорректный ответ API: {str(e)}", response.status_code)
+                else:
+                    usage = data.get("usage") or {}
+                    metrics.count("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+                    metrics.count("llm.completion_tokens", usage.get("completion_tokens", 0))
+                    finish_reason = data["choices"][0].get("finish_reason")
+                    if finish_reason == "length":
+                        metrics.count("llm.truncated")
+                        print(f"Ответ модели обрезан на max_tokens={max_tokens}")
+                    if stream_handler is not None:
+                        _feed_whole(stream_handler, content)
+                    _store(cache, cache_key, content, finish_reason)
+                    return content
+            elif response.status_code == 400 and "response_format" in payload and _rejects_response_format(response):
+                # Модель не поддерживает response_format - сразу повторяем запрос без схемы
+                # (повтор не расходует попытку, поэтому выполняется и при LLM_MAX_ATTEMPTS=1)
+                print(f"Модель {payload['model']} не принимает response_format, запросы отправляются без JSON-схемы")
+                metrics.count("llm.structured_output_rejected")
+                _structured_output = False
+                del payload["response_format"]
+                cache_key = make_cache_key(payload["model"], prompt, max_tokens, temperature)
+                continue
+            elif response.status_code == 429:
+                # Превышен лимит провайдера: общий лимитер снижает темп и задерживает все запросы,
+                # включая запросы других потоков и скриптов, на время из Retry-After
+                delay = rate_limiter.bucket.on_rate_limited(response.headers, default_delay=backoff_delay(attempt))
+                rate_limited = True
+                last_error = LLMError(f"Ошибка API: 429, повтор через {delay:.1f} с {response.text[:200]}", 429)
+            elif response.status_code in RETRYABLE_STATUS_CODES:
+                last_error = LLMError(f"Ошибка API: {response.status_code} {response.text[:200]}", response.status_code)
+            else:
+                raise LLMError(f"Ошибка API: {response.status_code} {response.text[:200]}", response.status_code)
+
+        print(f"{last_error}. Попытка {attempt + 1} из {max_attempts}")
+        if attempt < max_attempts - 1 and not rate_limited:
+            metrics.sleep(backoff_delay(attempt), "llm.backoff")
+        attempt += 1
+
+    raise last_error
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Файл SQLite с общим состоянием лимита для всех запущенных скриптов ("off" - только внутри процесса)
+LLM_RATE_LIMIT_PATH = os.getenv("LLM_RATE_LIMIT_PATH", os.path.join("cache", "llm_rate_limit.sqlite3"))
+# Запас запросов, которые можно отправить подряд без паузы
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "1"))
+# Нижняя граница темпа после ответов 429 (запросов в секунду)
+LLM_RATE_MIN = float(os.getenv("LLM_RATE_MIN", "0.2"))
+# Во сколько раз темп растет после каждого успешного ответа
+LLM_RATE_GROWTH = float(os.getenv("LLM_RATE_GROWTH", "1.1"))
+
+# Во сколько раз снижается темп после ответа 429
+RATE_DECREASE = 0.7
+# Через сколько секунд без запросов сниженный темп забывается (лимит провайдера уже восстановился)
+IDLE_RESET = 300
+# Как часто ожидающий запрос перечитывает общее состояние (его могли изменить другие процессы)
+MAX_POLL_INTERVAL = 1.0
+
+# Заголовки лимитов: OpenAI-совместимые (x-ratelimit-*-requests) и OpenRouter (x-ratelimit-*)
+REMAINING_HEADERS = ("x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+RESET_HEADERS = ("x-ratelimit-reset-requests", "x-ratelimit-reset")
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def _header(headers, names):
+    for name in names:
+        value = headers.get(name)
+        if value not in (None, ""):
+            return value.strip()
+    return None
+
+def parse_retry_after(value, now=None):
+    """Retry-After в секундах: число секунд или HTTP-дата. None, если заголовок не разобран"""
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def parse_reset(value, now=None):
+    """
+    Время сброса лимита (unix time) из x-ratelimit-reset: метка времени в миллисекундах
+    или секундах, число секунд до сброса или длительность вида "6m0s"
+    """
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_RE.findall(value)
+        if not parts:
+            return None
+        return now + sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    if number > 1e11:
+        return number / 1000
+    if number > 1e9:
+        return number
+    return now + number
+
+class TokenBucketLimiter:
+    """
+    Ограничивает темп запросов к LLM по алгоритму token bucket. Состояние хранится в SQLite,
+    поэтому лимит общий для всех потоков и для одновременно запущенных скриптов.
+
+    Темп адаптивный: после ответа 429 он снижается в RATE_DECREASE раз, а запросы приостанавливаются
+    на время из Retry-After (или x-ratelimit-reset); после каждого успешного ответа темп
+    растет в rate_growth раз, пока не достигнет max_rate. Если заголовки x-ratelimit-remaining
+    сообщают, что лимит провайдера исчерпан, запросы ждут его сброса.
+    """
+
+    def __init__(self, path, name, max_rate, burst=1.0, min_rate=0.2, rate_growth=1.1):
+        self.name = name
+        self.max_rate = max_rate
+        self.burst = max(1.0, burst)
+        self.min_rate = min(min_rate, max_rate)
+        self.rate_growth = max(1.0, rate_growth)
+        self._lock = threading.Lock()
+        if path == "off":
+            database = ":memory:"
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            database = path
+        # Транзакции открываются вручную (BEGIN IMMEDIATE), чтобы процессы не читали состояние одновременно
+        self._conn = sqlite3.connect(database, timeout=30, isolation_level=None, check_same_thread=False)
+        if database != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                rate REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO buckets (name, tokens, rate, updated_at, blocked_until) VALUES (?, ?, ?, ?, 0)",
+            (name, self.burst, max_rate, time.time())
+        )
+
+    @contextmanager
+    def _state(self):
+        """Читает состояние под блокировкой базы, пополняет запас токенов и сохраняет изменения"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, rate, updated_at, blocked_until = self._conn.execute(
+                    "SELECT tokens, rate, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                # Другой скрипт мог запуститься с большим лимитом - темп не выше своего max_rate
+                rate = min(max(rate, self.min_rate), self.max_rate)
+                if now - updated_at > IDLE_RESET:
+                    rate = self.max_rate
+                state = {
+                    "now": now,
+                    "rate": rate,
+                    "tokens": min(self.burst, tokens + max(0.0, now - updated_at) * rate),
+                    "blocked_until": blocked_until,
+                }
+                yield state
+                self._conn.execute(
+                    "UPDATE buckets SET tokens = ?, rate = ?, updated_at = ?, blocked_until = ? WHERE name = ?",
+                    (state["tokens"], state["rate"], now, state["blocked_until"], self.name)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def acquire(self):
+        """Ждет, пока можно отправить запрос, и забирает один токен. Возвращает время ожидания"""
+        waited = 0.0
+        while True:
+            with self._state() as state:
+                if state["blocked_until"] > state["now"]:
+                    wait = state["blocked_until"] - state["now"]
+                elif state["tokens"] >= 1:
+                    state["tokens"] -= 1
+                    return waited
+                else:
+                    wait = (1 - state["tokens"]) / state["rate"]
+            wait = min(wait, MAX_POLL_INTERVAL)
+            time.sleep(wait)
+            waited += wait
+
+    def _apply_headers(self, state, headers):
+        remaining = _header(headers, REMAINING_HEADERS)
+        if remaining is None:
+            return
+        try:
+            remaining = float(remaining)
+        except ValueError:
+            return
+        state["tokens"] = min(state["tokens"], remaining)
+        if remaining <= 0:
+            reset_at = parse_reset(_header(headers, RESET_HEADERS), state["now"])
+            if reset_at is not None:
+                state["blocked_until"] = max(state["blocked_until"], reset_at)
+
+    def on_success(self, headers=None):
+        """Учитывает успешный ответ: темп постепенно растет, заголовки лимитов уточняют запас"""
+        with self._state() as state:
+            state["rate"] = min(self.max_rate, state["rate"] * self.rate_growth)
+            if headers is not None:
+                self._apply_headers(state, headers)
+
+    def on_rate_limited(self, headers=None, default_delay=1.0):
+        """
+        Учитывает ответ 429: темп снижается, и все запросы ждут время из Retry-After,
+        x-ratelimit-reset или default_delay. Возвращает время ожидания в секундах
+        """
+        with self._state() as state:
+            now = state["now"]
+            delay = None
+            if headers is not None:
+                delay = parse_retry_after(_header(headers, ("retry-after",)), now)
+                if delay is None:
+                    reset_at = parse_reset(_header(headers, RESET_HEADERS), now)
+                    if reset_at is not None:
+                        delay = max(0.0, reset_at - now)
+            if delay is None:
+                delay = default_delay
+            # 429 на запросы, отправленные до предыдущего снижения, темп повторно не снижают
+            if state["blocked_until"] <= now:
+                state["rate"] = max(self.min_rate, state["rate"] * RATE_DECREASE)
+            state["tokens"] = 0.0
+            state["blocked_until"] = max(state["blocked_until"], now + delay)
+            return state["blocked_until"] - now
+
+    def snapshot(self):
+        with self._state() as state:
+            return {"rate": state["rate"], "tokens": state["tokens"],
+                    "blocked_for": max(0.0, state["blocked_until"] - state["now"])}
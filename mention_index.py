@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+# Количество упоминаний и размер контекста вокруг упоминания по умолчанию
+MENTION_LIMIT = 5
+CONTEXT_WINDOW = 300
+
+_WORD_RE = re.compile(r"\w+")
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == "_"
+
+class MentionIndex:
+    """
+    Индекс упоминаний понятий в тексте курса.
+
+    Строится один раз на весь текст: текст переводится в нижний регистр и разбивается
+    на слова, и за один проход по словам для каждого понятия собираются первые
+    `limit` упоминаний на границах слов (без учета регистра).
+    """
+
+    def __init__(self, text, names=(), limit=MENTION_LIMIT, window=CONTEXT_WINDOW):
+        self.text = text
+        self.limit = limit
+        self.window = window
+        self._lower = text.lower()
+        # Для редких символов lower() меняет длину строки, тогда смещения перестают совпадать
+        self._same_length = len(self._lower) == len(text)
+        self._offsets = {}
+
+        # Понятия группируются по первому слову, чтобы проверять только кандидатов
+        by_first_word = {}
+        for name in dict.fromkeys(names):
+            name_lower = name.lower()
+            first_word = _WORD_RE.match(name_lower)
+            if not self._same_length or not first_word:
+                # Понятие начинается не с буквы или цифры - ищем его отдельно
+                self._offsets[name] = self._scan(name)
+                continue
+            self._offsets[name] = []
+            by_first_word.setdefault(first_word.group(0), []).append((name, name_lower))
+
+        if by_first_word:
+            self._index_words(by_first_word)
+
+    def _index_words(self, by_first_word):
+        """Один проход по словам текста для всех понятий сразу"""
+        lower = self._lower
+        text_len = len(lower)
+        pending = sum(len(candidates) for candidates in by_first_word.values())
+        for word in _WORD_RE.finditer(lower):
+            candidates = by_first_word.get(word.group(0))
+            if not candidates:
+                continue
+            start = word.start()
+            for name, name_lower in candidates:
+                offsets = self._offsets[name]
+                if len(offsets) >= self.limit or not lower.startswith(name_lower, start):
+                    continue
+                end = start + len(name_lower)
+                if end < text_len and _is_word_char(lower[end]):
+                    continue
+                offsets.append((start, end))
+                if len(offsets) == self.limit:
+                    pending -= 1
+            if pending == 0:
+                break
+
+    def _scan(self, name):
+        """Поиск упоминаний одного понятия (для понятий, не попавших в индекс)"""
+        if not self._same_length:
+            pattern = r"(?i)(?<!\w)" + re.escape(name) + r"(?!\w)"
+            return [m.span() for m in re.finditer(pattern, self.text)][:self.limit]
+
+        name_lower = name.lower()
+        if not name_lower:
+            return []
+        offsets = []
+        start = self._lower.find(name_lower)
+        while start != -1 and len(offsets) < self.limit:
+            end = start + len(name_lower)
+            before_ok = start == 0 or not _is_word_char(self._lower[start - 1])
+            after_ok = end == len(self._lower) or not _is_word_char(self._lower[end])
+            if before_ok and after_ok:
+                offsets.append((start, end))
+            start = self._lower.find(name_lower, start + 1)
+        return offsets
+
+    def offsets(self, name):
+        """Возвращает список (начало, конец) первых упоминаний понятия"""
+        if name not in self._offsets:
+            self._offsets[name] = self._scan(name)
+        return self._offsets[name]
+
+    def contexts(self, name):
+        """Возвращает фрагменты текста вокруг первых упоминаний понятия"""
+        return [
+            self.text[max(0, start - self.window):min(len(self.text), end + self.window)]
+            for start, end in self.offsets(name)
+        ]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Файл, в который при завершении запуска записываются метрики (.json или .prom)
+METRICS_FILE = os.getenv("METRICS_FILE")
+
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = "course_adapter"
+
+class Metrics:
+    """
+    Замеры времени этапов (span) и счетчики событий за один запуск скрипта.
+
+    Для каждого этапа накапливаются количество, суммарное и максимальное время.
+    Вложенные этапы считаются отдельно, поэтому их время может пересекаться.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._spans = {}
+        self._counters = {}
+
+    @contextmanager
+    def span(self, name):
+        """Замеряет время выполнения блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        """Добавляет замер этапа, выполненный вручную"""
+        with self._lock:
+            stats = self._spans.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def sleep(self, seconds, name="sleep"):
+        """time.sleep, время которого учитывается как отдельный этап"""
+        with self.span(name):
+            time.sleep(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started_at": self._started,
+                "wall_time": time.time() - self._started,
+                "spans": {name: dict(stats) for name, stats in self._spans.items()},
+                "counters": dict(self._counters),
+            }
+
+    def summary(self):
+        """Текстовая сводка по этапам (по убыванию суммарного времени) и счетчикам"""
+        data = self.snapshot()
+        lines = [f"Метрики запуска (общее время {data['wall_time']:.1f} с):"]
+        spans = sorted(data["spans"].items(), key=lambda item: item[1]["total"], reverse=True)
+        for name, stats in spans:
+            average = stats["total"] / stats["count"] if stats["count"] else 0.0
+            lines.append(f"  {name:<28} {stats['count']:>7} раз  {stats['total']:>9.2f} с  "
+                         f"сред. {average:.3f} с  макс. {stats['max']:.3f} с")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"  {name:<28} {value:>7}")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        data = self.snapshot()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_wall_time_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_wall_time_seconds {data['wall_time']:.6f}",
+            f"# TYPE {PROMETHEUS_PREFIX}_span_seconds_total counter",
+        ]
+        for name, stats in sorted(data["spans"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_span_seconds_total{{span="{name}"}} {stats["total"]:.6f}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_span_count_total counter")
+        for name, stats in sorted(data["spans"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_span_count_total{{span="{name}"}} {stats["count"]}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_span_max_seconds gauge")
+        for name, stats in sorted(data["spans"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_span_max_seconds{{span="{name}"}} {stats["max"]:.6f}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_events_total counter")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Записывает метрики в файл: .prom - формат Prometheus, иначе JSON"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+# Общие метрики процесса
+metrics = Metrics()
+span = metrics.span
+observe = metrics.observe
+count = metrics.count
+sleep = metrics.sleep
+
+_neo4j_instrumented = False
+
+def instrument_neo4j():
+    """
+    Замеряет все обращения к Neo4j через py2neo: каждый запрос (graph.run, create, push,
+    nodes.match и запросы в явных транзакциях) проходит через Transaction.run,
+    а фиксация явных транзакций - через Graph.commit
+    """
+    global _neo4j_instrumented
+    if _neo4j_instrumented:
+        return
+    from py2neo.database import Graph, Transaction
+
+    def timed(method, name):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return method(*args, **kwargs)
+        return wrapper
+
+    Transaction.run = timed(Transaction.run, "neo4j.query")
+    Graph.commit = timed(Graph.commit, "neo4j.commit")
+    _neo4j_instrumented = True
+
+def report(metrics_file=None):
+    """Печатает сводку метрик и, если указан файл, записывает метрики в него"""
+    print("\n" + metrics.summary())
+    metrics_file = metrics_file or METRICS_FILE
+    if metrics_file:
+        try:
+            metrics.write(metrics_file)
+            print(f"Метрики сохранены в {metrics_file}")
+        except OSError as e:
+            print(f"Не удалось сохранить метрики в {metrics_file}: {str(e)}")
+
+def setup(metrics_file=None):
+    """Включает замеры Neo4j и вывод сводки метрик при завершении скрипта"""
+    instrument_neo4j()
+    atexit.register(report, metrics_file)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import argparse
+from py2neo import Graph
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Конфигурация подключения к Neo4j
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
+
+# Ограничения уникальности: (имя, метка, свойство).
+# Понятия и курсы ищутся и объединяются (MERGE) по имени, поэтому имя должно быть уникальным.
+CONSTRAINTS = [
+    ("concept_name_unique", "Concept", "name"),
+    ("course_name_unique", "Course", "name"),
+]
+
+# Индексы: (имя, метка, свойства).
+# Главы создаются заново при каждой загрузке курса, поэтому для них только индекс без уникальности.
+# Индексы по updated_at нужны для инкрементных резервных копий.
+INDEXES = [
+    ("chapter_course_title", "Chapter", ("course", "title")),
+    ("theme_course", "Theme", ("course",)),
+    ("course_updated_at", "Course", ("updated_at",)),
+    ("chapter_updated_at", "Chapter", ("updated_at",)),
+    ("concept_updated_at", "Concept", ("updated_at",)),
+]
+
+def updated_at_now():
+    """
+    Значение свойства updated_at, которое ставится узлам и связям при каждой записи:
+    миллисекунды с начала эпохи по часам машины, на которой работают скрипты
+    """
+    return int(time.time() * 1000)
+
+def _constraint_queries(name, label, prop):
+    """Варианты запроса создания ограничения: синтаксис Neo4j 4.4+/5 и более старый синтаксис 4.x"""
+    return [
+        f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE",
+        f"CREATE CONSTRAINT {name} IF NOT EXISTS ON (n:{label}) ASSERT n.{prop} IS UNIQUE",
+    ]
+
+def _index_queries(name, label, props):
+    """Варианты запроса создания индекса (синтаксис FOR ... ON поддерживается с Neo4j 4.0)"""
+    props_cypher = ", ".join(f"n.{prop}" for prop in props)
+    return [f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON ({props_cypher})"]
+
+def _run_first_supported(graph, queries):
+    """Выполняет первый вариант запроса, который поддерживает сервер"""
+    last_error = None
+    for query in queries:
+        try:
+            graph.run(query)
+            return
+        except Exception as e:
+            last_error = e
+    raise last_error
+
+def get_existing_indexes(graph):
+    """Возвращает множество (метка, свойства) для индексов в базе, включая индексы ограничений уникальности"""
+    existing = set()
+    for record in graph.run("SHOW INDEXES YIELD labelsOrTypes, properties").data():
+        labels = record.get("labelsOrTypes") or []
+        props = tuple(record.get("properties") or [])
+        for label in labels:
+            existing.add((label, props))
+    return existing
+
+def ensure_schema(graph=None):
+    """
+    Создает ограничения уникальности и индексы, если их еще нет.
+    Повторный вызов ничего не меняет.
+
+    Возвращает True, если вся схема создана
+    """
+    if graph is None:
+        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+    success = True
+    for name, label, prop in CONSTRAINTS:
+        try:
+            _run_first_supported(graph, _constraint_queries(name, label, prop))
+        except Exception as e:
+            # Обычно это значит, что в базе уже есть узлы с одинаковым значением свойства
+            print(f"Не удалось создать ограничение уникальности {label}.{prop}: {str(e)}")
+            success = False
+
+    for name, label, props in INDEXES:
+        try:
+            _run_first_supported(graph, _index_queries(name, label, props))
+        except Exception as e:
+            print(f"Не удалось создать индекс {label}({', '.join(props)}): {str(e)}")
+            success = False
+
+    if success:
+        print("Ограничения и индексы Neo4j на месте")
+    return success
+
+def find_missing_schema(graph=None):
+    """Возвращает список описаний отсутствующих ограничений и индексов"""
+    if graph is None:
+        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+    existing = get_existing_indexes(graph)
+    missing = []
+    for _, label, prop in CONSTRAINTS:
+        if (label, (prop,)) not in existing:
+            missing.append(f"ограничение уникальности {label}.{prop}")
+    for _, label, props in INDEXES:
+        if (label, tuple(props)) not in existing:
+            missing.append(f"индекс {label}({', '.join(props)})")
+    return missing
+
+def warn_if_schema_missing(graph=None):
+    """Печатает предупреждение, если в базе нет нужных ограничений или индексов"""
+    try:
+        missing = find_missing_schema(graph)
+    except Exception as e:
+        print(f"Не удалось проверить схему Neo4j: {str(e)}")
+        return False
+
+    if missing:
+        print(f"Предупреждение: в Neo4j отсутствуют {', '.join(missing)}.")
+        print("Поиск понятий и курсов будет медленным. Создайте схему командой: python neo4j_schema.py ensure")
+        return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление ограничениями и индексами Neo4j")
+    parser.add_argument("command", choices=["ensure", "check"], nargs="?", default="ensure",
+                        help="ensure - создать ограничения и индексы, check - проверить их наличие")
+    args = parser.parse_args()
+
+    graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    if args.command == "ensure":
+        ensure_schema(graph)
+    elif warn_if_schema_missing(graph):
+        print("Все ограничения и индексы на месте")
+
+if __name__ == "__main__":
+    main()
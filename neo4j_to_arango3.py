@@ -3,9 +3,10 @@
 
 import os
 import json
-import time
 import re
 import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from py2neo import Graph as Neo4jGraph
 from arango import ArangoClient
 from dotenv import load_dotenv
@@ -23,15 +24,20 @@ ARANGO_HOST = os.getenv("ARANGO_HOST", "http://localhost:8529")
 ARANGO_USER = os.getenv("ARANGO_USER", "root")
 ARANGO_PASSWORD = os.getenv("ARANGO_PASSWORD", "12345678")
 ARANGO_DB = os.getenv("ARANGO_DB", "adapter_course")
+# Количество документов в одном запросе массового импорта
+ARANGO_BATCH_SIZE = int(os.getenv("ARANGO_BATCH_SIZE", "1000"))
+# Количество записей в одной странице чтения из Neo4j
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
 
 def generate_safe_key(text, max_length=64):
     """
     Генерирует безопасный ключ для ArangoDB
     Если после очистки ключ пустой или содержит только подчеркивания,
-    добавляет хеш от оригинального текста
+    добавляет хеш от оригинального текста.
+    Для одного и того же текста всегда возвращает один и тот же ключ
     """
     if not text:
-        return f"key_{time.time_ns()}"
+        return "key_empty"
     
     # Заменяем недопустимые символы на подчеркивания
     key = re.sub(r'[^a-zA-Z0-9_\-:]', '_', text)
@@ -48,75 +54,105 @@ def generate_safe_key(text, max_length=64):
     
     return key
 
-def export_from_neo4j():
-    """Экспорт данных из Neo4j, но с другим подходом к запросам"""
+# Запросы экспорта в порядке загрузки: сначала узлы (ребрам нужны их ключи), затем связи.
+# Каждый запрос читает одну страницу после курсора $after, упорядочивая записи по id,
+# поэтому ключи с суффиксами (_2, _3) не меняются между запусками.
+# Концы связей передаются их id в Neo4j: названия глав повторяются (в разных курсах
+# и при повторной загрузке курса), поэтому по названию конец связи определить нельзя
+EXPORT_QUERIES = [
+    ("courses", "курсов", """
+        MATCH (c:Course) WHERE id(c) > $after
+        RETURN id(c) as cursor, c.name as name, c.description as description
+        ORDER BY id(c) LIMIT $page_size
+    """),
+    ("chapters", "глав", """
+        MATCH (ch:Chapter) WHERE id(ch) > $after
+        RETURN id(ch) as cursor, ch.title as title, ch.description as description, ch.course as course
+        ORDER BY id(ch) LIMIT $page_size
+    """),
+    ("concepts", "понятий", """
+        MATCH (c:Concept) WHERE id(c) > $after
+        RETURN id(c) as cursor, c.name as name, c.definition as definition, c.example as example, c.questions as questions
+        ORDER BY id(c) LIMIT $page_size
+    """),
+    ("chapter_course", "связей между главами и курсами", """
+        MATCH (ch:Chapter)-[r:PART_OF]->(c:Course) WHERE id(r) > $after
+        RETURN id(r) as cursor, id(ch) as source_id, id(c) as target_id,
+               ch.title as chapter_title, c.name as course_name, type(r) as relationship_type, r.description as description
+        ORDER BY id(r) LIMIT $page_size
+    """),
+    ("concept_course", "связей между понятиями и курсами", """
+        MATCH (c:Concept)-[r:PART_OF]->(course:Course) WHERE id(r) > $after
+        RETURN id(r) as cursor, id(c) as source_id, id(course) as target_id,
+               c.name as concept_name, course.name as course_name, type(r) as relationship_type, r.description as description
+        ORDER BY id(r) LIMIT $page_size
+    """),
+    ("concept_chapter", "связей между понятиями и главами", """
+        MATCH (c:Concept)-[r:MENTIONED_IN]->(ch:Chapter) WHERE id(r) > $after
+        RETURN id(r) as cursor, id(c) as source_id, id(ch) as target_id,
+               c.name as concept_name, ch.title as chapter_title, type(r) as relationship_type, r.description as description
+        ORDER BY id(r) LIMIT $page_size
+    """),
+    ("concept_concept", "связей между понятиями", """
+        MATCH (c1:Concept)-[r]->(c2:Concept) WHERE id(r) > $after
+        RETURN id(r) as cursor, id(c1) as source_id, id(c2) as target_id,
+               c1.name as source_name, c2.name as target_name, type(r) as relationship_type, r.description as description
+        ORDER BY id(r) LIMIT $page_size
+    """),
+]
+
+def iter_pages(neo4j, query, page_size):
+    """Постранично выполняет запрос с курсором по id и возвращает страницы записей"""
+    after = -1
+    while True:
+        page = neo4j.run(query, after=after, page_size=page_size).data()
+        if page:
+            yield page
+        if len(page) < page_size:
+            break
+        after = page[-1]["cursor"]
+
+def iter_export_pages(neo4j, page_size):
+    """Возвращает пары (вид записей, страница) для всех запросов экспорта по порядку"""
+    for kind, title, query in EXPORT_QUERIES:
+        total = 0
+        for page in iter_pages(neo4j, query, page_size):
+            total += len(page)
+            yield kind, page
+        print(f"Найдено {total} {title}")
+
+def export_from_neo4j(page_size=EXPORT_PAGE_SIZE):
+    """
+    Экспорт данных из Neo4j.
+
+    Возвращает генератор пар (вид записей, страница записей); данные читаются
+    постранично по мере загрузки в ArangoDB и целиком в памяти не хранятся.
+    При ошибке подключения возвращает None
+    """
     try:
         neo4j = Neo4jGraph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        neo4j.run("RETURN 1").evaluate()
         print(f"Соединение с Neo4j установлено: {NEO4J_URI}")
     except Exception as e:
         print(f"Ошибка подключения к Neo4j: {str(e)}")
         return None
     
-    # Получаем все курсы с их свойствами
-    courses = neo4j.run("""
-        MATCH (c:Course)
-        RETURN c.name as name, c.description as description
-    """).data()
-    print(f"Найдено {len(courses)} курсов")
-    
-    # Получаем все главы с их свойствами
-    chapters = neo4j.run("""
-        MATCH (ch:Chapter)
-        RETURN ch.title as title, ch.description as description, ch.course as course
-    """).data()
-    print(f"Найдено {len(chapters)} глав")
-    
-    # Получаем все понятия с их свойствами
-    concepts = neo4j.run("""
-        MATCH (c:Concept)
-        RETURN c.name as name, c.definition as definition, c.example as example, c.questions as questions
-    """).data()
-    print(f"Найдено {len(concepts)} понятий")
-    
-    # Получаем связи "глава - курс"
-    chapter_course_rel = neo4j.run("""
-        MATCH (ch:Chapter)-[r:PART_OF]->(c:Course)
-        RETURN ch.title as chapter_title, c.name as course_name, type(r) as relationship_type, r.description as description
-    """).data()
-    print(f"Найдено {len(chapter_course_rel)} связей между главами и курсами")
-    
-    # Получаем связи "понятие - курс"
-    concept_course_rel = neo4j.run("""
-        MATCH (c:Concept)-[r:PART_OF]->(course:Course)
-        RETURN c.name as concept_name, course.name as course_name, type(r) as relationship_type, r.description as description
-    """).data()
-    print(f"Найдено {len(concept_course_rel)} связей между понятиями и курсами")
-    
-    # Получаем связи "понятие - глава"
-    concept_chapter_rel = neo4j.run("""
-        MATCH (c:Concept)-[r:MENTIONED_IN]->(ch:Chapter)
-        RETURN c.name as concept_name, ch.title as chapter_title, type(r) as relationship_type, r.description as description
-    """).data()
-    print(f"Найдено {len(concept_chapter_rel)} связей между понятиями и главами")
-    
-    # Получаем связи между понятиями
-    concept_concept_rel = neo4j.run("""
-        MATCH (c1:Concept)-[r]->(c2:Concept)
-        RETURN c1.name as source_name, c2.name as target_name, type(r) as relationship_type, r.description as description
-    """).data()
-    print(f"Найдено {len(concept_concept_rel)} связей между понятиями")
-    
-    return {
-        "courses": courses,
-        "chapters": chapters,
-        "concepts": concepts,
-        "relationships": {
-            "chapter_course": chapter_course_rel,
-            "concept_course": concept_course_rel,
-            "concept_chapter": concept_chapter_rel,
-            "concept_concept": concept_concept_rel
-        }
-    }
+    return iter_export_pages(neo4j, page_size)
+
+def read_ahead(pages):
+    """
+    Читает следующую страницу в отдельном потоке, пока обрабатывается текущая,
+    чтобы чтение из Neo4j шло одновременно с записью в ArangoDB.
+    В памяти одновременно находится не больше двух страниц
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(next, pages, None)
+        while True:
+            page = future.result()
+            if page is None:
+                break
+            future = executor.submit(next, pages, None)
+            yield page
 
 def setup_arango():
     """Настройка и подключение к ArangoDB"""
@@ -154,228 +190,233 @@ def setup_arango():
     
     return db
 
-def import_to_arango(neo4j_data):
-    """Импорт данных в ArangoDB"""
+def unique_key(base_key, used_keys):
+    """Возвращает ключ, которого еще нет среди used_keys (при совпадении добавляет суффикс _2, _3, ...)"""
+    key = base_key
+    suffix = 2
+    while key in used_keys:
+        key = f"{base_key}_{suffix}"
+        suffix += 1
+    used_keys.add(key)
+    return key
+
+def content_hash(document):
+    """Хеш содержимого документа (без _key), по которому синхронизация определяет изменения"""
+    payload = {k: v for k, v in document.items() if k not in ("_key", "content_hash")}
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+def load_content_hashes(db, collection_name):
+    """Возвращает {ключ: хеш содержимого} для всех документов коллекции"""
+    cursor = db.aql.execute(
+        "FOR d IN @@collection RETURN [d._key, d.content_hash]",
+        bind_vars={"@collection": collection_name},
+        batch_size=ARANGO_BATCH_SIZE
+    )
+    return {key: digest for key, digest in cursor}
+
+def import_documents(collection, documents, title, existing_hashes=None):
+    """
+    Отправляет документы в коллекцию пакетами через import_bulk.
+
+    Если передан existing_hashes (синхронизация), отправляются только новые и измененные
+    документы, а существующие документы с тем же ключом заменяются.
+    Возвращает количество записанных документов.
+    """
+    changed = []
+    for document in documents:
+        document["content_hash"] = content_hash(document)
+        if existing_hashes is None or existing_hashes.get(document["_key"]) != document["content_hash"]:
+            changed.append(document)
+
+    written = 0
+    for i in range(0, len(changed), ARANGO_BATCH_SIZE):
+        batch = changed[i:i + ARANGO_BATCH_SIZE]
+        result = collection.import_bulk(batch, halt_on_error=False, details=True, on_duplicate="replace")
+        written += result.get("created", 0) + result.get("updated", 0)
+        errors = result.get("errors", 0)
+        if errors:
+            print(f"Не удалось импортировать {errors} ({title})")
+        for detail in result.get("details", [])[:10]:
+            print(f"Ошибка при импорте ({title}): {detail}")
+    return written
+
+def delete_orphans(collection, existing_hashes, current_keys, title):
+    """Удаляет документы, которых больше нет в Neo4j. Возвращает количество удаленных"""
+    orphans = [{"_key": key} for key in existing_hashes if key not in current_keys]
+    for i in range(0, len(orphans), ARANGO_BATCH_SIZE):
+        collection.delete_many(orphans[i:i + ARANGO_BATCH_SIZE])
+    if orphans:
+        print(f"Удалено {len(orphans)} устаревших ({title})")
+    return len(orphans)
+
+def course_document(course, key):
+    return {
+        "_key": key,
+        "name": course["name"],
+        "description": course.get("description", ""),
+        "node_type": "Course"
+    }
+
+def chapter_document(chapter, key):
+    return {
+        "_key": key,
+        "title": chapter["title"],
+        "description": chapter.get("description", ""),
+        "course": chapter.get("course", ""),
+        "node_type": "Chapter"
+    }
+
+def concept_document(concept, key):
+    return {
+        "_key": key,
+        "name": concept["name"],
+        "definition": concept.get("definition", ""),
+        "example": concept.get("example", ""),
+        "questions": concept.get("questions", []),
+        "node_type": "Concept"
+    }
+
+# Виды узлов: коллекция, поле с именем, построитель документа
+NODE_KINDS = {
+    "courses": ("courses", "name", course_document),
+    "chapters": ("chapters", "title", chapter_document),
+    "concepts": ("concepts", "name", concept_document),
+}
+
+# Виды связей: (коллекция и поле с именем начала, коллекция и поле с именем конца, название, сохранять имена концов)
+EDGE_KINDS = {
+    "chapter_course": ("chapters", "chapter_title", "courses", "course_name", "глава-курс", False),
+    "concept_course": ("concepts", "concept_name", "courses", "course_name", "понятие-курс", False),
+    "concept_chapter": ("concepts", "concept_name", "chapters", "chapter_title", "понятие-глава", False),
+    "concept_concept": ("concepts", "source_name", "concepts", "target_name", "понятие-понятие", True),
+}
+
+COLLECTION_TITLES = {"courses": "курсы", "chapters": "главы", "concepts": "понятия", "edges": "связи"}
+
+def build_edges(rels, from_keys, from_collection, from_field, to_keys, to_collection, to_field, title,
+                used_keys, extra_fields=False):
+    """
+    Строит документы ребер для одного вида связей по словарям соответствий id узлов в Neo4j и ключей
+    (имена концов используются только в сообщениях и дополнительных полях).
+    Ключ ребра выводится из ключей концов и типа связи, поэтому не меняется между запусками.
+    Возвращает список ребер и количество связей, для которых не найдены ключи
+    """
+    edges = []
+    missing = 0
+    for rel in rels:
+        from_key = from_keys.get(rel["source_id"])
+        to_key = to_keys.get(rel["target_id"])
+        if not from_key or not to_key:
+            missing += 1
+            if missing <= 10:
+                print(f"Не найдены ключи для связи {title}: '{rel[from_field]}' - '{rel[to_field]}'")
+            continue
+        edge_from = f"{from_collection}/{from_key}"
+        edge_to = f"{to_collection}/{to_key}"
+        edge = {
+            "_key": unique_key(generate_safe_key(f"{edge_from}-{rel['relationship_type']}-{edge_to}"), used_keys),
+            "_from": edge_from,
+            "_to": edge_to,
+            "type": rel["relationship_type"],
+            "description": rel.get("description", "")
+        }
+        if extra_fields:
+            edge["source_name"] = rel[from_field]
+            edge["target_name"] = rel[to_field]
+        edges.append(edge)
+    return edges, missing
+
+def import_to_arango(pages, full=False):
+    """
+    Импорт данных в ArangoDB.
+
+    Принимает поток страниц (вид записей, записи) из export_from_neo4j: каждая страница
+    сразу превращается в документы и отправляется пакетами через import_bulk, а следующая
+    страница в это время читается из Neo4j. В памяти хранятся только соответствия id узлов
+    в Neo4j и ключей, а не сами данные.
+
+    По умолчанию выполняется синхронизация: ключи детерминированы, в базу записываются
+    только новые и измененные документы (по хешу содержимого), а документы, которых
+    больше нет в Neo4j, удаляются. Коллекции при этом не очищаются и остаются доступны.
+    При full=True коллекции очищаются и загружаются заново.
+    """
     # Настраиваем ArangoDB
     db = setup_arango()
     
     # Получаем коллекции
-    courses_collection = db.collection("courses")
-    chapters_collection = db.collection("chapters")
-    concepts_collection = db.collection("concepts")
-    edges_collection = db.collection("edges")
-    
-    # Очищаем коллекции перед импортом
-    courses_collection.truncate()
-    chapters_collection.truncate()
-    concepts_collection.truncate()
-    edges_collection.truncate()
-    
-    # Словари для хранения соответствий между именами и ключами
-    course_keys = {}
-    chapter_keys = {}
-    concept_keys = {}
-    
-    # Импортируем курсы
-    print("Импорт курсов...")
-    for course in neo4j_data["courses"]:
-        # Генерируем безопасный ключ
-        course_key = generate_safe_key(course["name"])
-        
-        document = {
-            "_key": course_key,
-            "name": course["name"],
-            "description": course.get("description", ""),
-            "node_type": "Course"
-        }
-        
-        try:
-            courses_collection.insert(document)
-            course_keys[course["name"]] = course_key
-        except Exception as e:
-            print(f"Ошибка при вставке курса {course['name']}: {str(e)}")
-            # Генерируем уникальный ключ на основе timestamp
-            course_key = f"course_{time.time_ns()}"
-            document["_key"] = course_key
-            courses_collection.insert(document)
-            course_keys[course["name"]] = course_key
-    
-    # Импортируем главы
-    print("Импорт глав...")
-    for chapter in neo4j_data["chapters"]:
-        # Генерируем безопасный ключ
-        chapter_key = generate_safe_key(chapter["title"])
-        
-        document = {
-            "_key": chapter_key,
-            "title": chapter["title"],
-            "description": chapter.get("description", ""),
-            "course": chapter.get("course", ""),
-            "node_type": "Chapter"
-        }
-        
-        try:
-            chapters_collection.insert(document)
-            chapter_keys[chapter["title"]] = chapter_key
-        except Exception as e:
-            print(f"Ошибка при вставке главы {chapter['title']}: {str(e)}")
-            # Генерируем уникальный ключ на основе timestamp
-            chapter_key = f"chapter_{time.time_ns()}"
-            document["_key"] = chapter_key
-            chapters_collection.insert(document)
-            chapter_keys[chapter["title"]] = chapter_key
+    collections = {name: db.collection(name) for name in ("courses", "chapters", "concepts", "edges")}
     
-    # Импортируем понятия
-    print("Импорт понятий...")
-    for concept in neo4j_data["concepts"]:
-        # Генерируем безопасный ключ
-        concept_key = generate_safe_key(concept["name"])
-        
-        document = {
-            "_key": concept_key,
-            "name": concept["name"],
-            "definition": concept.get("definition", ""),
-            "example": concept.get("example", ""),
-            "questions": concept.get("questions", []),
-            "node_type": "Concept"
-        }
+    existing_hashes = {}
+    if full:
+        # Очищаем коллекции перед импортом
+        for collection in collections.values():
+            collection.truncate()
+    else:
+        for name in collections:
+            existing_hashes[name] = load_content_hashes(db, name)
+    
+    # Соответствия между id узлов в Neo4j и ключами, использованные ключи и счетчики по коллекциям
+    id_keys = {name: {} for name in NODE_KINDS}
+    current_keys = {name: set() for name in collections}
+    written = {name: 0 for name in collections}
+    total = {name: 0 for name in collections}
+    missing_edges = 0
+    
+    for kind, rows in read_ahead(pages):
+        if kind in NODE_KINDS:
+            collection_name, name_field, make_document = NODE_KINDS[kind]
+            documents = []
+            for row in rows:
+                # Генерируем безопасный ключ, уникальный в коллекции
+                key = unique_key(generate_safe_key(row[name_field]), current_keys[collection_name])
+                documents.append(make_document(row, key))
+                id_keys[collection_name][row["cursor"]] = key
+        else:
+            from_collection, from_field, to_collection, to_field, title, extra_fields = EDGE_KINDS[kind]
+            collection_name = "edges"
+            documents, missing = build_edges(rows, id_keys[from_collection], from_collection, from_field,
+                                             id_keys[to_collection], to_collection, to_field, title,
+                                             current_keys["edges"], extra_fields=extra_fields)
+            missing_edges += missing
         
-        try:
-            concepts_collection.insert(document)
-            concept_keys[concept["name"]] = concept_key
-        except Exception as e:
-            print(f"Ошибка при вставке понятия {concept['name']}: {str(e)}")
-            # Генерируем уникальный ключ на основе timestamp
-            concept_key = f"concept_{time.time_ns()}"
-            document["_key"] = concept_key
-            concepts_collection.insert(document)
-            concept_keys[concept["name"]] = concept_key
-    
-    # Импортируем связи "глава - курс"
-    print("Импорт связей между главами и курсами...")
-    for rel in neo4j_data["relationships"]["chapter_course"]:
-        try:
-            # Получаем ключи из словарей соответствий
-            chapter_key = chapter_keys.get(rel["chapter_title"])
-            course_key = course_keys.get(rel["course_name"])
-            
-            if chapter_key and course_key:
-                edge = {
-                    "_from": f"chapters/{chapter_key}",
-                    "_to": f"courses/{course_key}",
-                    "type": rel["relationship_type"],
-                    "description": rel.get("description", "")
-                }
-                
-                edges_collection.insert(edge)
-            else:
-                print(f"Не найдены ключи для связи глава '{rel['chapter_title']}' - курс '{rel['course_name']}'")
-                
-        except Exception as e:
-            print(f"Ошибка при вставке связи глава-курс: {str(e)}")
-    
-    # Импортируем связи "понятие - курс"
-    print("Импорт связей между понятиями и курсами...")
-    for rel in neo4j_data["relationships"]["concept_course"]:
-        try:
-            # Получаем ключи из словарей соответствий
-            concept_key = concept_keys.get(rel["concept_name"])
-            course_key = course_keys.get(rel["course_name"])
-            
-            if concept_key and course_key:
-                edge = {
-                    "_from": f"concepts/{concept_key}",
-                    "_to": f"courses/{course_key}",
-                    "type": rel["relationship_type"],
-                    "description": rel.get("description", "")
-                }
-                
-                edges_collection.insert(edge)
-            else:
-                print(f"Не найдены ключи для связи понятие '{rel['concept_name']}' - курс '{rel['course_name']}'")
-                
-        except Exception as e:
-            print(f"Ошибка при вставке связи понятие-курс: {str(e)}")
-    
-    # Импортируем связи "понятие - глава"
-    print("Импорт связей между понятиями и главами...")
-    for rel in neo4j_data["relationships"]["concept_chapter"]:
-        try:
-            # Получаем ключи из словарей соответствий
-            concept_key = concept_keys.get(rel["concept_name"])
-            chapter_key = chapter_keys.get(rel["chapter_title"])
-            
-            if concept_key and chapter_key:
-                edge = {
-                    "_from": f"concepts/{concept_key}",
-                    "_to": f"chapters/{chapter_key}",
-                    "type": rel["relationship_type"],
-                    "description": rel.get("description", "")
-                }
-                
-                edges_collection.insert(edge)
-            else:
-                print(f"Не найдены ключи для связи понятие '{rel['concept_name']}' - глава '{rel['chapter_title']}'")
-                
-        except Exception as e:
-            print(f"Ошибка при вставке связи понятие-глава: {str(e)}")
-    
-    # Импортируем связи между понятиями
-    print("Импорт связей между понятиями...")
-    successful_edges = 0
-    failed_edges = 0
-    
-    for rel in neo4j_data["relationships"]["concept_concept"]:
-        try:
-            # Получаем ключи из словарей соответствий
-            source_key = concept_keys.get(rel["source_name"])
-            target_key = concept_keys.get(rel["target_name"])
-            
-            if source_key and target_key:
-                edge = {
-                    "_from": f"concepts/{source_key}",
-                    "_to": f"concepts/{target_key}",
-                    "type": rel["relationship_type"],
-                    "description": rel.get("description", ""),
-                    "source_name": rel["source_name"],
-                    "target_name": rel["target_name"]
-                }
-                
-                edges_collection.insert(edge)
-                successful_edges += 1
-            else:
-                failed_edges += 1
-                if failed_edges < 10:
-                    print(f"Не найдены ключи для связи понятие '{rel['source_name']}' - понятие '{rel['target_name']}'")
-                
-        except Exception as e:
-            failed_edges += 1
-            if failed_edges < 10:  # Ограничим количество выводимых ошибок
-                print(f"Ошибка при вставке связи понятие-понятие: {str(e)}")
-    
-    print(f"Успешно импортировано {successful_edges} связей между понятиями")
-    if failed_edges > 0:
-        print(f"Не удалось импортировать {failed_edges} связей между понятиями")
+        total[collection_name] += len(documents)
+        written[collection_name] += import_documents(collections[collection_name], documents,
+                                                     COLLECTION_TITLES[collection_name],
+                                                     existing_hashes.get(collection_name))
+    
+    for name, title in COLLECTION_TITLES.items():
+        if full:
+            print(f"Импортировано {written[name]} из {total[name]} ({title})")
+        else:
+            print(f"Записано {written[name]} новых или измененных из {total[name]} ({title})")
+    if missing_edges:
+        print(f"Пропущено {missing_edges} связей без найденных ключей")
+    
+    if not full:
+        # Сначала удаляем ребра, затем узлы, чтобы не оставлять висячих ребер
+        print("Удаление устаревших документов...")
+        for name in ("edges", "concepts", "chapters", "courses"):
+            delete_orphans(collections[name], existing_hashes[name], current_keys[name], COLLECTION_TITLES[name])
     
     print("Импорт завершен!")
     
     # Возвращаем статистику
-    return {
-        "courses": courses_collection.count(),
-        "chapters": chapters_collection.count(),
-        "concepts": concepts_collection.count(),
-        "edges": edges_collection.count()
-    }
+    return {name: collection.count() for name, collection in collections.items()}
 
 def main():
-    print("Начало экспорта данных из Neo4j...")
-    neo4j_data = export_from_neo4j()
+    parser = argparse.ArgumentParser(description="Перенос графа знаний из Neo4j в ArangoDB")
+    parser.add_argument("--full", action="store_true",
+                        help="Очистить коллекции и загрузить все заново вместо синхронизации изменений")
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE,
+                        help=f"Количество записей в странице чтения из Neo4j (по умолчанию {EXPORT_PAGE_SIZE})")
+    args = parser.parse_args()
+
+    pages = export_from_neo4j(page_size=args.page_size)
     
-    if neo4j_data:
-        print("Экспорт из Neo4j завершен успешно.")
-        
-        print("\nНачало импорта данных в ArangoDB...")
-        stats = import_to_arango(neo4j_data)
+    if pages is not None:
+        print("Начало переноса данных из Neo4j в ArangoDB...")
+        stats = import_to_arango(pages, full=args.full)
         
         print("\nИмпорт завершен! Статистика:")
         print(f"Курсы: {stats['courses']}")
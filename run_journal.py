@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+JOURNAL_DIR = os.path.join(os.getenv("RESULTS_DIR", "results"), "journal")
+
+# Состояния единицы работы (главы или понятия)
+ANALYZED = "analyzed"
+PERSISTED = "persisted"
+
+class RunJournal:
+    """
+    Журнал запуска: фиксирует, какие главы или понятия уже проанализированы
+    и какие записаны в Neo4j, чтобы прерванный запуск можно было продолжить.
+
+    Журнал хранится в файле JSON Lines, каждая запись дописывается в конец
+    и сбрасывается на диск сразу, поэтому переживает аварийное завершение.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._states = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Последняя строка могла оборваться при сбое
+                        continue
+                    self._states.setdefault(entry["unit"], {})[entry["state"]] = entry
+
+    @classmethod
+    def for_run(cls, script_name, course_name):
+        """Открывает журнал для пары (скрипт, курс)"""
+        safe_course = re.sub(r"[^\w\-]+", "_", course_name)
+        return cls(os.path.join(JOURNAL_DIR, f"{script_name}_{safe_course}.jsonl"))
+
+    def reset(self):
+        """Начинает журнал заново (запуск без --resume)"""
+        with self._lock:
+            self._states = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def mark(self, unit, state, **info):
+        """Отмечает, что единица работы достигла указанного состояния"""
+        entry = {"unit": unit, "state": state, "time": datetime.now().isoformat()}
+        entry.update(info)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._states.setdefault(unit, {})[state] = entry
+
+    def is_done(self, unit, state):
+        with self._lock:
+            return state in self._states.get(unit, {})
+
+    def get(self, unit, state):
+        """Возвращает запись журнала для единицы работы в указанном состоянии или None"""
+        with self._lock:
+            return self._states.get(unit, {}).get(state)
+
+    def count(self, state):
+        with self._lock:
+            return sum(1 for states in self._states.values() if state in states)
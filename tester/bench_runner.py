@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Запускает скрипт проекта и подсчитывает обращения к Neo4j.
+
+Используется бенчмарком: каждый запрос Cypher (включая graph.create/push и
+graph.nodes.match) проходит через Transaction.run, а фиксация явных транзакций -
+через Graph.commit. Счетчики записываются в файл из BENCH_NEO4J_STATS при выходе.
+
+    python tester/bench_runner.py adapter.py --course "Курс" --file course.txt
+"""
+
+import os
+import sys
+import json
+import runpy
+import atexit
+import threading
+
+from py2neo.database import Graph, Transaction
+
+_lock = threading.Lock()
+_stats = {"queries": 0, "commits": 0}
+
+def _counted(method, counter):
+    def wrapper(*args, **kwargs):
+        with _lock:
+            _stats[counter] += 1
+        return method(*args, **kwargs)
+    return wrapper
+
+def _write_stats():
+    path = os.getenv("BENCH_NEO4J_STATS")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(_stats, f)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python tester/bench_runner.py <скрипт.py> [аргументы скрипта]")
+        sys.exit(1)
+
+    Transaction.run = _counted(Transaction.run, "queries")
+    Graph.commit = _counted(Graph.commit, "commits")
+    atexit.register(_write_stats)
+
+    script = os.path.abspath(sys.argv[1])
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+
+if __name__ == "__main__":
+    main()
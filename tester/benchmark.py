@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Офлайн-бенчмарк всего конвейера: adapter.py и analyze_concepts_in_depth.py
+запускаются на файлах курсов против локальной заглушки LLM (llm_stub_server.py).
+
+Для каждого шага измеряются время выполнения, количество запросов к LLM,
+ошибок, оценка токенов и количество запросов к Neo4j. Нужна только локальная Neo4j,
+ключ OpenRouter не используется. Курсы создаются под отдельными именами
+("Бенчмарк <файл>"), их можно удалить через clean_neo4j.py.
+
+    python tester/benchmark.py --latency 1 --error-rate 0.05
+    python tester/benchmark.py --files course2.txt --steps adapter --output results/bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+import requests
+
+# Добавляем родительскую директорию в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_stub_server import DEFAULT_PORT, add_stub_arguments, state_from_args, start_server
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNER = os.path.join(ROOT_DIR, "tester", "bench_runner.py")
+
+# Шаги конвейера: имя -> (скрипт, функция построения аргументов)
+STEPS = {
+    "adapter": ("adapter.py", lambda course, path: ["--course", course, "--file", path]),
+    "analyze": ("analyze_concepts_in_depth.py", lambda course, path: ["--course", course, "--file", path]),
+}
+
+def run_step(step, course_name, course_file, base_url, extra_env):
+    """Запускает один шаг конвейера и возвращает его метрики"""
+    script, build_args = STEPS[step]
+    stats_fd, stats_path = tempfile.mkstemp(suffix=".json", prefix="bench_neo4j_")
+    os.close(stats_fd)
+
+    env = dict(os.environ)
+    env.update(extra_env)
+    env["BENCH_NEO4J_STATS"] = stats_path
+
+    # Сбрасываем счетчики заглушки перед шагом
+    requests.get(f"{base_url}/stats?reset=1", timeout=10)
+
+    command = [sys.executable, RUNNER, os.path.join(ROOT_DIR, script)] + build_args(course_name, course_file) + ["--no-cache"]
+    print(f"\n=== {step}: {course_file} ===")
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True)
+    wall_time = time.perf_counter() - started
+
+    llm_stats = requests.get(f"{base_url}/stats", timeout=10).json()
+    neo4j_stats = {}
+    try:
+        with open(stats_path, "r", encoding="utf-8") as f:
+            neo4j_stats = json.load(f)
+    except (OSError, ValueError):
+        pass
+    finally:
+        os.remove(stats_path)
+
+    if completed.returncode != 0:
+        # Показываем конец вывода упавшего шага
+        print("\n".join(completed.stdout.splitlines()[-20:]))
+
+    result = {
+        "step": step,
+        "file": course_file,
+        "course": course_name,
+        "exit_code": completed.returncode,
+        "wall_time": round(wall_time, 3),
+        "llm_requests": llm_stats.get("requests", 0),
+        "llm_errors": llm_stats.get("errors", 0),
+        "prompt_tokens": llm_stats.get("prompt_tokens", 0),
+        "completion_tokens": llm_stats.get("completion_tokens", 0),
+        "neo4j_queries": neo4j_stats.get("queries", 0),
+        "neo4j_commits": neo4j_stats.get("commits", 0),
+    }
+    print(f"Время: {result['wall_time']} с, запросов к LLM: {result['llm_requests']} "
+          f"(ошибок: {result['llm_errors']}), токенов: {result['prompt_tokens']} + {result['completion_tokens']}, "
+          f"запросов к Neo4j: {result['neo4j_queries']}")
+    return result
+
+def print_summary(results):
+    print("\nИтоги бенчмарка:")
+    header = f"{'шаг':<10} {'файл':<14} {'время, с':>9} {'LLM':>6} {'ошибки':>7} {'токены':>10} {'Neo4j':>7} {'код':>4}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        tokens = r["prompt_tokens"] + r["completion_tokens"]
+        print(f"{r['step']:<10} {os.path.basename(r['file']):<14} {r['wall_time']:>9.2f} {r['llm_requests']:>6} "
+              f"{r['llm_errors']:>7} {tokens:>10} {r['neo4j_queries']:>7} {r['exit_code']:>4}")
+    print(f"Всего: {sum(r['wall_time'] for r in results):.2f} с")
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера против локальной заглушки LLM")
+    parser.add_argument("--files", nargs="+", default=["course.txt", "course2.txt"], help="Файлы курсов")
+    parser.add_argument("--steps", nargs="+", default=list(STEPS), choices=list(STEPS), help="Шаги конвейера")
+    parser.add_argument("--course-prefix", type=str, default="Бенчмарк", help="Префикс названий курсов в Neo4j")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Порт заглушки")
+    parser.add_argument("--url", type=str,
+                        help="Адрес уже запущенной заглушки (например, http://127.0.0.1:8765); по умолчанию запускается своя")
+    parser.add_argument("--output", type=str, help="Файл JSON для сохранения результатов")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = start_server(state_from_args(args), port=args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"Заглушка LLM запущена на {base_url}")
+
+    extra_env = {
+        "OPENROUTER_URL": f"{base_url}/v1/chat/completions",
+        "OPENROUTER_API_KEY": "stub",
+    }
+
+    results = []
+    try:
+        for course_file in args.files:
+            course_name = f"{args.course_prefix} {os.path.splitext(os.path.basename(course_file))[0]}"
+            for step in args.steps:
+                results.append(run_step(step, course_name, course_file, base_url, extra_env))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print_summary(results)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"time": datetime.now().isoformat(), "settings": vars(args), "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Локальная замена OpenRouter для тестов и бенчмарков без ключа API.
+
+Сервер принимает запросы в формате OpenAI (POST .../chat/completions) и отвечает:
+- записанными ответами из кеша LLM (--replay-cache), если такой запрос уже выполнялся;
+- ответами из файла (--responses), если промпт содержит указанную подстроку;
+- иначе сгенерированным ответом в той структуре JSON, которую ждут скрипты проекта.
+
+Задержка и доля ошибок настраиваются, статистика запросов доступна по GET /stats.
+
+Пример запуска:
+    python tester/llm_stub_server.py --port 8765 --latency 1.5 --error-rate 0.05
+    OPENROUTER_URL=http://127.0.0.1:8765/v1/chat/completions OPENROUTER_API_KEY=stub python adapter.py
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем родительскую директорию в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_cache import open_cache, make_cache_key
+
+DEFAULT_PORT = 8765
+# Размер фрагмента текста в одном событии потокового ответа
+STREAM_CHUNK_CHARS = 40
+
+# Типы связей, которые используются в промптах проекта
+RELATIONSHIP_TYPES = ["RELATES_TO", "PART_OF", "IS_A", "PREREQUISITE_FOR", "USED_IN"]
+
+def estimate_tokens(text):
+    """Грубая оценка количества токенов (около 4 символов на токен)"""
+    return max(1, len(text) // 4)
+
+def load_responses(path):
+    """
+    Читает файл заготовленных ответов в формате JSON Lines:
+    {"match": "подстрока промпта", "content": "текст ответа"}
+    """
+    responses = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                responses.append((entry["match"], entry["content"]))
+    return responses
+
+def _listed_concepts(prompt):
+    """Понятия, перечисленные в промпте анализа главы или группы понятий"""
+    match = re.search(r"основные понятия: (.+?)\.\n", prompt)
+    if not match:
+        match = re.search(r"ключевые понятия:\s*\n\s*- (.+?)\n", prompt)
+    if not match:
+        return []
+    return [name.strip() for name in match.group(1).split(",") if name.strip()]
+
+def _words_from_text(prompt, count):
+    """Понятия для промпта без списка: первые длинные слова из текста главы"""
+    names = []
+    for word in re.findall(r"[А-Яа-яЁё]{7,}", prompt):
+        name = word.lower()
+        if name not in names:
+            names.append(name)
+        if len(names) == count:
+            break
+    return names
+
+def _concept(name):
+    return {
+        "name": name,
+        "definition": f"Определение понятия «{name}» по тексту курса",
+        "example": f"Пример использования понятия «{name}»",
+        "questions": [f"Что такое {name}?", f"Где применяется {name}?"]
+    }
+
+def _concept_details(name, defined_names):
+    data = _concept(name)
+    data["chapter_variations"] = []
+    data["related_concepts"] = [
+        {"name": other, "relationship_type": "RELATES_TO", "description": f"{name} связано с {other}"}
+        for other in [n for n in defined_names if n != name][:3]
+    ]
+    return data
+
+def _relationships(names):
+    return [
+        {
+            "source": source,
+            "target": target,
+            "type": RELATIONSHIP_TYPES[i % len(RELATIONSHIP_TYPES)],
+            "description": f"{source} связано с {target}"
+        }
+        for i, (source, target) in enumerate(zip(names, names[1:]))
+    ]
+
+def generate_response(prompt):
+    """Строит ответ в структуре JSON, которую ожидает скрипт, отправивший промпт"""
+    # Углубленный анализ одного понятия или пакета понятий (analyze_concepts_in_depth.py)
+    match = re.search(r'понятии "(.+?)" в следующем JSON-формате', prompt)
+    packed = re.findall(r'=== Понятие "(.+?)" ===', prompt)
+    if match or packed:
+        defined = re.search(r"используются следующие понятия: (.*)", prompt)
+        defined_names = [n.strip() for n in defined.group(1).split(",") if n.strip()] if defined else []
+        details = [_concept_details(name, defined_names) for name in (packed or [match.group(1)])]
+        if packed:
+            return json.dumps({"concepts": details}, ensure_ascii=False)
+        return json.dumps(details[0], ensure_ascii=False)
+
+    # Выделение глав в курсе без явной структуры (detect_chapters.py)
+    if "логических глав" in prompt:
+        names = _words_from_text(prompt, 24)
+        chapters = [
+            {"title": f"Глава {i + 1}", "description": f"Описание главы {i + 1}", "concepts": names[i::8]}
+            for i in range(8)
+        ]
+        return "```json\n" + json.dumps(chapters, ensure_ascii=False) + "\n```"
+
+    # Анализ главы или группы понятий (adapter.py, detect_chapters.py)
+    names = _listed_concepts(prompt) or _words_from_text(prompt, 10)
+    data = {
+        "main_ideas": ["Первая главная мысль", "Вторая главная мысль", "Третья главная мысль"],
+        "concepts": [_concept(name) for name in names],
+        "relationships": _relationships(names)
+    }
+    return json.dumps(data, ensure_ascii=False)
+
+class StubState:
+    """Настройки сервера и счетчики запросов (общие для всех потоков обработки)"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429,
+                 responses=None, replay_cache=None, seed=None, stream_delay=0.0):
+        self.latency = latency
+        self.stream_delay = stream_delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responses = responses or []
+        self.replay_cache = replay_cache
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "errors": 0,
+                "replayed": 0,
+                "canned": 0,
+                "generated": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "stream_aborted": 0,
+            }
+
+    def count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self.stats[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.latency + jitter)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def find_response(self, payload, prompt):
+        """Возвращает (текст ответа, источник)"""
+        if self.replay_cache is not None:
+            key = make_cache_key(payload.get("model"), prompt, payload.get("max_tokens"), payload.get("temperature"),
+                                 payload.get("response_format"))
+            cached = self.replay_cache.get(key)
+            if cached is not None:
+                return cached, "replayed"
+        for match, content in self.responses:
+            if match in prompt:
+                return content, "canned"
+        return generate_response(prompt), "generated"
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод бенчмарка строкой на каждый запрос
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path.startswith("/stats"):
+            stats = state.snapshot()
+            if "reset=1" in self.path:
+                state.reset()
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        prompt_tokens = estimate_tokens(prompt)
+        state.count(requests=1, prompt_tokens=prompt_tokens)
+
+        time.sleep(state.delay())
+        if state.should_fail():
+            state.count(errors=1)
+            headers = {"Retry-After": "1"} if state.error_status == 429 else None
+            self._send_json(state.error_status, {"error": {"message": "stub error"}}, headers)
+            return
+
+        content, source = state.find_response(payload, prompt)
+        completion_tokens = estimate_tokens(content)
+        state.count(completion_tokens=completion_tokens, **{source: 1})
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if payload.get("stream"):
+            self._send_stream(payload, content, usage)
+            return
+        self._send_json(200, {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _send_stream(self, payload, content, usage):
+        """Отправляет ответ потоком Server-Sent Events фрагментами по STREAM_CHUNK_CHARS символов"""
+        state = self.server.state
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_event(data):
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk_id = f"stub-{time.time_ns()}"
+        try:
+            self.wfile.write(b": stub processing\n\n")
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                if state.stream_delay:
+                    time.sleep(state.stream_delay)
+                send_event(json.dumps({
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "model": payload.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK_CHARS]},
+                                 "finish_reason": None}]
+                }, ensure_ascii=False))
+            send_event(json.dumps({
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "model": payload.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": usage
+            }))
+            send_event("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прервал получение ответа
+            state.count(stream_aborted=1)
+
+def start_server(state, host="127.0.0.1", port=DEFAULT_PORT):
+    """Запускает сервер в фоновом потоке и возвращает его (остановка - server.shutdown())"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def add_stub_arguments(parser):
+    """Общие параметры заглушки для сервера и бенчмарка"""
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа в секундах")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайное отклонение задержки в секундах")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов, завершающихся ошибкой (0..1)")
+    parser.add_argument("--error-status", type=int, default=429, help="Код ответа для ошибок (по умолчанию 429)")
+    parser.add_argument("--responses", type=str, help="Файл JSON Lines с заготовленными ответами")
+    parser.add_argument("--replay-cache", action="store_true",
+                        help="Отвечать записанными ответами из кеша LLM (LLM_CACHE_PATH), если они есть")
+    parser.add_argument("--seed", type=int, default=None, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--stream-delay", type=float, default=0.0,
+                        help="Пауза между фрагментами потокового ответа (stream=true) в секундах")
+
+def state_from_args(args):
+    replay_cache = None
+    if args.replay_cache:
+        replay_cache = open_cache()
+        if replay_cache is None:
+            print("Кеш LLM выключен (LLM_CACHE=off), записанные ответы недоступны")
+    return StubState(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        responses=load_responses(args.responses) if args.responses else None,
+        replay_cache=replay_cache,
+        seed=args.seed,
+        stream_delay=args.stream_delay
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenAI-совместимого API")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Адрес сервера")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Порт сервера (по умолчанию {DEFAULT_PORT})")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(state_from_args(args), args.host, args.port)
+    print(f"Заглушка LLM запущена: http://{args.host}:{args.port}/v1/chat/completions")
+    print(f"Статистика запросов: http://{args.host}:{args.port}/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nОстановка заглушки")
+        print(json.dumps(server.state.snapshot(), ensure_ascii=False, indent=2))
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -15,11 +15,14 @@ NEO4J_URI = "bolt://localhost:7687/system_self_development"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "neo4j"
 
+# Файл курса: из COURSE_FILE или course.txt в корне репозитория
+COURSE_FILE = os.getenv("COURSE_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "course.txt"))
+
 def main():
     print("Начинаем полный анализ второй главы курса...")
     
     # Чтение файла курса
-    course_text = read_course_file("/home/cehovoy/adapter_course/course.txt")
+    course_text = read_course_file(COURSE_FILE)
     print(f"Файл курса успешно прочитан: {len(course_text)} символов")
     
     # Разделение на главы
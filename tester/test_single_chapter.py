@@ -5,12 +5,15 @@ import os
 import time
 from adapter import read_course_file, split_into_chapters, analyze_chapter_with_grok
 
+# Файл курса: из COURSE_FILE или course.txt в корне репозитория
+COURSE_FILE = os.getenv("COURSE_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "course.txt"))
+
 # Основная функция
 def main():
     print("Тестирование анализа первой главы курса...")
     
     # Чтение файла курса
-    course_text = read_course_file("/home/cehovoy/adapter_course/course.txt")
+    course_text = read_course_file(COURSE_FILE)
     print(f"Файл курса успешно прочитан: {len(course_text)} символов")
     
     # Разделение на главы